@@ -0,0 +1,160 @@
+# Latency tracing of samples through the stages of a pipeline
+#
+# A Trace is started when a sample enters the pipeline and carries a monotonic
+# timestamp per stage along with the sample. When the sample leaves the pipeline
+# the trace is handed back to the LatencyTracer, which adds the time spent in
+# every stage and the total to histograms.
+
+import json
+import threading
+import time
+from bisect import bisect_left
+
+# Upper edges of the histogram bins in milliseconds, the last bin is open
+BIN_EDGES_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000]
+
+
+class Trace:
+    __slots__ = ("stamps",)
+
+    def __init__(self):
+        self.stamps = [("start", time.perf_counter())]
+
+    def mark(self, stage):
+        """
+        Record that the sample has finished a stage.
+        :param stage: Name of the stage
+        """
+        self.stamps.append((stage, time.perf_counter()))
+
+
+class _NullTrace:
+    """
+    Trace used when tracing is disabled, marks are ignored.
+    """
+
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0 for _ in range(len(BIN_EDGES_MS) + 1)]
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BIN_EDGES_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, q):
+        """
+        :param q: Percentile, 0..100
+        :return: Upper edge of the bin containing the percentile, max for the open bin
+        """
+        target = self.count * q / 100
+        acc = 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= target and n > 0:
+                return min(BIN_EDGES_MS[i], self.max) if i < len(BIN_EDGES_MS) else self.max
+        return 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.mean(),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": self.max,
+            "bin_edges_ms": BIN_EDGES_MS,
+            "bin_counts": self.counts,
+        }
+
+
+class LatencyTracer:
+    """
+    Collects per-stage and total latency histograms of finished traces.
+    Thread safe, traces may be started and finished in different threads.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: If False, begin() returns NULL_TRACE and nothing is recorded
+        """
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages = {}  # Stage name -> Histogram, in the order stages were first seen
+        self._total = Histogram()
+        self._last_report = time.perf_counter()
+
+    def begin(self):
+        """
+        Start tracing a sample entering the pipeline now.
+        """
+        return Trace() if self.enabled else NULL_TRACE
+
+    def finish(self, trace):
+        """
+        Add a trace whose sample has left the pipeline.
+        """
+        if trace is NULL_TRACE or trace is None:
+            return
+
+        stamps = trace.stamps
+        with self._lock:
+            for (_, t_prev), (stage, t) in zip(stamps, stamps[1:]):
+                hist = self._stages.get(stage)
+                if hist is None:
+                    hist = self._stages[stage] = Histogram()
+                hist.add((t - t_prev) * 1000)
+            self._total.add((stamps[-1][1] - stamps[0][1]) * 1000)
+
+    def summary(self):
+        """
+        :return: Table of the per-stage and total latency
+        """
+        lines = ["{0:<16} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9}".format("stage", "count", "mean(ms)", "p50(ms)", "p95(ms)", "max(ms)")]
+        with self._lock:
+            for stage, hist in list(self._stages.items()) + [("total", self._total)]:
+                lines.append(
+                    "{0:<16} {1:>8} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9.2f}".format(
+                        stage, hist.count, hist.mean(), hist.percentile(50), hist.percentile(95), hist.max
+                    )
+                )
+        return "\n".join(lines)
+
+    def report(self, interval):
+        """
+        Print the summary if at least interval seconds passed since the last report.
+        """
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if now - self._last_report >= interval:
+            self._last_report = now
+            print(self.summary())
+
+    def dump(self, path):
+        """
+        Write the histograms to a JSON file.
+        """
+        with self._lock:
+            data = {
+                "stages": {stage: hist.to_dict() for stage, hist in self._stages.items()},
+                "total": self._total.to_dict(),
+            }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
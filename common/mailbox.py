@@ -0,0 +1,79 @@
+# Latest-value mailbox connecting the stages of a pipeline
+#
+# A mailbox holds a single value. Putting a value replaces the previous one even
+# if nobody has read it yet, so a slow consumer always gets the freshest value
+# and never works through a backlog.
+
+import threading
+import time
+
+
+class MailboxClosed(Exception):
+    pass
+
+
+class LatestValue:
+    """
+    Thread safe mailbox holding only the newest value.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+        self._seq = 0  # Incremented on every put
+        self._read_seq = 0  # Sequence number of the last value taken by get()
+        self._closed = False
+        self.dropped = 0  # Values replaced before they were read
+
+    def put(self, value):
+        """
+        Replace the value and wake up a waiting consumer.
+        """
+        with self._cond:
+            if self._seq != self._read_seq:
+                self.dropped += 1
+            self._value = value
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Wait for a value newer than the one returned by the previous call.
+        :param timeout: Seconds to wait, None waits forever
+        :return: Newest value, None on timeout
+        :raise MailboxClosed: If the mailbox is closed
+        """
+        with self._cond:
+            end_time = None if timeout is None else time.monotonic() + timeout
+            while self._seq == self._read_seq:
+                if self._closed:
+                    raise MailboxClosed()
+                remaining = None if end_time is None else end_time - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+            self._read_seq = self._seq
+            self._cond.notify_all()
+            return self._value
+
+    def wait_read(self, timeout=None):
+        """
+        Wait until the current value is taken by get(), for producers that must not skip values.
+        :param timeout: Seconds to wait, None waits forever
+        :return: True if the value was read or the mailbox is closed, False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq == self._read_seq or self._closed, timeout)
+
+    def close(self):
+        """
+        Wake up all consumers, get() raises MailboxClosed once no new value is left.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
@@ -0,0 +1,130 @@
+# Rolling per-stage timing of a pipeline
+#
+# Every stage keeps the durations of its last few runs, so the mean and p95 follow
+# the current behavior instead of averaging over the whole session. The numbers can
+# be drawn onto a video frame and are logged to a CSV file at a fixed interval.
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageProfiler:
+    """
+    Thread safe, stages may run in different threads.
+    """
+
+    def __init__(self, enabled=True, window=120, csv_path=None, csv_interval=1.0):
+        """
+        :param enabled: If False, nothing is recorded
+        :param window: Number of recent runs per stage the statistics are computed from
+        :param csv_path: CSV file the statistics are logged to, created on the first log() while enabled,
+                         None to disable logging
+        :param csv_interval: Seconds between two logged rows of a stage
+        """
+        self.enabled = enabled
+        self._window = window
+        self._lock = threading.Lock()
+        self._stages = {}  # Stage name -> deque of durations in seconds, in the order stages were first seen
+        self._start_time = time.perf_counter()
+        self._csv_interval = csv_interval
+        self._next_log = self._start_time + csv_interval
+        self._csv_path = csv_path
+        self._csv = None
+
+    def add(self, stage, seconds):
+        """
+        Record one run of a stage.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            durations = self._stages.get(stage)
+            if durations is None:
+                durations = self._stages[stage] = deque(maxlen=self._window)
+            durations.append(seconds)
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Time the body of a with statement as one run of a stage.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t)
+
+    def stats(self):
+        """
+        :return: List of (stage, runs in window, mean in ms, p95 in ms)
+        """
+        with self._lock:
+            items = [(stage, np.array(durations)) for stage, durations in self._stages.items() if durations]
+        return [(stage, len(d), d.mean() * 1000, np.percentile(d, 95) * 1000) for stage, d in items]
+
+    def draw(self, img, origin=(10, 230), color=(0, 255, 255)):
+        """
+        Draw the statistics onto a BGR image.
+        """
+        if not self.enabled:
+            return
+
+        import cv2  # Only needed for drawing
+
+        x, y = origin
+        cv2.putText(img, "{0:<14}{1:>8}{2:>8}".format("stage", "mean", "p95"), (x, y),
+                    cv2.FONT_HERSHEY_PLAIN, 1.2, color, 1)
+        for stage, _, mean, p95 in self.stats():
+            y += 18
+            cv2.putText(img, "{0:<14}{1:>8.2f}{2:>8.2f}".format(stage[:14], mean, p95), (x, y),
+                        cv2.FONT_HERSHEY_PLAIN, 1.2, color, 1)
+
+    def log(self):
+        """
+        Write the statistics to the CSV file if the log interval has passed.
+        """
+        if not self.enabled or self._csv_path is None:
+            return
+
+        now = time.perf_counter()
+        if now < self._next_log:
+            return
+        self._next_log = now + self._csv_interval
+
+        if self._csv is None:
+            self._csv = open(self._csv_path, "w")
+            self._csv.write("time_s,stage,count,mean_ms,p95_ms\n")
+
+        elapsed = now - self._start_time
+        for stage, count, mean, p95 in self.stats():
+            self._csv.write("{0:.3f},{1},{2},{3:.3f},{4:.3f}\n".format(elapsed, stage, count, mean, p95))
+        self._csv.flush()
+
+    def summary(self):
+        """
+        :return: Table of the per-stage statistics
+        """
+        lines = ["{0:<16} {1:>8} {2:>9} {3:>9}".format("stage", "count", "mean(ms)", "p95(ms)")]
+        for stage, count, mean, p95 in self.stats():
+            lines.append("{0:<16} {1:>8} {2:>9.2f} {3:>9.2f}".format(stage, count, mean, p95))
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        Log the final statistics and close the CSV file.
+        """
+        self._next_log = 0
+        self.log()
+        if self._csv is not None:
+            self._csv.close()
+            self._csv = None
+
@@ -0,0 +1,267 @@
+# On-host EMG gesture classification from raw EMG data blocks
+
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import List, Optional
+
+import numpy as np
+
+FEATURES = ["MAV", "RMS", "WL", "ZC"]
+
+# EMG stream and analysis window, shared by training and the demo
+EMG_FS = 500  # Hz
+EMG_NUM_CHANNELS = 8
+WINDOW_MS = 200
+
+# Minimum step between samples counted as a zero crossing, in ADC units, to ignore noise
+ZC_THRESHOLD = 2.0
+
+
+def extract_features(windows: np.ndarray, zc_threshold=ZC_THRESHOLD) -> np.ndarray:
+    """
+    Compute time-domain features per channel: mean absolute value, root mean square,
+    waveform length and zero crossings.
+    :param windows: EMG windows of shape (..., samples, channels)
+    :param zc_threshold: Minimum step between samples counted as a zero crossing
+    :return: Features of shape (..., len(FEATURES) * channels), grouped by feature
+    """
+    w = windows.astype(np.float32)
+    # The ADC output is unsigned, remove the DC offset of each window first
+    w -= w.mean(axis=-2, keepdims=True)
+
+    diff = np.diff(w, axis=-2)
+    mav = np.abs(w).mean(axis=-2)
+    rms = np.sqrt((w * w).mean(axis=-2))
+    wl = np.abs(diff).sum(axis=-2)
+    zc = ((w[..., :-1, :] * w[..., 1:, :] < 0) & (np.abs(diff) >= zc_threshold)).sum(axis=-2)
+
+    return np.concatenate([mav, rms, wl, zc.astype(np.float32)], axis=-1)
+
+
+def sliding_windows(samples: np.ndarray, window_len: int, step: int) -> np.ndarray:
+    """
+    :param samples: EMG samples of shape (samples, channels)
+    :param window_len: Samples per window
+    :param step: Samples between the starts of two windows
+    :return: Windows of shape (windows, window_len, channels), views into samples
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(samples, window_len, axis=0)
+    return windows[::step].swapaxes(-1, -2)
+
+
+class _Classifier(ABC):
+    kind = ""
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self._mean = None
+        self._std = None
+
+    def _standardize(self, features: np.ndarray) -> np.ndarray:
+        return (features - self._mean) / self._std
+
+    def _fit_scaler(self, features: np.ndarray):
+        self._mean = features.mean(axis=0)
+        self._std = features.std(axis=0) + 1e-6
+
+    @abstractmethod
+    def fit(self, features: np.ndarray, labels: List[str]):
+        """
+        :param features: Features of shape (samples, features)
+        :param labels: Label of every sample
+        :return: self
+        """
+
+    @abstractmethod
+    def _scores(self, x: np.ndarray) -> np.ndarray:
+        """
+        :param x: Standardized features of shape (samples, features)
+        :return: Score of every label, shape (samples, labels)
+        """
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """
+        :param features: Features of shape (features,) or (samples, features)
+        :return: Index into labels, one per sample
+        """
+        return np.argmax(self._scores(self._standardize(np.atleast_2d(features))), axis=-1)
+
+    @abstractmethod
+    def _params(self) -> dict:
+        """
+        :return: Arrays of the trained model saved by save()
+        """
+
+    @abstractmethod
+    def _set_params(self, params):
+        """
+        :param params: Arrays loaded from a file written by save()
+        """
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            kind=self.kind,
+            labels=np.array(self.labels),
+            mean=self._mean,
+            std=self._std,
+            **self._params(),
+        )
+
+
+class NearestCentroidClassifier(_Classifier):
+    """
+    Assigns the class whose mean standardized feature vector is closest.
+    """
+
+    kind = "nearest_centroid"
+
+    def fit(self, features: np.ndarray, labels: List[str]):
+        self.labels = sorted(set(labels))
+        label_idx = np.array([self.labels.index(label) for label in labels])
+        self._fit_scaler(features)
+        x = self._standardize(features)
+        self._centroids = np.stack([x[label_idx == i].mean(axis=0) for i in range(len(self.labels))])
+        return self
+
+    def _scores(self, x: np.ndarray) -> np.ndarray:
+        return -((x[:, None, :] - self._centroids[None, :, :]) ** 2).sum(axis=-1)
+
+    def _params(self) -> dict:
+        return {"centroids": self._centroids}
+
+    def _set_params(self, params):
+        self._centroids = params["centroids"]
+
+
+class LdaClassifier(_Classifier):
+    """
+    Linear discriminant analysis with a shared, shrunk covariance matrix.
+    """
+
+    kind = "lda"
+
+    def __init__(self, shrinkage=0.1):
+        """
+        :param shrinkage: Weight of the identity matrix blended into the covariance, 0..1
+        """
+        super().__init__()
+        self._shrinkage = shrinkage
+
+    def fit(self, features: np.ndarray, labels: List[str]):
+        self.labels = sorted(set(labels))
+        label_idx = np.array([self.labels.index(label) for label in labels])
+        self._fit_scaler(features)
+        x = self._standardize(features)
+
+        means = np.stack([x[label_idx == i].mean(axis=0) for i in range(len(self.labels))])
+        centered = x - means[label_idx]
+        cov = centered.T @ centered / max(len(x) - len(self.labels), 1)
+        cov = (1 - self._shrinkage) * cov + self._shrinkage * np.eye(cov.shape[0])
+        priors = np.bincount(label_idx, minlength=len(self.labels)) / len(x)
+
+        self._weights = np.linalg.solve(cov, means.T)
+        self._bias = -0.5 * np.sum(means.T * self._weights, axis=0) + np.log(priors)
+        return self
+
+    def _scores(self, x: np.ndarray) -> np.ndarray:
+        return x @ self._weights + self._bias
+
+    def _params(self) -> dict:
+        return {"weights": self._weights, "bias": self._bias}
+
+    def _set_params(self, params):
+        self._weights = params["weights"]
+        self._bias = params["bias"]
+
+
+CLASSIFIERS = {cls.kind: cls for cls in [NearestCentroidClassifier, LdaClassifier]}
+
+
+def load_classifier(path: str) -> _Classifier:
+    params = np.load(path)
+    classifier = CLASSIFIERS[str(params["kind"])]()
+    classifier.labels = [str(label) for label in params["labels"]]
+    classifier._mean = params["mean"]
+    classifier._std = params["std"]
+    classifier._set_params(params)
+    return classifier
+
+
+class EmgGesturePipeline:
+    """
+    Buffers raw EMG blocks of one device and publishes gesture predictions at a fixed rate.
+    The latency from receiving the newest block over BLE to its prediction, which covers
+    queueing, feature extraction and classification but not moving the hand, is measured
+    against a budget.
+    """
+
+    def __init__(self, classifier: _Classifier, num_channels=EMG_NUM_CHANNELS, fs=EMG_FS, window_ms=WINDOW_MS, rate_hz=20,
+                 min_stable=2, latency_budget_ms=50):
+        """
+        :param classifier: Trained classifier
+        :param num_channels: EMG channels per sample
+        :param fs: Sampling rate in Hz
+        :param window_ms: Length of the analysis window, must match training
+        :param rate_hz: Prediction rate
+        :param min_stable: Consecutive equal predictions needed before a gesture is published
+        :param latency_budget_ms: Latency target, predictions above it are counted
+        """
+        self._classifier = classifier
+        self._window_len = max(2, round(fs * window_ms / 1000))
+        self._buffer = np.zeros((self._window_len, num_channels), dtype=np.float32)
+        self._filled = 0
+        self._period = 1.0 / rate_hz
+        self._next_time = 0.0
+        self._min_stable = min_stable
+        self._candidate = None
+        self._stable_count = 0
+        self._budget = latency_budget_ms / 1000
+        self.latencies = deque(maxlen=1024)
+        self.over_budget = 0
+
+    def push(self, block: np.ndarray, timestamp: float) -> Optional[str]:
+        """
+        Add an EMG data block.
+        :param block: EMG samples of shape (samples, channels)
+        :param timestamp: time.monotonic() when the block was received over BLE, e.g. DeviceData.timestamp
+        :return: Newly published gesture label, None if there is no new gesture
+        """
+        if len(block) == 0:
+            return None
+
+        # Only the newest samples of a block longer than the window are kept
+        n = min(len(block), self._window_len)
+        self._buffer[:-n] = self._buffer[n:]
+        self._buffer[-n:] = block[-n:]
+        self._filled = min(self._filled + n, self._window_len)
+
+        if self._filled < self._window_len or timestamp < self._next_time:
+            return None
+        self._next_time = timestamp + self._period
+
+        label = self._classifier.labels[self._classifier.predict(extract_features(self._buffer))[0]]
+
+        latency = time.monotonic() - timestamp
+        self.latencies.append(latency)
+        if latency > self._budget:
+            self.over_budget += 1
+
+        if label != self._candidate:
+            self._candidate = label
+            self._stable_count = 0
+        self._stable_count += 1
+
+        if self._stable_count == self._min_stable:
+            return label
+        return None
+
+    def latency_summary(self) -> str:
+        if len(self.latencies) == 0:
+            return "no predictions"
+
+        ms = np.array(self.latencies) * 1000
+        return "receive to prediction latency mean {0:.2f}ms, p95 {1:.2f}ms, max {2:.2f}ms, {3} over {4:.0f}ms budget".format(
+            ms.mean(), np.percentile(ms, 95), ms.max(), self.over_budget, self._budget * 1000
+        )
@@ -4,7 +4,7 @@ import asyncio
 import os
 import signal
 import sys
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 from pymodbus import FramerType
 from pymodbus.client import ModbusSerialClient
@@ -14,14 +14,34 @@ from serial.tools import list_ports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from common.roh_registers_v1 import *
 from lib_gforce import gforce
+from lib_gforce.session import GForceSession
+from pose_sequencer import PoseSequencer
 
-# ROHand configuration
-NODE_ID = 2
+# ROHand configuration, one node per armband. Armbands are assigned in order of their addresses
+NODE_ID = [2]
 
 # Device filters
 DEV_NAME_PREFIX = "gForce"
 DEV_MIN_RSSI = -64
 
+# Gesture source: "device" uses the gesture IDs recognized by the armband,
+# "host" classifies raw EMG data on this computer with the model trained by train_emg_classifier.py
+GESTURE_SOURCE = "device"
+EMG_MODEL_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "emg_model.npz")
+PREDICTION_RATE = 20  # Hz
+LATENCY_BUDGET_MS = 50
+
+# Seconds the hand stays in REST before moving to a new gesture
+REST_DELAY = 0.5
+
+# Gesture IDs recognized by the armband
+DEVICE_GESTURES = {
+    1: "SPREAD",
+    2: "FIST",
+    3: "VICTORY",
+    4: "SIX",
+}
+
 NUM_FINGERS = 5
 
 THUMB_ROOT = {
@@ -59,6 +79,13 @@ def interpolate(n, from_min, from_max, to_min, to_max):
     return (n - from_min) / (from_max - from_min) * (to_max - to_min) + to_min
 
 
+def gesture_steps(gesture):
+    """
+    :return: Steps of PoseSequencer moving to a gesture through REST
+    """
+    return [(GESTURES["REST"], REST_DELAY), (GESTURES[gesture], 0)]
+
+
 class Application:
 
     def __init__(self):
@@ -85,16 +112,17 @@ class Application:
                 return port.device
         return None
 
-    def write_registers(self, client, address, values):
+    def write_registers(self, client, address, values, node_id):
         """
         Write data to Modbus device.
         :param client: Modbus client instance
         :param address: Register address
         :param values: Data to be written
+        :param node_id: Modbus node id
         :return: True if successful, False otherwise
         """
         try:
-            resp = client.write_registers(address, values, NODE_ID)
+            resp = client.write_registers(address, values, node_id)
             if resp.isError():
                 print("client.write_registers() returned", resp)
                 return False
@@ -103,16 +131,17 @@ class Application:
             print("ModbusException:{0}".format(e))
             return False
 
-    def read_registers(self, client, address, count):
+    def read_registers(self, client, address, count, node_id):
         """
         Read data from Modbus device.
         :param client: Modbus client instance
         :param address: Register address
         :param count: Register count to be read
+        :param node_id: Modbus node id
         :return: List of registers if successful, None otherwise
         """
         try:
-            resp = client.read_holding_registers(address, count, NODE_ID)
+            resp = client.read_holding_registers(address, count, node_id)
             if resp.isError():
                 return None    
             return resp.registers
@@ -121,57 +150,82 @@ class Application:
             return None
 
     async def main(self):
-        gforce_device = gforce.GForce(DEV_NAME_PREFIX, DEV_MIN_RSSI)
+        session = GForceSession(DEV_NAME_PREFIX, DEV_MIN_RSSI, len(NODE_ID))
 
         client = ModbusSerialClient(self.find_comport("CH340") or self.find_comport("USB"), FramerType.RTU, 115200)
         if not client.connect():
             print("连接Modbus设备失败\nFailed to connect to Modbus device")
             exit(-1)
 
-        def gestures_control(gesture):
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET0, GESTURES["REST"]):
-                print("控制指令发送失败\nFailed to send control command")
-            time.sleep(0.5)
-    
-            # if not self.write_registers(client, ROH_FINGER_POS_TARGET5, gesture[NUM_FINGERS]):
-            #     print("控制指令发送失败\nFailed to send control command")
-            # time.sleep(1)
+        # Modbus requests block, they run one at a time in a worker thread instead of the event loop
+        loop = asyncio.get_running_loop()
+        modbus_executor = ThreadPoolExecutor(max_workers=1)
+
+        def pose_writer(node_id):
+            async def write(pose):
+                return await loop.run_in_executor(
+                    modbus_executor, self.write_registers, client, ROH_FINGER_POS_TARGET0, pose, node_id
+                )
 
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET0, gesture):
-                print("控制指令发送失败\nFailed to send control command")
+            return write
 
         try:
-            await gforce_device.connect()
+            await session.connect()
         except Exception as e:
             print(e)
 
-        if gforce_device.client == None or not gforce_device.client.is_connected:
+        if session.num_devices == 0:
             exit(-1)
 
-        print("Connected to {0}".format(gforce_device.device_name))
+        for device, node_id in zip(session.devices, NODE_ID):
+            print("Connected to {0}, controlling node {1}".format(device.device_name, node_id))
+
+        sequencers = [PoseSequencer(pose_writer(node_id), device.device_name) for device, node_id in zip(session.devices, NODE_ID)]
+        sequencer_tasks = [asyncio.create_task(sequencer.run()) for sequencer in sequencers]
 
-        await gforce_device.set_subscription(gforce.DataSubscription.EMG_GESTURE)
-        q = await gforce_device.start_streaming()
+        pipelines = []
+        if GESTURE_SOURCE == "host":
+            from emg_classifier import EMG_FS, EmgGesturePipeline, load_classifier
+
+            classifier = load_classifier(EMG_MODEL_FILE)
+            pipelines = [
+                EmgGesturePipeline(classifier, rate_hz=PREDICTION_RATE, latency_budget_ms=LATENCY_BUDGET_MS)
+                for _ in range(session.num_devices)
+            ]
+            emg_cfg = gforce.EmgRawDataConfig(fs=EMG_FS, channel_mask=0xFF, batch_len=16,
+                                              resolution=gforce.SampleResolution.BITS_8)
+            await session.start(gforce.DataSubscription.EMG_RAW, emg_cfg)
+        else:
+            await session.start(gforce.DataSubscription.EMG_GESTURE)
 
-        prev_pos = 0
         while not self.terminated:
-                gesture = await q.get()
-                print("gesture ID:", gesture)
-                if (gesture != prev_pos):
-                    match(gesture):
-                        case 0: continue 
-                        case 1: gestures_control(GESTURES["SPREAD"])
-                        case 2: gestures_control(GESTURES["FIST"])
-                        case 3: gestures_control(GESTURES["VICTORY"])
-                        case 4: gestures_control(GESTURES["SIX"])
-                        case 5: continue
-
-                    prev_pos = gesture
+                item = await session.get()
+
+                if GESTURE_SOURCE == "host":
+                    gesture = pipelines[item.device_index].push(item.data, item.timestamp)
                 else:
+                    print("{0} gesture ID: {1}".format(item.device_name, item.data))
+                    gesture = DEVICE_GESTURES.get(item.data)
+
+                if gesture is None or gesture not in GESTURES:
                     continue
 
-        await gforce_device.stop_streaming()
-        await gforce_device.disconnect()
+                sequencer = sequencers[item.device_index]
+                if gesture != sequencer.current:
+                    print("{0} gesture: {1}".format(item.device_name, gesture))
+                    sequencer.request(gesture, gesture_steps(gesture))
+
+        for task in sequencer_tasks:
+            task.cancel()
+        await asyncio.gather(*sequencer_tasks, return_exceptions=True)
+        modbus_executor.shutdown()
+
+        for i, pipeline in enumerate(pipelines):
+            print("{0}: {1}".format(session.devices[i].device_name, pipeline.latency_summary()))
+        for sequencer, device in zip(sequencers, session.devices):
+            print("{0}: {1}".format(device.device_name, sequencer.summary()))
+
+        await session.stop()
 
 
 if __name__ == "__main__":
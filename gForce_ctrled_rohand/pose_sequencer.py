@@ -0,0 +1,92 @@
+# Non-blocking pose sequencing of one ROHand
+#
+# A gesture is reached through a sequence of steps, each a pose and a delay before the
+# next step. Delays are awaited, so BLE notifications keep being handled while the hand
+# moves. Only the newest requested gesture is kept: a request replaces one that hasn't
+# started yet, and cuts short the delay of a sequence in progress, so the hand never
+# works through a backlog of old gestures.
+
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+Step = Tuple[Sequence[int], float]  # Finger positions and seconds to wait before the next step
+
+
+class PoseSequencer:
+    def __init__(self, write: Callable[[List[int]], Awaitable[bool]], name=""):
+        """
+        :param write: Coroutine function writing finger positions to the hand, returns False on failure
+        :param name: Name of the hand used in messages
+        """
+        self._write = write
+        self._name = name
+        self._wakeup = asyncio.Event()
+        self._request: Optional[Tuple[str, List[Step], float]] = None  # Gesture, steps and request time
+        self._last_pose: Optional[List[int]] = None
+        self._last_write_time = 0.0
+        self.current: Optional[str] = None  # Gesture requested last
+        self.superseded = 0  # Requests replaced before they were reached
+        self.reaction_times: List[float] = []  # Seconds from request to writing the final pose, superseded requests excluded
+
+    def request(self, gesture: str, steps: List[Step]):
+        """
+        Move to a gesture, replacing any gesture not reached yet.
+        :param gesture: Name of the gesture
+        :param steps: Steps of the transition, the last pose is the gesture
+        """
+        if self._request is not None:
+            self.superseded += 1
+        self._request = (gesture, steps, time.monotonic())
+        self.current = gesture
+        self._wakeup.set()
+
+    async def _wait(self, seconds: float) -> bool:
+        """
+        :return: True if a new request arrived within the time
+        """
+        if seconds > 0:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        return self._wakeup.is_set()
+
+    async def run(self):
+        """
+        Execute requests until cancelled.
+        """
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            gesture, steps, request_time = self._request
+
+            for i, (pose, delay) in enumerate(steps):
+                pose = list(pose)
+                if pose == self._last_pose:
+                    # Already moving there, e.g. after a request cut the previous sequence short
+                    delay -= time.monotonic() - self._last_write_time
+                else:
+                    if not await self._write(pose):
+                        print("{0} 控制指令发送失败\nFailed to send control command".format(self._name))
+                    self._last_pose = pose
+                    self._last_write_time = time.monotonic()
+
+                if i == len(steps) - 1:
+                    # A request arriving while the final pose was written already counted this one as superseded
+                    if not self._wakeup.is_set():
+                        self.reaction_times.append(time.monotonic() - request_time)
+                        self._request = None
+                elif await self._wait(delay):
+                    break  # Preempted by a newer gesture
+
+    def summary(self) -> str:
+        if len(self.reaction_times) == 0:
+            return "no gestures"
+
+        ms = np.array(self.reaction_times) * 1000
+        return "{0} gestures, {1} superseded, reaction p50 {2:.0f}ms, p95 {3:.0f}ms, max {4:.0f}ms".format(
+            len(ms), self.superseded, np.median(ms), np.percentile(ms, 95), ms.max()
+        )
@@ -0,0 +1,127 @@
+# Record a short EMG session with the gForce armband and train the on-host gesture classifier
+#
+# Usage:
+#   python train_emg_classifier.py                  Record a new session, then train
+#   python train_emg_classifier.py recording.npz    Train from a recorded session
+
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lib_gforce import gforce
+from lib_gforce.gforce import EmgRawDataConfig, SampleResolution
+from emg_classifier import (
+    CLASSIFIERS,
+    EMG_FS,
+    WINDOW_MS,
+    extract_features,
+    sliding_windows,
+)
+
+# Device filters
+DEV_NAME_PREFIX = "gForce"
+DEV_MIN_RSSI = -64
+
+# Gestures to record, names must match GESTURES in gForce_ctrled_hand.py
+TRAIN_GESTURES = ["REST", "FIST", "SPREAD", "POINT", "VICTORY", "SIX"]
+RECORD_SECONDS = 5
+PREPARE_SECONDS = 3
+
+STEP_MS = 25  # Step between training windows
+TEST_RATIO = 0.25  # Last part of every gesture kept for testing
+CLASSIFIER = "lda"  # "lda" or "nearest_centroid"
+
+current_dir = os.path.dirname(os.path.realpath(__file__))
+RECORDING_FILE = os.path.join(current_dir, "emg_recording.npz")
+MODEL_FILE = os.path.join(current_dir, "emg_model.npz")
+
+
+async def drain(q, seconds):
+    blocks = []
+    end_time = time.monotonic() + seconds
+    while time.monotonic() < end_time:
+        try:
+            blocks.append(await asyncio.wait_for(q.get(), end_time - time.monotonic()))
+        except asyncio.TimeoutError:
+            break
+    return blocks
+
+
+async def record():
+    gforce_device = gforce.GForce(DEV_NAME_PREFIX, DEV_MIN_RSSI)
+    await gforce_device.connect()
+    print("Connected to {0}".format(gforce_device.device_name))
+
+    await gforce_device.set_emg_raw_data_config(
+        EmgRawDataConfig(fs=EMG_FS, channel_mask=0xFF, batch_len=16, resolution=SampleResolution.BITS_8)
+    )
+    await gforce_device.set_subscription(gforce.DataSubscription.EMG_RAW)
+    q = await gforce_device.start_streaming(data_types=[gforce.DataType.EMG_ADC])
+
+    recording = {}
+    for gesture in TRAIN_GESTURES:
+        print("准备做手势 {0}\nGet ready for gesture {0}".format(gesture))
+        await drain(q, PREPARE_SECONDS)
+        print("保持手势 {0} {1} 秒\nHold gesture {0} for {1} seconds".format(gesture, RECORD_SECONDS))
+        blocks = await drain(q, RECORD_SECONDS)
+        recording[gesture] = np.concatenate(blocks)
+        print("{0}: {1} samples".format(gesture, len(recording[gesture])))
+
+    await gforce_device.stop_streaming()
+    await gforce_device.disconnect()
+
+    np.savez(RECORDING_FILE, **recording)
+    print("Recording saved to {0}".format(RECORDING_FILE))
+    return recording
+
+
+def train(recording):
+    window_len = round(EMG_FS * WINDOW_MS / 1000)
+    step = max(1, round(EMG_FS * STEP_MS / 1000))
+
+    train_x, train_y, test_x, test_y = [], [], [], []
+    for gesture, samples in recording.items():
+        features = extract_features(sliding_windows(samples, window_len, step))
+        num_train = round(len(features) * (1 - TEST_RATIO))
+        train_x.append(features[:num_train])
+        train_y += [gesture] * num_train
+        test_x.append(features[num_train:])
+        test_y += [gesture] * (len(features) - num_train)
+
+    train_x = np.concatenate(train_x)
+    test_x = np.concatenate(test_x)
+
+    classifier = CLASSIFIERS[CLASSIFIER]().fit(train_x, train_y)
+    predicted = np.array(classifier.labels)[classifier.predict(test_x)]
+    print("测试准确率\nTest accuracy: {0:.1%}".format(np.mean(predicted == np.array(test_y))))
+
+    # Final model uses every window
+    classifier.fit(np.concatenate([train_x, test_x]), train_y + test_y)
+
+    window = sliding_windows(next(iter(recording.values())), window_len, step)[0]
+    repeat = 200
+    t = time.perf_counter()
+    for _ in range(repeat):
+        classifier.predict(extract_features(window))
+    print("Feature extraction + prediction: {0:.3f}ms".format((time.perf_counter() - t) / repeat * 1000))
+
+    classifier.save(MODEL_FILE)
+    print("Model saved to {0}".format(MODEL_FILE))
+
+
+def main():
+    if len(sys.argv) > 1:
+        with np.load(sys.argv[1]) as f:
+            recording = {gesture: f[gesture] for gesture in f.files}
+    else:
+        recording = asyncio.run(record())
+
+    train(recording)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,12 @@ Website: https://www.computervision.zone/
 """
 
 import math
+from contextlib import nullcontext
 
 import cv2
-import mediapipe as mp
+import numpy as np
+
+from landmark_backends import LegacyBackend
 
 def clamp(n, smallest, largest):
     return max(smallest, min(n, largest))
@@ -18,15 +21,109 @@ def interpolate(n, from_min, from_max, to_min, to_max):
 MAXTHUMBDEGREE = 125
 MINTHUMBDEGREE = 97
 
+NUM_LANDMARKS = 21
+
+# Same connections as mediapipe's HAND_CONNECTIONS, so drawing doesn't depend on the backend
+HAND_CONNECTIONS = [(0, 1), (1, 2), (2, 3), (3, 4),
+                    (0, 5), (5, 6), (6, 7), (7, 8),
+                    (5, 9), (9, 10), (10, 11), (11, 12),
+                    (9, 13), (13, 14), (14, 15), (15, 16),
+                    (13, 17), (0, 17), (17, 18), (18, 19), (19, 20)]
+TIP_IDS = np.array([4, 8, 12, 16, 20])
+
+# Landmarks from the wrist to the tip of thumb, index, middle, ring and pinky
+FINGER_CHAINS = np.array([[0, 1, 2, 3, 4],
+                          [0, 5, 6, 7, 8],
+                          [0, 9, 10, 11, 12],
+                          [0, 13, 14, 15, 16],
+                          [0, 17, 18, 19, 20]])
+
+def angle_between(u, v):
+    """
+    Angle between vectors along the last axis, broadcast over the other axes.
+    :return: Degrees, 0 for a zero-length vector
+    """
+    lengths = np.linalg.norm(u, axis=-1) * np.linalg.norm(v, axis=-1)
+    cos = np.sum(u * v, axis=-1) / np.where(lengths > 0, lengths, 1)
+    return np.degrees(np.arccos(np.clip(np.where(lengths > 0, cos, 1), -1, 1)))
+
+def joint_angles(landmarks):
+    """
+    Bend angles of the finger joints.
+    :param landmarks: Landmarks of shape (..., 21, 3)
+    :return: Angles of shape (..., 5, 3) in degrees, fingers from thumb to pinky and joints
+             from the base to the tip, 0 for a straight joint
+    """
+    segments = np.diff(landmarks[..., FINGER_CHAINS, :], axis=-2)
+    return angle_between(segments[..., :-1, :], segments[..., 1:, :])
+
+def thumb_spread_angles(landmarks):
+    """
+    Angle at the index finger base between the thumb base and the middle finger base, in the image plane.
+    :param landmarks: Landmarks of shape (..., 21, 3)
+    :return: Angles of shape (...) in degrees
+    """
+    xy = landmarks[..., :2]
+    return angle_between(xy[..., 2, :] - xy[..., 5, :], xy[..., 9, :] - xy[..., 5, :])
+
+def finger_states(landmarks, isLeft):
+    """
+    Which fingers are up, for one or several hands at once.
+    :param landmarks: Landmarks of shape (..., 21, 3) in pixel coordinates
+    :param isLeft: Bool of shape (...), True for left hands
+    :return: Finger states of shape (..., 5) from thumb to pinky, thumb spread angles of shape (...)
+    """
+    tips = landmarks[..., TIP_IDS, :]
+    states = np.empty(tips.shape[:-1], dtype=np.uint8)
+
+    # Thumb tip is beyond the thumb IP joint, towards the outside of the hand
+    thumbOut = tips[..., 0, 0] - landmarks[..., TIP_IDS[0] - 1, 0]
+    states[..., 0] = np.where(isLeft, thumbOut > 0, thumbOut < 0)
+
+    # Other tips are above their PIP joints
+    states[..., 1:] = tips[..., 1:, 1] < landmarks[..., TIP_IDS[1:] - 2, 1]
+
+    return states, thumb_spread_angles(landmarks)
+
+class Hand:
+    """
+    Hand found in an image. Landmarks are stored as one array, the dict-style keys
+    "lmList", "bbox", "center" and "type" are kept for existing callers.
+    """
+
+    __slots__ = ("landmarks", "type", "bbox", "center")
+
+    def __init__(self, landmarks, handType):
+        """
+        :param landmarks: Float32 array of shape (21, 3), x and y in pixels, z in the scale of x
+        :param handType: "Left" or "Right"
+        """
+        self.landmarks = landmarks
+        self.type = handType
+
+        xy = landmarks[:, :2].astype(np.int32)
+        xmin, ymin = xy.min(axis=0).tolist()
+        xmax, ymax = xy.max(axis=0).tolist()
+        self.bbox = xmin, ymin, xmax - xmin, ymax - ymin
+        self.center = xmin + (xmax - xmin) // 2, ymin + (ymax - ymin) // 2
+
+    def __getitem__(self, key):
+        if key == "lmList":
+            return self.landmarks.astype(np.int32)
+        if key in ("type", "bbox", "center"):
+            return getattr(self, key)
+        raise KeyError(key)
+
 class HandDetector:
     """
-    Finds Hands using the mediapipe library. Exports the landmarks
+    Finds Hands using a landmark backend, mediapipe by default. Exports the landmarks
     in pixel format. Adds extra functionalities like finding how
     many fingers are up or the distance between two fingers. Also
     provides bounding box info of the hand found.
     """
 
-    def __init__(self, staticMode=False, maxHands=2, modelComplexity=1, detectionCon=0.5, minTrackCon=0.5):
+    def __init__(self, staticMode=False, maxHands=2, modelComplexity=1, detectionCon=0.5, minTrackCon=0.5,
+                 roiScale=1.6, inferenceSize=None, profiler=None, backend=None):
 
         """
         :param mode: In static mode, detection is done on each image: slower
@@ -34,132 +131,173 @@ class HandDetector:
         :param modelComplexity: Complexity of the hand landmark model: 0 or 1.
         :param detectionCon: Minimum Detection Confidence Threshold
         :param minTrackCon: Minimum Tracking Confidence Threshold
+        :param roiScale: Side of the square region returned by nextROI() relative to the larger side of the bbox
+        :param inferenceSize: Downscale the image passed to the model so its larger side is at most
+                              this many pixels, None to use the original resolution
+        :param profiler: common.stage_profiler.StageProfiler timing the internal stages, None to disable
+        :param backend: Landmark backend from landmark_backends, None for the mediapipe solutions API
+                        created from the arguments above
         """
         self.staticMode = staticMode
         self.maxHands = maxHands
         self.modelComplexity = modelComplexity
         self.detectionCon = detectionCon
         self.minTrackCon = minTrackCon
-        self.mpHands = mp.solutions.hands
-        self.hands = self.mpHands.Hands(static_image_mode=self.staticMode,
-                                        max_num_hands=self.maxHands,
-                                        model_complexity=modelComplexity,
-                                        min_detection_confidence=self.detectionCon,
-                                        min_tracking_confidence=self.minTrackCon)
-
-        self.mpDraw = mp.solutions.drawing_utils
+        if backend is None:
+            backend = LegacyBackend(maxHands, modelComplexity, detectionCon, minTrackCon, staticMode)
+        self.backend = backend
         self.tipIds = [4, 8, 12, 16, 20]
-        self.fingers = []
-        self.lmList = []
-        self.previousThumbDegreeValue = 0
+        self.roiScale = roiScale
+        self.inferenceSize = inferenceSize
+        self.profiler = profiler
+
+    def _stage(self, name):
+        return self.profiler.stage(name) if self.profiler is not None else nullcontext()
+
+    def _process(self, img, roi):
+        """
+        Run the model on a region of a BGR image.
+        :param roi: x, y, w, h of the region, None for the full image
+        :return: List of (normalized landmarks, handedness) from the backend, x, y, w, h of the region
+        """
+        if roi is None:
+            roi = (0, 0, img.shape[1], img.shape[0])
+        x, y, w, h = roi
+        imgROI = img[y:y + h, x:x + w]
+
+        with self._stage("cvtColor"):
+            if self.inferenceSize and max(w, h) > self.inferenceSize:
+                scale = self.inferenceSize / max(w, h)
+                imgROI = cv2.resize(imgROI, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                    interpolation=cv2.INTER_AREA)
+
+            imgRGB = cv2.cvtColor(imgROI, cv2.COLOR_BGR2RGB)
+
+        with self._stage("hands.process"):
+            # A region moves with the hand, so the backend must not track from the previous image
+            return self.backend.process(imgRGB, static=(w, h) != (img.shape[1], img.shape[0])), roi
+
+    def nextROI(self, allHands, imgShape):
+        """
+        Region to search in the next frame when tracking: a square around all found hands,
+        expanded by roiScale and clipped to the image.
+        :param allHands: Hands found by findHands()
+        :param imgShape: Shape of the image
+        :return: x, y, w, h of the region, None to search the full frame
+        """
+        if not allHands:
+            return None
+
+        imgH, imgW = imgShape[:2]
+
+        xmin = min(hand.bbox[0] for hand in allHands)
+        ymin = min(hand.bbox[1] for hand in allHands)
+        xmax = max(hand.bbox[0] + hand.bbox[2] for hand in allHands)
+        ymax = max(hand.bbox[1] + hand.bbox[3] for hand in allHands)
+        side = int(max(xmax - xmin, ymax - ymin) * self.roiScale)
+        cx, cy = (xmin + xmax) // 2, (ymin + ymax) // 2
+
+        x0, y0 = clamp(cx - side // 2, 0, imgW), clamp(cy - side // 2, 0, imgH)
+        x1, y1 = clamp(cx + side // 2, 0, imgW), clamp(cy + side // 2, 0, imgH)
+        if x1 - x0 < 32 or y1 - y0 < 32:
+            return None
+        if x1 - x0 >= imgW and y1 - y0 >= imgH:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _drawLandmarks(self, img, lmList):
+        """
+        Draw landmarks given in full-frame pixel coordinates.
+        """
+        points = lmList[:, :2].tolist()
+        for start, end in HAND_CONNECTIONS:
+            cv2.line(img, points[start], points[end], (224, 224, 224), 2)
+        for point in points:
+            cv2.circle(img, point, 3, (0, 0, 255), cv2.FILLED)
 
-    def findHands(self, img, draw=True, flipType=True):
+    def findHands(self, img, draw=True, flipType=True, roi=None):
         """
-        Finds hands in a BGR image.
+        Finds hands in a BGR image. Nothing about the frame is kept in the detector, callers
+        tracking a hand pass the region from nextROI() of the previous frame.
         :param img: Image to find the hands in.
         :param draw: Flag to draw the output on the image.
-        :return: Image with or without drawings
+        :param roi: x, y, w, h of the region to search, falls back to the full frame if no hand is found there
+        :return: List of Hand, image with or without drawings
         """
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.hands.process(imgRGB)
+        imgH, imgW, c = img.shape
+        results, (x0, y0, w, h) = self._process(img, roi)
+        if roi is not None and not results:
+            # Hand lost, search the full frame again
+            results, (x0, y0, w, h) = self._process(img, None)
+
         allHands = []
-        h, w, c = img.shape
-        if self.results.multi_hand_landmarks:
-            for handType, handLms in zip(self.results.multi_handedness, self.results.multi_hand_landmarks):
-                myHand = {}
-                ## lmList
-                mylmList = []
-                xList = []
-                yList = []
-                for id, lm in enumerate(handLms.landmark):
-                    px, py, pz = int(lm.x * w), int(lm.y * h), int(lm.z * w)
-                    mylmList.append([px, py, pz])
-                    xList.append(px)
-                    yList.append(py)
-
-                ## bbox
-                xmin, xmax = min(xList), max(xList)
-                ymin, ymax = min(yList), max(yList)
-                boxW, boxH = xmax - xmin, ymax - ymin
-                bbox = xmin, ymin, boxW, boxH
-                cx, cy = bbox[0] + (bbox[2] // 2), \
-                         bbox[1] + (bbox[3] // 2)
-
-                myHand["lmList"] = mylmList
-                myHand["bbox"] = bbox
-                myHand["center"] = (cx, cy)
+        if not results:
+            return allHands, img
+
+        with self._stage("landmarks"):
+            # z is in the scale of x, so it is scaled by the region width like x and ends up in
+            # pixels, the same as for landmarks found in the full frame
+            scale = np.array([w, h, w], dtype=np.float32)
+            offset = np.array([x0, y0, 0], dtype=np.float32)
+            for landmarks, label in results:
+                ## landmarks in full-frame pixels
+                landmarks = landmarks * scale + offset
 
                 if flipType:
-                    if handType.classification[0].label == "Right":
-                        myHand["type"] = "Right"
-                    else:
-                        myHand["type"] = "Left"
-                else:
-                    myHand["type"] = handType.classification[0].label
-                allHands.append(myHand)
-
-                ## draw
-                if draw:
-                    self.mpDraw.draw_landmarks(img, handLms,
-                                               self.mpHands.HAND_CONNECTIONS)
+                    label = "Right" if label == "Right" else "Left"
+                allHands.append(Hand(landmarks, label))
+
+        ## draw
+        if draw:
+            with self._stage("draw"):
+                for myHand in allHands:
+                    bbox = myHand.bbox
+                    self._drawLandmarks(img, myHand["lmList"])
                     cv2.rectangle(img, (bbox[0] - 20, bbox[1] - 20),
                                   (bbox[0] + bbox[2] + 20, bbox[1] + bbox[3] + 20),
                                   (255, 0, 255), 2)
-                    cv2.putText(img, myHand["type"], (bbox[0] - 30, bbox[1] - 30), cv2.FONT_HERSHEY_PLAIN,
+                    cv2.putText(img, myHand.type, (bbox[0] - 30, bbox[1] - 30), cv2.FONT_HERSHEY_PLAIN,
                                 2, (255, 0, 255), 2)
 
         return allHands, img
 
-    def fingersUp(self, myHand):
+    def fingersUp(self, myHand, previousRotation=0):
         """
         Finds how many fingers are open and returns in a list.
         Considers left and right hands separately
-        :return: List of which fingers are up
+        :param previousRotation: Thumb rotation returned for this hand in the previous frame,
+                                 kept while the thumb is between the two thresholds
+        :return: List of which fingers are up, followed by the thumb rotation 0 or 1
         """
-        fingers = []
-        myHandType = myHand["type"]
-        myLmList = myHand["lmList"]
-        if self.results.multi_hand_landmarks:
-
-            # Thumb,self.tipIds[0]:大拇指指尖索引,myLmList[self.tipIds[0]]:大拇指指尖二维空间的坐标
-            if myHandType == "Left":
-                if myLmList[self.tipIds[0]][0] > myLmList[self.tipIds[0] - 1][0]:
-                    fingers.append(1)
-                else:
-                    fingers.append(0)
-            else:
-                if myLmList[self.tipIds[0]][0] < myLmList[self.tipIds[0] - 1][0]:
-                    fingers.append(1)
-                else:
-                    fingers.append(0)
-
-            # 4 Fingers
-            for id in range(1, 5):
-                if myLmList[self.tipIds[id]][1] < myLmList[self.tipIds[id] - 2][1]:
-                    fingers.append(1)
-                else:
-                    fingers.append(0)
-                
-            thumb_base = myLmList[self.tipIds[0] - 2]
-            index_base = myLmList[self.tipIds[1] - 3]
-            middle_base = myLmList[self.tipIds[2] - 3]
-            if thumb_base is not None and index_base is not None and middle_base is not None:
-                degree = int(self.calculate_angle(thumb_base, index_base, middle_base))
-                degree2Interpolation = interpolate(degree, MINTHUMBDEGREE, MAXTHUMBDEGREE, 0, 1)
-                degree2Interpolation = round(clamp(degree2Interpolation, 0, 1), 2)
-                # print("degree2Interpolation: " + "  " +str(degree2Interpolation))
-                if 0 <= degree2Interpolation <= 0.2:
-                    degree2Interpolation = 0
-                elif 0.85 <= degree2Interpolation <= 1:
-                    degree2Interpolation = 1
-                else:
-                     degree2Interpolation = self.previousThumbDegreeValue
-                    # return fingers
-                self.previousThumbDegreeValue = degree2Interpolation
-                fingers.append(degree2Interpolation)
+        return self.fingersUpBatch([myHand], [previousRotation])[0]
+
+    def fingersUpBatch(self, hands, previousRotations=None):
+        """
+        fingersUp for several hands, computed in one pass.
+        :param hands: List of Hand
+        :param previousRotations: Thumb rotation of every hand in the previous frame, 0 if None
+        :return: One list per hand
+        """
+        if not hands:
+            return []
+        if previousRotations is None:
+            previousRotations = [0] * len(hands)
+
+        landmarks = np.stack([hand.landmarks for hand in hands])
+        isLeft = np.array([hand.type == "Left" for hand in hands])
+        states, degrees = finger_states(landmarks, isLeft)
+        rotations = np.round(np.clip(interpolate(degrees.astype(np.int32), MINTHUMBDEGREE, MAXTHUMBDEGREE, 0, 1), 0, 1), 2)
+
+        allFingers = []
+        for fingers, rotation, previous in zip(states.tolist(), rotations.tolist(), previousRotations):
+            if rotation <= 0.2:
+                rotation = 0
+            elif rotation >= 0.85:
+                rotation = 1
             else:
-                return fingers
-        return fingers
+                rotation = previous
+            allFingers.append(fingers + [rotation])
+        return allFingers
 
     def calculate_angle(self, thumbVector, indexVector, middleVector) -> float:
         """
@@ -169,31 +307,8 @@ class HandDetector:
         :param middleVector:
         :return: degrees
         """
-        # 向量
-        it_vector = (thumbVector[0] - indexVector[0], thumbVector[1] - indexVector[1])
-        im_vector = (middleVector[0] - indexVector[0], middleVector[1] - indexVector[1])
-
-        # 模长
-        length_it_vector = round(math.sqrt(it_vector[0]**2 + it_vector[1]**2), 0)
-        length_im_vector = round(math.sqrt(im_vector[0]**2 + im_vector[1]**2), 0)
-        # print("length_it_vector: " + str(length_it_vector) + "length_mi_vector" + str(length_mi_vector))
-
-        # 点积
-        dot_product = it_vector[0] * im_vector[0] + it_vector[1] * im_vector[1]
-
-        # 余弦值
-        cos_angle = dot_product / (length_it_vector * length_im_vector)
-
-        # 弧度
-        try:
-            radian_angle = math.acos(cos_angle)
-        except Exception as e:
-            radian_angle = 0
-
-        # 角度
-        radian2degree = math.degrees(radian_angle)
-
-        return radian2degree
+        thumb, index, middle = (np.asarray(v[:2], dtype=np.float32) for v in (thumbVector, indexVector, middleVector))
+        return float(angle_between(thumb - index, middle - index))
 
     def findDistance(self, p1, p2, img=None, color=(255, 0, 255), scale=5):
         """
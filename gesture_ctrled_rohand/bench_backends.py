@@ -0,0 +1,121 @@
+"""
+Landmark backend benchmark on a recorded video, without GPU.
+
+Every backend processes the same frames the way the demo does, with ROI tracking.
+Landmarks are compared with the reference backend: the error is the mean landmark
+distance relative to the hand size, the finger agreement is the share of frames with
+the same fingersUp() result. Backends whose library or model file is missing are skipped.
+
+Usage:
+    python bench_backends.py video.mp4 [max_frames]
+"""
+
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from bench_hand_tracking import load_frames
+from gesture_ctrled_hand import TRACKING_ROI, create_landmark_backend
+from HandTrackingModule import HandDetector
+
+# Name, backend, model complexity
+CONFIGS = [
+    ("legacy-1", "legacy", 1),
+    ("legacy-0", "legacy", 0),
+    ("tasks", "tasks", None),
+    ("onnx", "onnx", None),
+]
+REFERENCE = "legacy-1"
+
+
+def run(frames, backend):
+    """
+    :return: FPS, CPU load, landmarks of the first hand per frame (None if not found), fingersUp per frame
+    """
+    detector = HandDetector(maxHands=1, detectionCon=0.8, backend=backend)
+    landmarks = []
+    fingers = []
+    roi = None
+    thumb_rotation = 0
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for img in frames:
+        hands, _ = detector.findHands(img.copy(), draw=False, roi=roi)
+        if TRACKING_ROI:
+            roi = detector.nextROI(hands, img.shape)
+        if hands:
+            finger_up = detector.fingersUp(hands[0], thumb_rotation)
+            thumb_rotation = finger_up[5]
+            landmarks.append(hands[0].landmarks)
+            fingers.append(finger_up)
+        else:
+            landmarks.append(None)
+            fingers.append(None)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    return len(frames) / wall, cpu / wall, landmarks, fingers
+
+
+def agreement(landmarks, fingers, ref_landmarks, ref_fingers):
+    """
+    :return: Mean and p95 landmark error relative to the hand size, finger agreement, None if no common frames
+    """
+    errors = []
+    same_fingers = 0
+    for lm, f, ref_lm, ref_f in zip(landmarks, fingers, ref_landmarks, ref_fingers):
+        if lm is None or ref_lm is None:
+            continue
+        size = np.linalg.norm(ref_lm[:, :2].max(axis=0) - ref_lm[:, :2].min(axis=0))
+        errors.append(np.linalg.norm(lm[:, :2] - ref_lm[:, :2], axis=-1).mean() / max(size, 1))
+        same_fingers += f == ref_f
+
+    if not errors:
+        return None
+    return np.mean(errors), np.percentile(errors, 95), same_fingers / len(errors)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(-1)
+
+    max_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    frames = load_frames(sys.argv[1], max_frames)
+    if not frames:
+        print("读取视频失败\nFailed to read video")
+        exit(-1)
+    print("{0} frames, {1}x{2}, reference {3}".format(len(frames), frames[0].shape[1], frames[0].shape[0], REFERENCE))
+
+    results = {}
+    for name, backend_name, model_complexity in CONFIGS:
+        try:
+            if model_complexity is None:
+                backend = create_landmark_backend(backend_name)
+            else:
+                backend = create_landmark_backend(backend_name, model_complexity)
+        except (ImportError, IOError) as e:
+            print("{0}: skipped, {1}".format(name, e))
+            continue
+
+        results[name] = run(frames, backend)
+        backend.close()
+
+    print("{0:<10} {1:>8} {2:>6} {3:>6} {4:>10} {5:>10} {6:>8}".format(
+        "backend", "fps", "cpu", "found", "error", "p95 error", "fingers"))
+    ref = results.get(REFERENCE)
+    for name, (fps, load, landmarks, fingers) in results.items():
+        found = sum(lm is not None for lm in landmarks) / len(landmarks)
+        agree = agreement(landmarks, fingers, ref[2], ref[3]) if ref is not None else None
+        if agree is None:
+            agree_text = "{0:>10} {1:>10} {2:>8}".format("-", "-", "-")
+        else:
+            agree_text = "{0:>9.1%} {1:>10.1%} {2:>7.0%}".format(*agree)
+        print("{0:<10} {1:>8.1f} {2:>5.0%} {3:>5.0%}  {4}".format(name, fps, load, found, agree_text))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Hand tracking benchmark on a recorded video, without GPU.
+
+Every configuration processes the same frames, FPS is measured from wall time and
+CPU load from process time, so a load above 100% means more than one core is busy.
+
+Usage:
+    python bench_hand_tracking.py video.mp4 [max_frames]
+"""
+
+import sys
+import time
+
+import cv2
+
+from HandTrackingModule import HandDetector
+
+# Name, ROI tracking, HandDetector arguments
+CONFIGS = [
+    ("full frame", False, dict()),
+    ("full frame 256", False, dict(inferenceSize=256)),
+    ("roi", True, dict()),
+    ("roi 256", True, dict(inferenceSize=256)),
+    ("roi 160", True, dict(inferenceSize=160)),
+]
+
+
+def load_frames(path, max_frames):
+    video = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        success, img = video.read()
+        if not success:
+            break
+        frames.append(cv2.flip(img, 1))
+    video.release()
+    return frames
+
+
+def run(frames, tracking, **kwargs):
+    """
+    :return: FPS, CPU load, ratio of frames with a hand found
+    """
+    detector = HandDetector(maxHands=1, detectionCon=0.8, **kwargs)
+    found = 0
+    roi = None
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for img in frames:
+        hands, _ = detector.findHands(img.copy(), draw=False, roi=roi)
+        if tracking:
+            roi = detector.nextROI(hands, img.shape)
+        if hands:
+            found += 1
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    return len(frames) / wall, cpu / wall, found / len(frames)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(-1)
+
+    max_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    frames = load_frames(sys.argv[1], max_frames)
+    if not frames:
+        print("读取视频失败\nFailed to read video")
+        exit(-1)
+    print("{0} frames, {1}x{2}".format(len(frames), frames[0].shape[1], frames[0].shape[0]))
+
+    print("{0:<16} {1:>8} {2:>8} {3:>8}".format("config", "fps", "cpu", "found"))
+    for name, tracking, kwargs in CONFIGS:
+        fps, load, found = run(frames, tracking, **kwargs)
+        print("{0:<16} {1:>8.1f} {2:>7.0%} {3:>7.0%}".format(name, fps, load, found))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Scaling benchmark of multi_camera.py on a multi-core CPU.
+
+The same recorded video is fed to 1, 2, ... streams at once with the null sink, the
+total throughput shows how well the worker processes scale.
+
+Usage:
+    python bench_multi_camera.py video.mp4 [max_streams] [max_frames]
+"""
+
+import multiprocessing
+import sys
+
+from gesture_ctrled_hand import NullSink
+from multi_camera import run
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        exit(-1)
+
+    video = sys.argv[1]
+    max_streams = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+    max_frames = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+
+    print("{0} CPUs, {1} frames per stream".format(multiprocessing.cpu_count(), max_frames))
+    print("{0:>8} {1:>12} {2:>12} {3:>12} {4:>8} {5:>11}".format(
+        "streams", "total fps", "min fps", "max fps", "speedup", "efficiency"))
+
+    single_fps = None
+    for num_streams in range(1, max_streams + 1):
+        streams = [(video, i) for i in range(num_streams)]
+        stats = run(streams, NullSink(), max_frames, verbose=False)
+
+        fps = [frames / seconds if seconds > 0 else 0.0 for frames, seconds in stats]
+        total = sum(fps)
+        if single_fps is None:
+            single_fps = total
+        speedup = total / single_fps if single_fps > 0 else 0.0
+
+        print("{0:>8} {1:>12.1f} {2:>12.1f} {3:>12.1f} {4:>8.2f} {5:>10.0%}".format(
+            num_streams, total, min(fps), max(fps), speedup, speedup / num_streams))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Frame sources of the gesture pipeline: camera, video file or image directory
+
+import os
+
+import cv2
+
+IMAGE_EXTENSIONS = (".bmp", ".jpg", ".jpeg", ".png")
+
+
+class VideoSource:
+    """
+    Camera or video file read through cv2.VideoCapture.
+    """
+
+    def __init__(self, source):
+        """
+        :param source: Camera index or path of a video file
+        """
+        self.finite = not isinstance(source, int)
+        self._video = cv2.VideoCapture(source)
+        if not self._video.isOpened():
+            raise IOError("Failed to open {0}".format(source))
+
+    @property
+    def size(self):
+        return int(self._video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self._video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def read(self):
+        """
+        :return: BGR image, None if no frame is available
+        """
+        success, img = self._video.read()
+        return img if success else None
+
+    def release(self):
+        self._video.release()
+
+
+class ImageDirSource:
+    """
+    Images of a directory in file name order.
+    """
+
+    finite = True
+
+    def __init__(self, directory):
+        self._paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self._paths:
+            raise IOError("No images in {0}".format(directory))
+        self._next = 0
+
+    @property
+    def size(self):
+        img = cv2.imread(self._paths[0])
+        return img.shape[1], img.shape[0]
+
+    def read(self):
+        while self._next < len(self._paths):
+            img = cv2.imread(self._paths[self._next])
+            self._next += 1
+            if img is not None:
+                return img
+        return None
+
+    def release(self):
+        pass
+
+
+def open_source(source):
+    """
+    :param source: Camera index, video file or image directory
+    :return: Frame source
+    """
+    if source.isdigit():
+        return VideoSource(int(source))
+    if os.path.isdir(source):
+        return ImageDirSource(source)
+    return VideoSource(source)
@@ -1,9 +1,14 @@
+import time
+
+START_TIME = time.perf_counter()
+
 import os
 import sys
 import cv2
-import time
-import queue
+import argparse
+import numpy as np
 import threading
+import queue
 
 from pymodbus import FramerType
 from pymodbus.client import ModbusSerialClient
@@ -12,7 +17,14 @@ from serial.tools import list_ports
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from HandTrackingModule import HandDetector
+from landmark_backends import create_backend
+from retarget import Retargeter
+from gesture_state import GestureStateMachine
+from frame_sources import open_source
 from common.roh_registers_v1 import *
+from common.latency_trace import LatencyTracer
+from common.stage_profiler import StageProfiler
+from common.mailbox import LatestValue, MailboxClosed
 
 file_path = os.path.abspath(os.path.dirname(__file__))
 
@@ -20,22 +32,66 @@ file_path = os.path.abspath(os.path.dirname(__file__))
 NUM_FINGERS = 6
 NODE_ID = 2
 
-gesture_queue = queue.Queue(maxsize=NUM_FINGERS)
-image_queue = queue.Queue(maxsize=1)
-
-video = cv2.VideoCapture(0)
-
-# 获取摄像头的分辨率
-width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))  # 摄像头帧宽度
-height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))  # 摄像头帧高度
-
-detector = HandDetector(maxHands=1, detectionCon=0.8)
-
-# 创建可调整大小的窗口
-cv2.namedWindow("Video", cv2.WINDOW_NORMAL)
-
-# 设置窗口大小为摄像头分辨率
-cv2.resizeWindow("Video", width, height)
+# Hand detection, see bench_hand_tracking.py for the speed of each setting
+TRACKING_ROI = True  # Search only around the hand of the previous frame
+INFERENCE_SIZE = None  # Downscale the image for the model to this size, e.g. 256, None for full resolution
+
+# Landmark backend, see bench_backends.py for speed and accuracy of each one
+# "legacy": mediapipe solutions API, MODEL_COMPLEXITY 0 (faster) or 1
+# "tasks": mediapipe Tasks hand landmarker, needs TASKS_MODEL_FILE
+# "onnx": hand landmark model in ONNX format run by onnxruntime, needs ONNX_MODEL_FILE
+LANDMARK_BACKEND = "legacy"
+MODEL_COMPLEXITY = 1
+TASKS_MODEL_FILE = file_path + "/models/hand_landmarker.task"
+ONNX_MODEL_FILE = file_path + "/models/hand_landmark.onnx"
+
+# "gesture": fingers are either open or closed, following fingersUp()
+# "proportional": finger positions follow the bend of the fingers continuously, see retarget.py
+CONTROL_MODE = "gesture"
+
+# Run the hand model on blank frames during startup, so the first real frame isn't slow
+MODEL_WARMUP = True
+MODEL_WARMUP_FRAMES = 2
+
+# Gesture debouncing in "gesture" mode, see gesture_state.py
+GESTURE_DWELL = 0.15  # Seconds a gesture must be held before it is sent
+GESTURE_HYSTERESIS = 0.1  # Seconds of different detections tolerated while a gesture is held
+THUMB_DELAY = 0.3  # Seconds between clearing the thumb and bending it, to avoid finger interference
+
+# Latency tracing from camera frame to Modbus write
+LATENCY_TRACE = False
+LATENCY_TRACE_FILE = file_path + "/latency_trace.json"
+LATENCY_REPORT_INTERVAL = 5  # seconds
+
+tracer = LatencyTracer(enabled=LATENCY_TRACE)
+
+# Rolling per-stage timing, enabled with --profile
+PROFILE_OVERLAY = True  # Draw the timing table onto the video
+PROFILE_CSV_FILE = file_path + "/stage_profile.csv"
+
+profiler = StageProfiler(enabled=False, csv_path=PROFILE_CSV_FILE)
+
+# Gesture icons, keyed by the finger pattern of thumb, index, middle, ring and pinky
+GESTURE_PICS = {
+    (0, 0, 0, 0, 0): "0.png",
+    (0, 1, 0, 0, 0): "1.png",
+    (0, 1, 1, 0, 0): "2.png",
+    (0, 1, 1, 1, 0): "3.png",
+    (0, 1, 1, 1, 1): "4.png",
+    (1, 1, 1, 1, 1): "5.png",
+}
+UNKNOWN_GESTURE_PIC = "unknown.png"
+GESTURE_PIC_SIZE = (161, 203)  # width, height
+GESTURE_PIC_AREA = (slice(0, GESTURE_PIC_SIZE[1]), slice(0, GESTURE_PIC_SIZE[0]))
+
+# Pipeline stages are connected by latest-value mailboxes, a slow stage skips stale
+# values instead of working through a backlog
+frame_box = LatestValue()  # grabber -> inference, (frame, trace, put time)
+gesture_box = LatestValue()  # inference -> actuator, (gesture, trace, put time)
+image_box = LatestValue()  # inference -> display, annotated frame
+stop_event = threading.Event()
+frames_processed = 0
+first_command_time = None  # time.perf_counter() of the first successful write
 
 def find_comport(port_name):
     """
@@ -49,16 +105,17 @@ def find_comport(port_name):
             return port.device
     return None
 
-def write_registers(client, address, values):
+def write_registers(client, address, values, node_id=NODE_ID):
     """
     Write data to Modbus device.
     :param client: Modbus client instance
     :param address: Register address
     :param values: Data to be written
+    :param node_id: Device address of the hand
     :return: True if successful, False otherwise
     """
     try:
-        resp = client.write_registers(address, values, NODE_ID)
+        resp = client.write_registers(address, values, node_id)
         if resp.isError():
             print("client.write_registers() returned", resp)
             return False
@@ -67,16 +124,17 @@ def write_registers(client, address, values):
         print("ModbusException:{0}".format(e))
         return False
 
-def read_registers(client, address, count):
+def read_registers(client, address, count, node_id=NODE_ID):
     """
     Read data from Modbus device.
     :param client: Modbus client instance
     :param address: Register address
     :param count: Register count to be read
+    :param node_id: Device address of the hand
     :return: List of registers if successful, None otherwise
     """
     try:
-        resp = client.read_holding_registers(address, count, NODE_ID)
+        resp = client.read_holding_registers(address, count, node_id)
         if resp.isError():
             return None
         return resp.registers
@@ -84,112 +142,400 @@ def read_registers(client, address, count):
         print("ModbusException:{0}".format(e))
         return None
 
-def camera_thread():
-    timer = 0
-    interval = 10
-    original_thumb_pos = 0
-    prev_index_pos = 0
+class ModbusSink:
+    """
+    Sends finger positions to the hand.
+    """
+
+    def __init__(self):
+        """
+        :raise IOError: If there is no serial port or the connection fails
+        """
+        port = find_comport("CH340") or find_comport("USB")
+        if port is None:
+            raise IOError("No serial port found")
+        self._client = ModbusSerialClient(port, FramerType.RTU, 115200)
+        if not self._client.connect():
+            raise IOError("Failed to connect to Modbus device on {0}".format(port))
+
+    def write(self, gesture, node_id=NODE_ID):
+        return write_registers(self._client, ROH_FINGER_POS_TARGET0, gesture, node_id)
+
+    def close(self):
+        self._client.close()
+
+class NullSink:
+    """
+    Discards finger positions, for running without a hand.
+    """
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, gesture, node_id=NODE_ID):
+        self.writes += 1
+        return True
+
+    def close(self):
+        pass
+
+SINKS = {"modbus": ModbusSink, "null": NullSink}
+
+def create_landmark_backend(name=LANDMARK_BACKEND, model_complexity=MODEL_COMPLEXITY, max_hands=1, detection_con=0.8):
+    """
+    :param name: "legacy", "tasks" or "onnx"
+    :return: Landmark backend for HandDetector
+    """
+    if name == "legacy":
+        return create_backend(name, maxHands=max_hands, modelComplexity=model_complexity, detectionCon=detection_con)
+    if name == "tasks":
+        return create_backend(name, modelPath=TASKS_MODEL_FILE, maxHands=max_hands, detectionCon=detection_con)
+    return create_backend(name, modelPath=ONNX_MODEL_FILE)
+
+def fingers_to_gesture(finger_up):
+    """
+    :param finger_up: Result of HandDetector.fingersUp()
+    :return: Finger positions of the gesture
+    """
+    gesture = [45000, 65535, 65535, 65535, 65535, 65535]
+
+    # Ignore bad gestures
+    if finger_up[1:5] != [0, 1, 0, 0]:
+        for i in range(len(finger_up)):
+            gesture[i] = int(gesture[i] * (1 - finger_up[i]))
+
+    return gesture
+
+class GestureIconCache:
+    """
+    Gesture icons decoded and resized once. Files are checked for changes at most
+    every check_interval seconds and only changed files are loaded again.
+    """
+
+    def __init__(self, directory, check_interval=1.0):
+        self._directory = directory
+        self._check_interval = check_interval
+        self._next_check = 0
+        self._icons = {}  # File name -> resized icon, None if it can't be loaded
+        self._mtimes = {}
+
+        for file_name in list(GESTURE_PICS.values()) + [UNKNOWN_GESTURE_PIC]:
+            self._load(file_name)
+
+    def _load(self, file_name):
+        path = os.path.join(self._directory, file_name)
+        try:
+            self._mtimes[file_name] = os.path.getmtime(path)
+        except OSError:
+            self._mtimes[file_name] = None
+
+        icon = cv2.imread(path)
+        if icon is None or not icon.any():
+            self._icons[file_name] = None
+        else:
+            self._icons[file_name] = cv2.resize(icon, GESTURE_PIC_SIZE)
+
+    def _refresh(self):
+        for file_name, mtime in list(self._mtimes.items()):
+            try:
+                changed = os.path.getmtime(os.path.join(self._directory, file_name)) != mtime
+            except OSError:
+                changed = mtime is not None
+            if changed:
+                self._load(file_name)
+
+    def get(self, pattern):
+        """
+        :param pattern: Finger pattern tuple, None if no hand is found
+        :return: Icon of the pattern, the unknown icon if there is none, None if it can't be loaded
+        """
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self._check_interval
+            self._refresh()
+
+        return self._icons[GESTURE_PICS.get(pattern, UNKNOWN_GESTURE_PIC)]
+
+
+def grabber_thread(source):
+    """
+    Read frames as fast as the camera delivers them, keeping only the newest one.
+    Frames of a file are all processed, the next one is read once the previous one is taken.
+    """
+    while not stop_event.is_set():
+        with profiler.stage("capture"):
+            img = source.read()
+        if img is None:
+            if source.finite:
+                break
+            time.sleep(0.01)
+            continue
+        frame_box.put((img, tracer.begin(), time.perf_counter()))
+        if source.finite:
+            frame_box.wait_read()
+
+    frame_box.close()
+
+def inference_thread(detector, headless):
+    """
+    Detect the hand in the newest frame and publish the gesture and the annotated frame.
+    :param headless: Skip drawing and the annotated frame
+    """
+    global frames_processed
+
+    icon_cache = None if headless else GestureIconCache(file_path + "/gestures")
+    retargeter = Retargeter()
+    state = GestureStateMachine([0, 0, 0, 0, 0, 0], GESTURE_DWELL, GESTURE_HYSTERESIS, THUMB_DELAY)
+    roi = None
+    thumb_rotation = 0
 
     while True:
-        _, img = video.read()
-        img = cv2.flip(img, 1)
-        hand = detector.findHands(img, draw=True)
-        gesture_pic = cv2.imread(file_path + "/gestures/unknown.png")
-        gesture = [45000, 65535, 65535, 65535, 65535, 65535]
-
-        if hand:
-            lmlist = hand[0]
-
-            if lmlist and lmlist[0]:
-                try:
-                    finger_up = detector.fingersUp(lmlist[0])
-
-                    # Ignore bad gestures
-                    if finger_up[1:5] != [0, 1, 0, 0]:
-                        for i in range(len(finger_up)):
-                            gesture[i] = int(gesture[i] * (1 - finger_up[i]))
-                except Exception as e:
-                    print(str(e))
-
-                if finger_up[:5] == [0, 0, 0, 0, 0]:
-                    gesture_pic = cv2.imread(file_path + "/gestures/0.png")
-                elif finger_up[:5] == [0, 1, 0, 0, 0]:
-                    gesture_pic = cv2.imread(file_path + "/gestures/1.png")
-                elif finger_up[:5] == [0, 1, 1, 0, 0]:
-                    gesture_pic = cv2.imread(file_path + "/gestures/2.png")
-                elif finger_up[:5] == [0, 1, 1, 1, 0]:
-                    gesture_pic = cv2.imread(file_path + "/gestures/3.png")
-                elif finger_up[:5] == [0, 1, 1, 1, 1]:
-                    gesture_pic = cv2.imread(file_path + "/gestures/4.png")
-                elif finger_up[:5] == [1, 1, 1, 1, 1]:
-                    gesture_pic = cv2.imread(file_path + "/gestures/5.png")
-            else:
-                gesture = [0, 0, 0, 0, 0, 0]
-
-        if gesture_pic.any():
-            gesture_pic = cv2.resize(gesture_pic, (161, 203))
-            img[0:203, 0:161] = gesture_pic
-
-        # To avoid finger interference
-        if gesture[0] > 0 and gesture[5] > 0:
-            if prev_index_pos != gesture[1]:
-                timer = 0
-                prev_index_pos = gesture[1]
-    
-            if timer == 0:
-                original_thumb_pos = gesture[0]
-            timer += 1
-
-            if timer <= interval:
-                gesture[0] = 0
-            else:
-                gesture[0] = original_thumb_pos
+        try:
+            img, trace, put_time = frame_box.get()
+        except MailboxClosed:
+            break
+        trace.mark("frame_wait")
+        profiler.add("frame_wait", time.perf_counter() - put_time)
+        with profiler.stage("flip"):
+            img = cv2.flip(img, 1)
+        trace.mark("flip")
+        hands, img = detector.findHands(img, draw=not headless, roi=roi)
+        if TRACKING_ROI:
+            roi = detector.nextROI(hands, img.shape)
+        trace.mark("detect")
+        pattern = None
+
+        if hands:
+            finger_up = detector.fingersUp(hands[0], thumb_rotation)
+            thumb_rotation = finger_up[5]
+            gesture = fingers_to_gesture(finger_up)
+            pattern = tuple(finger_up[:5])
+
+            if CONTROL_MODE == "proportional":
+                gesture = retargeter(hands[0].landmarks)
         else:
-            if timer > 0:
-                gesture[0] = original_thumb_pos
-            timer = 0
+            gesture = [0, 0, 0, 0, 0, 0]
+            retargeter.reset()
 
-        if not gesture_queue.full():
-            gesture_queue.put(gesture)
-        if not image_queue.full():
-            image_queue.put(img)
+        trace.mark("gesture")
 
-def main():
-    client = ModbusSerialClient(find_comport("CH340") or find_comport("USB"), FramerType.RTU, 115200)
-    if not client.connect():
-        print("连接Modbus设备失败\nFailed to connect to Modbus device")
-        exit(-1)
+        if not headless:
+            with profiler.stage("overlay"):
+                gesture_pic = icon_cache.get(pattern)
+                if gesture_pic is not None:
+                    img[GESTURE_PIC_AREA] = gesture_pic
+            trace.mark("overlay")
 
-    prev_gesture = [0, 0, 0, 0, 0, 0]
-    last_time = time.time()
+            if PROFILE_OVERLAY:
+                profiler.draw(img)
+            image_box.put(img)
+        frames_processed += 1
+        profiler.log()
+
+        if CONTROL_MODE == "gesture":
+            gesture = state.update(gesture)
+
+        if gesture is None:
+            # No committed change, nothing to send. The trace ends here, so the vision stages
+            # are reported for every frame, not only for frames which moved the hand
+            tracer.finish(trace)
+            tracer.report(LATENCY_REPORT_INTERVAL)
+            continue
+
+        gesture_box.put((gesture, trace, time.perf_counter()))
+
+    gesture_box.close()
+    image_box.close()
 
-    threading.Thread(target=camera_thread, daemon=True).start()
+def actuator_thread(sink):
+    """
+    Write the newest gesture to the hand, gestures published meanwhile are skipped.
+    """
+    global first_command_time
+
+    prev_gesture = [0, 0, 0, 0, 0, 0]
 
     while True:
-        gesture = gesture_queue.get()
-        if not image_queue.empty():
-            img = image_queue.get()
-            cv2.putText(img, "Try with gestures", (16, 272), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 255, 0), 5)
-            cv2.imshow("Video", img)
+        try:
+            gesture, trace, put_time = gesture_box.get()
+        except MailboxClosed:
+            break
+        trace.mark("queue")
+        profiler.add("queue_wait", time.perf_counter() - put_time)
 
         if (prev_gesture != gesture):
-            # When the gesture change time is less than 0.7 seconds, the thumb will remain open
-            current_time = time.time()
-            if (current_time - last_time < 0.7):
-                gesture[0] = 0
-            else:
-                last_time = current_time
-
-            if not write_registers(client, ROH_FINGER_POS_TARGET0, gesture):
+            with profiler.stage("modbus_write"):
+                success = sink.write(gesture)
+            if not success:
                 print("写入目标位置失败\nFailed to write target position")
+            elif first_command_time is None:
+                first_command_time = time.perf_counter()
             prev_gesture = gesture
+            trace.mark("modbus_write")
+
+        tracer.finish(trace)
+        tracer.report(LATENCY_REPORT_INTERVAL)
+
+def display():
+    """
+    Show the annotated frames until 'q' is pressed or the source ends.
+    Display stays in the main thread, GUI calls are not thread safe on every platform.
+    """
+    while True:
+        try:
+            img = image_box.get(timeout=0.1)
+        except MailboxClosed:
+            break
+        if img is not None:
+            cv2.putText(img, "Try with gestures", (16, 272), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 255, 0), 5)
+            cv2.imshow("Video", img)
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
 
-    video.release()
     cv2.destroyAllWindows()
-    client.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Control ROHand with hand gestures from a camera")
+    parser.add_argument("--source", default="0", help="camera index, video file or image directory (default: 0)")
+    parser.add_argument("--headless", action="store_true", help="no drawing or display, print throughput and stage timings")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every stage, shown on the video and logged to stage_profile.csv")
+    parser.add_argument("--sink", choices=SINKS.keys(), default="modbus", help="where finger positions go (default: modbus)")
+    return parser.parse_args()
+
+class Application:
+    """
+    Serial port, frame source and hand model are initialized in parallel when the
+    application starts, the first failure stops the start.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.sink = None
+        self.source = None
+        self.detector = None
+
+    def _open_sink(self):
+        self.sink = SINKS[self.args.sink]()
+
+    def _open_source(self):
+        self.source = open_source(self.args.source)
+
+    def _create_detector(self):
+        self.detector = HandDetector(maxHands=1, detectionCon=0.8, inferenceSize=INFERENCE_SIZE,
+                                     profiler=profiler if self.args.profile else None,
+                                     backend=create_landmark_backend())
+
+        if MODEL_WARMUP:
+            # The first inferences are much slower, run them before real frames arrive
+            img = np.zeros((480, 640, 3), dtype=np.uint8)
+            for _ in range(MODEL_WARMUP_FRAMES):
+                self.detector.findHands(img, draw=False)
+
+    def initialize(self):
+        """
+        :return: True if every component is ready, False otherwise
+        """
+        t = time.perf_counter()
+        results = queue.Queue()
+
+        def init(name, func):
+            start = time.perf_counter()
+            try:
+                func()
+                results.put((name, None, time.perf_counter() - start))
+            except Exception as e:
+                results.put((name, e, time.perf_counter() - start))
+
+        components = [("sink", self._open_sink), ("source", self._open_source), ("model", self._create_detector)]
+        # Daemon threads, so a failure exits at once instead of waiting for the model to load
+        for name, func in components:
+            threading.Thread(target=init, args=(name, func), daemon=True).start()
+
+        if not self.args.headless:
+            # GUI calls stay in the main thread, done while the others initialize
+            cv2.namedWindow("Video", cv2.WINDOW_NORMAL)
+
+        for _ in components:
+            name, error, seconds = results.get()
+            if error is not None:
+                print("初始化{0}失败\nFailed to initialize {0}: {1}".format(name, error))
+                return False
+            print("{0} ready in {1:.2f}s".format(name, seconds))
+
+        if not self.args.headless:
+            # 设置窗口大小为摄像头分辨率
+            width, height = self.source.size
+            cv2.resizeWindow("Video", width, height)
+
+        print("Initialized in {0:.2f}s, {1:.2f}s after start".format(time.perf_counter() - t, time.perf_counter() - START_TIME))
+        return True
+
+    def close(self):
+        if self.source is not None:
+            self.source.release()
+        if self.sink is not None:
+            self.sink.close()
+
+    def run(self):
+        args = self.args
+        profiler.enabled = args.profile
+        if args.headless:
+            tracer.enabled = True
+
+        threads = [
+            threading.Thread(target=grabber_thread, args=(self.source,), daemon=True),
+            threading.Thread(target=inference_thread, args=(self.detector, args.headless), daemon=True),
+            threading.Thread(target=actuator_thread, args=(self.sink,), daemon=True),
+        ]
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        if args.headless:
+            try:
+                threads[1].join()
+            except KeyboardInterrupt:
+                pass
+        else:
+            display()
+        elapsed = time.perf_counter() - start_time
+
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=1)
+
+        print("Frames skipped by inference: {0}, gestures skipped by actuator: {1}".format(frame_box.dropped, gesture_box.dropped))
+        print("{0} frames in {1:.1f}s, {2:.1f} frames/s".format(frames_processed, elapsed, frames_processed / elapsed))
+        if first_command_time is not None:
+            print("Time to first command: {0:.2f}s".format(first_command_time - START_TIME))
+
+        if args.headless:
+            print(tracer.summary())
+
+        if args.profile:
+            print(profiler.summary())
+            profiler.close()
+            print("Stage profile saved to {0}".format(PROFILE_CSV_FILE))
+
+        if LATENCY_TRACE:
+            print(tracer.summary())
+            tracer.dump(LATENCY_TRACE_FILE)
+            print("Latency trace saved to {0}".format(LATENCY_TRACE_FILE))
+
+def main():
+    app = Application(parse_args())
+    if not app.initialize():
+        app.close()
+        # Components still initializing are in native code, exit without waiting for them
+        sys.stdout.flush()
+        os._exit(-1)
+
+    try:
+        app.run()
+    finally:
+        app.close()
 
 if __name__ == "__main__":
     main()
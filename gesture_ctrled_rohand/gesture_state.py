@@ -0,0 +1,88 @@
+# Debounced gesture state machine, independent of the frame rate
+#
+# A gesture is committed once it has been seen for the dwell time. Different
+# gestures seen for less than the hysteresis time are treated as detection glitches
+# and don't restart the dwell. When fingers move while the thumb is bent, the thumb
+# is cleared first and bent again after the thumb delay, so it doesn't collide with
+# the other fingers.
+
+import time
+
+THUMB = 0
+
+
+class GestureStateMachine:
+    def __init__(self, initial, dwell=0.15, hysteresis=0.1, thumb_delay=0.3):
+        """
+        :param initial: Finger positions the hand is at
+        :param dwell: Seconds a gesture must be seen before it is committed
+        :param hysteresis: Seconds a different gesture may be seen without restarting the dwell
+        :param thumb_delay: Seconds between clearing the thumb and bending it again
+        """
+        self._dwell = dwell
+        self._hysteresis = hysteresis
+        self._thumb_delay = thumb_delay
+
+        self.committed = list(initial)
+        self._output = list(initial)  # Last emitted command
+        self._candidate = None
+        self._candidate_since = 0.0
+        self._candidate_seen = 0.0
+        self._pending = None  # Command emitted once the thumb delay has passed
+        self._pending_time = 0.0
+
+    def update(self, gesture, now=None):
+        """
+        :param gesture: Finger positions detected in the current frame
+        :param now: time.monotonic() of the frame, now if None
+        :return: Finger positions to send, None if nothing changes
+        """
+        if now is None:
+            now = time.monotonic()
+
+        if gesture == self._candidate:
+            self._candidate_seen = now
+        elif self._candidate is None or now - self._candidate_seen >= self._hysteresis:
+            self._candidate = list(gesture)
+            self._candidate_since = self._candidate_seen = now
+
+        if self._candidate != self.committed and self._candidate_seen - self._candidate_since >= self._dwell:
+            return self._commit(self._candidate, now)
+
+        return self.poll(now)
+
+    def poll(self, now=None):
+        """
+        :return: The second step of a sequenced transition once it is due, None otherwise
+        """
+        if self._pending is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        if now < self._pending_time:
+            return None
+
+        command, self._pending = self._pending, None
+        return self._emit(command)
+
+    def _commit(self, gesture, now):
+        self.committed = list(gesture)
+        self._pending = None
+
+        fingers_move = gesture[THUMB + 1:] != self._output[THUMB + 1:]
+        if fingers_move and (self._output[THUMB] > 0 or gesture[THUMB] > 0):
+            # Thumb clear before the other fingers move, bend it afterwards
+            cleared = list(gesture)
+            cleared[THUMB] = 0
+            if gesture[THUMB] > 0:
+                self._pending = list(gesture)
+                self._pending_time = now + self._thumb_delay
+            return self._emit(cleared)
+
+        return self._emit(gesture)
+
+    def _emit(self, command):
+        if command == self._output:
+            return None
+        self._output = list(command)
+        return list(command)
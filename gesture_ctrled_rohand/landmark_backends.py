@@ -0,0 +1,167 @@
+# Hand landmark inference backends of HandDetector
+#
+# Every backend takes an RGB image and returns the hands found in it as
+# (landmarks, handedness): landmarks is a float32 array of shape (21, 3) with x and y
+# normalized to the image size and z in the scale of x, handedness is "Left" or "Right"
+# as reported by the model.
+#
+# Backends which track a hand from frame to frame do so only for full frames. Images
+# passed with static=True, e.g. crops of a region that moves with the hand, don't
+# continue the previous image, so the hands are detected in every one of them.
+
+import os
+
+import cv2
+import numpy as np
+
+NUM_LANDMARKS = 21
+
+
+class LegacyBackend:
+    """
+    mediapipe solutions API, model complexity 0 (lite) or 1 (full).
+    """
+
+    name = "legacy"
+
+    def __init__(self, maxHands=2, modelComplexity=1, detectionCon=0.5, minTrackCon=0.5, staticMode=False):
+        import mediapipe as mp
+
+        self._mp = mp
+        self._options = dict(max_num_hands=maxHands,
+                             model_complexity=modelComplexity,
+                             min_detection_confidence=detectionCon,
+                             min_tracking_confidence=minTrackCon)
+        self._hands = mp.solutions.hands.Hands(static_image_mode=staticMode, **self._options)
+        self._staticHands = self._hands if staticMode else None  # Created on the first static image
+
+    def process(self, imgRGB, static=False):
+        if static and self._staticHands is None:
+            self._staticHands = self._mp.solutions.hands.Hands(static_image_mode=True, **self._options)
+        results = (self._staticHands if static else self._hands).process(imgRGB)
+        if not results.multi_hand_landmarks:
+            return []
+
+        return [
+            (np.array([(lm.x, lm.y, lm.z) for lm in handLms.landmark], dtype=np.float32),
+             handType.classification[0].label)
+            for handType, handLms in zip(results.multi_handedness, results.multi_hand_landmarks)
+        ]
+
+    def close(self):
+        self._hands.close()
+        if self._staticHands is not None and self._staticHands is not self._hands:
+            self._staticHands.close()
+
+
+class TasksBackend:
+    """
+    mediapipe Tasks HandLandmarker in video mode, needs a hand_landmarker.task model file.
+    """
+
+    name = "tasks"
+
+    def __init__(self, modelPath, maxHands=2, detectionCon=0.5, minTrackCon=0.5):
+        import mediapipe as mp
+        from mediapipe.tasks import python as mp_tasks
+        from mediapipe.tasks.python import vision
+
+        if not os.path.exists(modelPath):
+            raise IOError("Model file {0} not found".format(modelPath))
+
+        def options(running_mode):
+            return vision.HandLandmarkerOptions(
+                base_options=mp_tasks.BaseOptions(model_asset_path=modelPath),
+                running_mode=running_mode,
+                num_hands=maxHands,
+                min_hand_detection_confidence=detectionCon,
+                min_hand_presence_confidence=minTrackCon,
+                min_tracking_confidence=minTrackCon,
+            )
+
+        self._mp = mp
+        self._landmarker = vision.HandLandmarker.create_from_options(options(vision.RunningMode.VIDEO))
+        self._createStatic = lambda: vision.HandLandmarker.create_from_options(options(vision.RunningMode.IMAGE))
+        self._staticLandmarker = None  # Created on the first static image
+        self._timestamp_ms = 0
+
+    def process(self, imgRGB, static=False):
+        image = self._mp.Image(image_format=self._mp.ImageFormat.SRGB, data=np.ascontiguousarray(imgRGB))
+        if static:
+            if self._staticLandmarker is None:
+                self._staticLandmarker = self._createStatic()
+            result = self._staticLandmarker.detect(image)
+        else:
+            # Video mode needs strictly increasing timestamps, frame times don't matter otherwise
+            self._timestamp_ms += 1
+            result = self._landmarker.detect_for_video(image, self._timestamp_ms)
+
+        return [
+            (np.array([(lm.x, lm.y, lm.z) for lm in landmarks], dtype=np.float32), handedness[0].category_name)
+            for landmarks, handedness in zip(result.hand_landmarks, result.handedness)
+        ]
+
+    def close(self):
+        self._landmarker.close()
+        if self._staticLandmarker is not None:
+            self._staticLandmarker.close()
+
+
+class OnnxBackend:
+    """
+    Hand landmark model in ONNX format run by onnxruntime on the CPU, e.g. the mediapipe
+    hand landmark model converted to ONNX. The model has no palm detector, it expects the
+    hand to fill the image, so use it with ROI tracking of HandDetector and a hand that
+    starts close to the camera.
+
+    Input: float32 image of shape (1, size, size, 3), RGB in 0..1.
+    Outputs: landmarks of shape (1, 63) in input pixels, hand presence score of shape (1, 1),
+    handedness score of shape (1, 1), 1 for a right hand.
+    """
+
+    name = "onnx"
+
+    def __init__(self, modelPath, presenceCon=0.5):
+        import onnxruntime
+
+        if not os.path.exists(modelPath):
+            raise IOError("Model file {0} not found".format(modelPath))
+
+        self._session = onnxruntime.InferenceSession(modelPath, providers=["CPUExecutionProvider"])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._size = model_input.shape[1] if isinstance(model_input.shape[1], int) else 224
+        self._presenceCon = presenceCon
+
+    def process(self, imgRGB, static=False):
+        # Every image is processed on its own, static doesn't change anything
+        h, w = imgRGB.shape[:2]
+        # Letterbox to a square input, keeping the aspect ratio
+        scale = self._size / max(w, h)
+        resized = cv2.resize(imgRGB, (max(1, round(w * scale)), max(1, round(h * scale))))
+        blob = np.zeros((1, self._size, self._size, 3), dtype=np.float32)
+        blob[0, :resized.shape[0], :resized.shape[1]] = resized / np.float32(255)
+
+        landmarks, presence, handedness = self._session.run(None, {self._input_name: blob})[:3]
+        if float(np.ravel(presence)[0]) < self._presenceCon:
+            return []
+
+        landmarks = landmarks.reshape(NUM_LANDMARKS, 3).astype(np.float32) / scale
+        landmarks /= np.array([w, h, w], dtype=np.float32)
+        return [(landmarks, "Right" if float(np.ravel(handedness)[0]) > 0.5 else "Left")]
+
+    def close(self):
+        pass
+
+
+BACKENDS = {cls.name: cls for cls in [LegacyBackend, TasksBackend, OnnxBackend]}
+
+
+def create_backend(name, **kwargs):
+    """
+    :param name: "legacy", "tasks" or "onnx"
+    :param kwargs: Arguments of the backend
+    :raise IOError: If a model file is missing
+    :raise ImportError: If the library of the backend is not installed
+    """
+    return BACKENDS[name](**kwargs)
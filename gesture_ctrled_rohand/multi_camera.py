@@ -0,0 +1,211 @@
+# Control several ROHands from several cameras, one camera per hand
+#
+# Hand detection of every camera runs in its own process, mediapipe holds the GIL for
+# much of its work so threads would not run in parallel. The process keeps the
+# tracking state of its stream, so frames of a stream are processed in order. Gesture
+# commands come back through a queue and the parent process, the only owner of the
+# Modbus port, writes them to the node of the stream.
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gesture_ctrled_hand import (
+    GESTURE_DWELL,
+    GESTURE_HYSTERESIS,
+    INFERENCE_SIZE,
+    SINKS,
+    THUMB_DELAY,
+    TRACKING_ROI,
+    create_landmark_backend,
+    fingers_to_gesture,
+)
+from common.mailbox import LatestValue, MailboxClosed
+from frame_sources import open_source
+from gesture_state import GestureStateMachine
+from HandTrackingModule import HandDetector
+
+# Camera index, video file or image directory, and node ID of the hand it controls
+STREAMS = [("0", 2), ("1", 3)]
+
+STATS_INTERVAL = 5  # seconds
+
+
+def _latest_frames(source, stop):
+    """
+    Read a live source in a thread and keep only the newest frame.
+    """
+    frames = LatestValue()
+
+    def grab():
+        while not stop.is_set():
+            img = source.read()
+            if img is None:
+                time.sleep(0.01)
+                continue
+            frames.put(img)
+        frames.close()
+
+    threading.Thread(target=grab, daemon=True).start()
+    return frames
+
+
+def stream_worker(index, source_name, results, stop, max_frames=None):
+    """
+    Detect gestures of one stream, runs in a separate process.
+    :param index: Index of the stream
+    :param source_name: Camera index, video file or image directory
+    :param results: Queue receiving ("gesture", index, seq, gesture), ("stats", index, frames, seconds)
+                    and a final ("done", index, frames, seconds)
+    :param stop: Event set by the parent to stop
+    :param max_frames: Stop after this many frames, None for no limit
+    """
+    try:
+        source = open_source(source_name)
+    except IOError as e:
+        print("打开输入失败\nFailed to open source: {0}".format(e))
+        results.put(("done", index, 0, 0.0))
+        return
+
+    frames = None if source.finite else _latest_frames(source, stop)
+    detector = HandDetector(maxHands=1, detectionCon=0.8, inferenceSize=INFERENCE_SIZE, backend=create_landmark_backend())
+    state = GestureStateMachine([0, 0, 0, 0, 0, 0], GESTURE_DWELL, GESTURE_HYSTERESIS, THUMB_DELAY)
+    roi = None
+    thumb_rotation = 0
+
+    seq = 0
+    start_time = last_stats = time.perf_counter()
+    while not stop.is_set() and (max_frames is None or seq < max_frames):
+        if frames is None:
+            img = source.read()
+            if img is None:
+                break
+        else:
+            try:
+                img = frames.get(timeout=0.1)
+            except MailboxClosed:
+                break
+            if img is None:
+                continue
+
+        img = cv2.flip(img, 1)
+        hands, img = detector.findHands(img, draw=False, roi=roi)
+        if TRACKING_ROI:
+            roi = detector.nextROI(hands, img.shape)
+
+        if hands:
+            finger_up = detector.fingersUp(hands[0], thumb_rotation)
+            thumb_rotation = finger_up[5]
+            gesture = fingers_to_gesture(finger_up)
+        else:
+            gesture = [0, 0, 0, 0, 0, 0]
+
+        gesture = state.update(gesture)
+        if gesture is not None:
+            results.put(("gesture", index, seq, gesture))
+        seq += 1
+
+        now = time.perf_counter()
+        if now - last_stats >= STATS_INTERVAL:
+            last_stats = now
+            results.put(("stats", index, seq, now - start_time))
+
+    source.release()
+    results.put(("done", index, seq, time.perf_counter() - start_time))
+
+
+def run(streams, sink, max_frames=None, verbose=True):
+    """
+    Run one worker process per stream and send their gestures to the sink.
+    :param streams: List of (source, node ID)
+    :param sink: Sink with write(gesture, node_id)
+    :param max_frames: Frames per stream, None for no limit
+    :return: List of (frames, seconds) per stream
+    """
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    workers = [
+        multiprocessing.Process(target=stream_worker, args=(i, source, results, stop, max_frames), daemon=True)
+        for i, (source, _) in enumerate(streams)
+    ]
+    for worker in workers:
+        worker.start()
+
+    stats = [(0, 0.0)] * len(streams)
+    last_seq = [-1] * len(streams)
+    running = len(streams)
+
+    try:
+        while running > 0:
+            try:
+                kind, index, *data = results.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+
+            if kind == "gesture":
+                seq, gesture = data
+                if seq <= last_seq[index]:
+                    continue  # Never send an older frame's command after a newer one
+                last_seq[index] = seq
+                if not sink.write(gesture, streams[index][1]):
+                    print("写入目标位置失败\nFailed to write target position, node {0}".format(streams[index][1]))
+            else:
+                stats[index] = tuple(data)
+                if kind == "done":
+                    running -= 1
+                if verbose:
+                    print(format_stats(streams, stats))
+    except KeyboardInterrupt:
+        pass
+
+    stop.set()
+    for worker in workers:
+        worker.join(timeout=2)
+
+    return stats
+
+
+def format_stats(streams, stats):
+    return ", ".join(
+        "{0}->{1}: {2:.1f} frames/s".format(source, node_id, frames / seconds if seconds > 0 else 0.0)
+        for (source, node_id), (frames, seconds) in zip(streams, stats)
+    )
+
+
+def parse_stream(text):
+    source, node_id = text.rsplit(":", 1)
+    return source, int(node_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control several ROHands from several cameras")
+    parser.add_argument("--stream", action="append", type=parse_stream, metavar="SOURCE:NODE_ID",
+                        help="camera index, video file or image directory and node ID of its hand, repeat per stream")
+    parser.add_argument("--sink", choices=SINKS.keys(), default="modbus", help="where finger positions go (default: modbus)")
+    args = parser.parse_args()
+
+    streams = args.stream or STREAMS
+    try:
+        sink = SINKS[args.sink]()
+    except IOError as e:
+        print("连接Modbus设备失败\nFailed to connect to Modbus device: {0}".format(e))
+        exit(-1)
+    try:
+        stats = run(streams, sink)
+    finally:
+        sink.close()
+
+    print(format_stats(streams, stats))
+
+
+if __name__ == "__main__":
+    main()
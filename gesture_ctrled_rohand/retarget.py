@@ -0,0 +1,90 @@
+# Continuous retargeting of hand landmarks to proportional ROH finger positions
+#
+# Flexion of every finger is taken from the bend angles of its joints in 3D, thumb
+# rotation from the spread angle between thumb and index finger. Both are mapped
+# through calibration curves to 0..1 and then to register values.
+
+import numpy as np
+
+from HandTrackingModule import joint_angles, thumb_spread_angles
+
+NUM_FINGERS = 6  # Thumb, index, middle, ring, little, thumb rotation
+
+# Register value of a fully closed finger, thumb flexion is limited to avoid hitting the palm
+MAX_POS = np.array([45000, 65535, 65535, 65535, 65535, 65535], dtype=np.float32)
+
+# Calibration curves, (measured angles in degrees, normalized positions 0..1)
+# Flexion: sum of the bend angles of the three joints of a finger, open hand to fist
+# Thumb rotation: spread angle, see thumb_spread_angles(). Wide spread means not rotated.
+FLEXION_CURVES = [
+    ([30, 60, 110], [0, 0.4, 1]),  # Thumb
+    ([25, 120, 230], [0, 0.5, 1]),  # Index
+    ([25, 120, 240], [0, 0.5, 1]),  # Middle
+    ([25, 120, 240], [0, 0.5, 1]),  # Ring
+    ([25, 110, 220], [0, 0.5, 1]),  # Little
+    ([97, 125], [1, 0]),  # Thumb rotation
+]
+
+
+class Retargeter:
+    """
+    Converts hand landmarks to target positions of the six ROH fingers, smoothed and with a deadband
+    so small changes don't produce Modbus writes.
+    """
+
+    def __init__(self, curves=FLEXION_CURVES, smoothing=0.5, deadband=300, max_step=8000):
+        """
+        :param curves: Calibration curve per finger, see FLEXION_CURVES
+        :param smoothing: Weight of the previous value in exponential smoothing, 0 disables smoothing
+        :param deadband: Minimum change of any finger, in register units, before new targets are published
+        :param max_step: Maximum change of a finger per call, in register units, to keep command deltas small
+        """
+        self._curves = [(np.asarray(xp, dtype=np.float32), np.asarray(fp, dtype=np.float32)) for xp, fp in curves]
+        self._smoothing = smoothing
+        self._deadband = deadband
+        self._max_step = max_step
+        self._smoothed = None
+        self._published = None
+
+    def reset(self):
+        """
+        Forget the history, e.g. when the hand is lost.
+        """
+        self._smoothed = None
+        self._published = None
+
+    def angles(self, landmarks):
+        """
+        :param landmarks: Landmarks of shape (..., 21, 3)
+        :return: Measured angles of shape (..., 6), the inputs of the calibration curves
+        """
+        flexion = joint_angles(landmarks).sum(axis=-1)
+        return np.concatenate([flexion, thumb_spread_angles(landmarks)[..., None]], axis=-1)
+
+    def normalize(self, angles):
+        """
+        Map measured angles through the calibration curves.
+        :param angles: Angles of shape (..., 6)
+        :return: Positions of shape (..., 6), 0 open and 1 closed
+        """
+        return np.stack([np.interp(angles[..., i], xp, fp) for i, (xp, fp) in enumerate(self._curves)], axis=-1)
+
+    def __call__(self, landmarks):
+        """
+        :param landmarks: Landmarks of one hand, shape (21, 3)
+        :return: List of six target positions, None if the change is within the deadband
+        """
+        target = self.normalize(self.angles(landmarks)) * MAX_POS
+
+        if self._smoothed is None:
+            self._smoothed = target
+        else:
+            target = self._smoothing * self._smoothed + (1 - self._smoothing) * target
+            step = np.clip(target - self._smoothed, -self._max_step, self._max_step)
+            self._smoothed = self._smoothed + step
+
+        if self._published is not None and np.max(np.abs(self._smoothed - self._published)) < self._deadband:
+            return None
+
+        self._published = self._smoothed.copy()
+        return [int(pos) for pos in np.round(self._published)]
@@ -11,6 +11,7 @@ from serial.tools import list_ports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from common.roh_registers_v1 import *
+from common.latency_trace import NULL_TRACE, LatencyTracer
 
 
 # ROHand configuration
@@ -21,6 +22,11 @@ NUM_FINGERS = 6
 TOLERANCE = round(65536 / 32)  # 判断目标位置变化的阈值，位置控制模式时为整数，角度控制模式时为浮点数
 SPEED_CONTROL_THRESHOLD = 8192  # 位置变化低于该值时，线性调整手指运动速度
 
+# Latency tracing from glove sample to Modbus write
+LATENCY_TRACE = False
+LATENCY_TRACE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "latency_trace.json")
+LATENCY_REPORT_INTERVAL = 5  # seconds
+
 def clamp(n, smallest, largest):
     return max(smallest, min(n, largest))
 
@@ -100,7 +106,8 @@ class Application:
             print("连接Modbus设备失败\nFailed to connect to Modbus device")
             exit(-1)
 
-        pos_input = PosInput()
+        tracer = LatencyTracer(enabled=LATENCY_TRACE)
+        pos_input = PosInput(tracer)
 
         if not await pos_input.start():
             print("初始化失败,退出\nFailed to initialize, exit.")
@@ -108,6 +115,8 @@ class Application:
 
         while not self.terminated:
             finger_data = await pos_input.get_position()
+            # Take the trace of a new sample, so it is finished only once
+            trace, pos_input.last_trace = pos_input.last_trace, NULL_TRACE
 
             pos = [0 for _ in range(NUM_FINGERS)]
             target_changed = False
@@ -130,6 +139,7 @@ class Application:
                     print("读取位置指令发送失败\nFailed to send read pos command")
                     print(f"read_registers({ROH_FINGER_POS0}, {NUM_FINGERS}, {NODE_ID}) returned {resp})")
                     continue
+                trace.mark("read_pos")
 
                 speed = [0 for _ in range(NUM_FINGERS)]
 
@@ -140,14 +150,23 @@ class Application:
                 # Set speed
                 if not self.write_registers(client, ROH_FINGER_SPEED0, speed):
                     print("设置速度失败\nFailed to set speed")
+                trace.mark("write_speed")
 
                 # Control the ROHand
                 if not self.write_registers(client, ROH_FINGER_POS_TARGET0, pos):
                     print("设置位置失败\nFailed to set pos")
+                trace.mark("write_pos")
+                tracer.finish(trace)
+                tracer.report(LATENCY_REPORT_INTERVAL)
 
         await pos_input.stop()
         client.close()
 
+        if LATENCY_TRACE:
+            print(tracer.summary())
+            tracer.dump(LATENCY_TRACE_FILE)
+            print("Latency trace saved to {0}".format(LATENCY_TRACE_FILE))
+
 
 if __name__ == "__main__":
     app = Application()
@@ -8,6 +8,7 @@ current_dir = os.path.dirname(os.path.realpath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
+from common.latency_trace import NULL_TRACE
 from lib_gforce import gforce
 from lib_gforce.gforce import EmgRawDataConfig, SampleResolution
 
@@ -20,21 +21,46 @@ DEV_MIN_RSSI = -128
 SAMPLE_RESOLUTION = 12
 
 # Channel0: thumb, Channel1: index, Channel2: middle, Channel3: ring, Channel4: pinky, Channel5: thumb root
+# Only these channels are streamed from the device
 INDEX_CHANNELS = [7, 6, 0, 3, 4, 5]
 
 NUM_FINGERS = 6
 
 
+def emg_raw_data_config(resolution=SAMPLE_RESOLUTION) -> EmgRawDataConfig:
+    """
+    EMG raw data configuration streaming INDEX_CHANNELS. A packet holds whole samples of
+    all streamed channels, so batch_len is a multiple of the channel count.
+    :param resolution: 8 or 12 bits
+    """
+    if resolution == 12:
+        return EmgRawDataConfig.for_channels(
+            INDEX_CHANNELS, fs=100, batch_len=len(INDEX_CHANNELS) * 8, resolution=SampleResolution.BITS_12
+        )
+    return EmgRawDataConfig.for_channels(INDEX_CHANNELS, batch_len=len(INDEX_CHANNELS) * 3)
+
+
 class PosInputBleGlove:
 
-    def __init__(self):
+    def __init__(self, tracer=None):
+        """
+        :param tracer: LatencyTracer, the trace of the sample used by get_position() is left in last_trace
+        """
         self._gforce_device = gforce.GForce(DEV_NAME_PREFIX, DEV_MIN_RSSI)
+        if tracer is not None and tracer.enabled:
+            self._gforce_device.tracer = tracer
+        self.last_trace = NULL_TRACE
         self._emg_data = [0 for _ in range(NUM_FINGERS)]
         self._emg_min = [65535 for _ in range(NUM_FINGERS)]
         self._emg_max = [0 for _ in range(NUM_FINGERS)]
         self._pre_finger_data = [0 for _ in range(NUM_FINGERS)]
+        self._columns = INDEX_CHANNELS  # Columns of INDEX_CHANNELS in the decoded EMG data
         self._q = None
 
+    async def _get_block(self):
+        v, trace = await self._q.get()
+        return v, NULL_TRACE if trace is None else trace
+
     def clamp(self, n, smallest, largest):
         return max(smallest, min(n, largest))
 
@@ -56,32 +82,32 @@ class PosInputBleGlove:
 
         print("Connected to {0}".format(self._gforce_device.device_name))
 
-        # Set the EMG raw data configuration, default configuration is 8 bits, 16 batch_len
-        if SAMPLE_RESOLUTION == 12:
-            cfg = EmgRawDataConfig(fs=100, channel_mask=0xFF, batch_len=48, resolution=SampleResolution.BITS_12)
-            await self._gforce_device.set_emg_raw_data_config(cfg)
+        # Set the EMG raw data configuration
+        cfg = emg_raw_data_config()
+
+        # Configure first, the device info includes the EMG configuration read back
+        await self._gforce_device.set_emg_raw_data_config(cfg)
+        device_info = await self._gforce_device.get_device_info()
+        self._columns = [self._gforce_device.channel_index[ch] for ch in INDEX_CHANNELS]
 
-        baterry_level = await self._gforce_device.get_battery_level()
+        print("固件版本: {0}\nFirmware revision: {0}".format(device_info["firmware_revision"]))
+        baterry_level = device_info["battery_level"]
         print("电池电量: {0}%\nDevice baterry level: {0}%".format(baterry_level))
 
         await self._gforce_device.set_subscription(gforce.DataSubscription.EMG_RAW)
-        self._q = await self._gforce_device.start_streaming()
+        self._q = await self._gforce_device.start_streaming(data_types=[gforce.DataType.EMG_ADC], traced=True)
 
         print("校正模式，请常速握拳和张开及旋转大拇指动作若干次\n" \
         "Calibration Mode. Please perform several cycles of making a fist at normal speed, opening the hand, and rotating the thumb.")
 
         for _ in range(256):
-            v = await self._q.get()
+            v, _ = await self._get_block()
             # print(v)
 
-            emg_sum = [0 for _ in range(NUM_FINGERS)]
-
-            for j in range(len(v)):
-                for i in range(NUM_FINGERS):
-                    emg_sum[i] += v[j][INDEX_CHANNELS[i]]
+            emg_mean = v[:, self._columns].mean(axis=0)
 
             for i in range(NUM_FINGERS):
-                temp = emg_sum[i] / len(v)
+                temp = emg_mean[i]
                 self._emg_max[i] = max(self._emg_max[i], temp)
                 self._emg_min[i] = min(self._emg_min[i], temp)
 
@@ -98,27 +124,26 @@ class PosInputBleGlove:
 
     async def get_position(self):
         while True:
-            v = await self._q.get()
+            v, trace = await self._get_block()
             if self._q.empty():
                 break
+        trace.mark("queue")
 
         # print(v)
 
         finger_data = [0 for _ in range(NUM_FINGERS)]
-        emg_sum = [0 for _ in range(NUM_FINGERS)]
-
-        for j in range(len(v)):
-            for i in range(NUM_FINGERS):
-                emg_sum[i] += v[j][INDEX_CHANNELS[i]]
+        emg_mean = v[:, self._columns].mean(axis=0)
 
         for i in range(NUM_FINGERS):
-            self._emg_data[i] = emg_sum[i] / len(v)
+            self._emg_data[i] = emg_mean[i]
             self._emg_data[i] = self.clamp(self._emg_data[i], self._emg_min[i], self._emg_max[i])
             
             finger_data[i] = round(self.interpolate(self._emg_data[i], self._emg_min[i], self._emg_max[i], 0, 65535))
             finger_data[i] = self.clamp(finger_data[i], 0, 65535)
 
         self._pre_finger_data = finger_data
+        trace.mark("position")
+        self.last_trace = trace
         return finger_data
 
     async def stop(self):
@@ -1,8 +1,13 @@
+import os
+import sys
 import time
 import serial
 
 from serial.tools import list_ports
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.latency_trace import NULL_TRACE
+
 # Constants
 MAX_PROTOCOL_DATA_SIZE = 64
 
@@ -23,16 +28,14 @@ NUM_FINGERS = 6
 
 # OHand bus context
 class PosInputUsbGlove:
-    def __init__(self):
+    def __init__(self, tracer=None):
         """
         Initialize PosInputUsbGlove.
 
         Parameters
         ----------
-        serial : str
-            Path to serial port
-        timeout : int
-            Timeout in in milliseconds
+        tracer : LatencyTracer
+            Latency tracer, the trace of the sample used by get_position() is left in last_trace
         """
         # serial init
         self.serial_port = serial.Serial(
@@ -58,6 +61,9 @@ class PosInputUsbGlove:
         self._glove_raw_data = bytearray()  # 手套原始数据，单字节形式
         self._offset = 0
 
+        self._tracer = tracer
+        self.last_trace = NULL_TRACE
+
     def clamp(self, n, smallest, largest):
         return max(smallest, min(n, largest))
 
@@ -258,6 +264,7 @@ class PosInputUsbGlove:
 
         # 读取串口数据
         if self.get_data(self._glove_raw_data):
+            trace = self._tracer.begin() if self._tracer is not None else NULL_TRACE
             glove_data = []  # 手套完整数据，两个字节
 
             # 处理数据
@@ -280,6 +287,9 @@ class PosInputUsbGlove:
                 finger_data[i] = round(self.interpolate(glove_data[i], self._cali_min[i], self._cali_max[i], 0, 65535))
                 finger_data[i] = self.clamp(finger_data[i], 0, 65535)  # 限制在最大最小范围内
 
+            trace.mark("position")
+            self.last_trace = trace
+
         return finger_data
 
     async def stop(self):
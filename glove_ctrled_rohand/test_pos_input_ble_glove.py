@@ -0,0 +1,41 @@
+# Decoding of the EMG packets streamed with the glove configuration
+# pos_input_ble_glove adds the repository root to sys.path, it is imported first
+
+import numpy as np
+import pytest
+
+from pos_input_ble_glove import INDEX_CHANNELS, emg_raw_data_config, gforce
+from common.latency_trace import LatencyTracer, Trace
+
+
+@pytest.mark.parametrize("resolution", [8, 12])
+def test_decode_emg_packet(resolution):
+    cfg = emg_raw_data_config(resolution)
+    device = gforce.GForce()
+    device._apply_emg_raw_data_config(cfg)
+    q = device.add_sink(gforce.DataType.EMG_ADC)
+
+    dtype = np.uint8 if resolution == 8 else np.uint16
+    samples = np.arange(cfg.batch_len, dtype=dtype).reshape(-1, len(INDEX_CHANNELS))
+    device._on_data_response(bytearray([gforce.DataType.EMG_ADC]) + samples.tobytes())
+
+    v = q.get_nowait()
+    assert v.shape == samples.shape
+    columns = [device.channel_index[ch] for ch in INDEX_CHANNELS]
+    np.testing.assert_array_equal(v[:, columns], samples[:, columns])
+
+
+def test_only_traced_sinks_receive_traces():
+    device = gforce.GForce()
+    device._apply_emg_raw_data_config(emg_raw_data_config())
+    device.tracer = LatencyTracer()
+    plain = device.add_sink(gforce.DataType.EMG_ADC)
+    traced = device.add_sink(gforce.DataType.EMG_ADC, traced=True)
+
+    samples = np.zeros((2, len(INDEX_CHANNELS)), dtype=np.uint16)
+    device._on_data_response(bytearray([gforce.DataType.EMG_ADC]) + samples.tobytes())
+
+    assert isinstance(plain.get_nowait(), np.ndarray)
+    v, trace = traced.get_nowait()
+    assert isinstance(v, np.ndarray)
+    assert isinstance(trace, Trace)
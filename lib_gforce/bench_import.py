@@ -0,0 +1,83 @@
+"""
+Import time benchmark of lib_gforce.
+
+Every import is measured in a fresh interpreter, so nothing is cached in sys.modules.
+
+Usage:
+    python -m lib_gforce.bench_import [repeat]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+    "import lib_gforce.gforce",
+    "import lib_gforce.session",
+    "import asyncio",
+    "import numpy",
+    "import bleak",
+]
+
+PROBE = """
+import sys, time
+t = time.perf_counter()
+{statement}
+t = time.perf_counter() - t
+print(t, int("numpy" in sys.modules), int("bleak" in sys.modules))
+"""
+
+
+def measure(statement, repeat):
+    """
+    Measure the import time of a statement.
+    :param statement: Import statement
+    :param repeat: Number of fresh interpreters to run it in
+    :return: List of times in seconds, whether numpy and bleak got imported
+    """
+    times = []
+    loaded_numpy = loaded_bleak = False
+
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(statement=statement)],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        t, has_numpy, has_bleak = out.stdout.split()
+        times.append(float(t))
+        loaded_numpy = has_numpy == "1"
+        loaded_bleak = has_bleak == "1"
+
+    return times, loaded_numpy, loaded_bleak
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    print("{0:<28} {1:>10} {2:>10} {3:>6} {4:>6}".format("statement", "min(ms)", "median(ms)", "numpy", "bleak"))
+    for statement in STATEMENTS:
+        try:
+            times, loaded_numpy, loaded_bleak = measure(statement, repeat)
+        except subprocess.CalledProcessError as e:
+            print("{0:<28} failed: {1}".format(statement, e.stderr.strip().splitlines()[-1]))
+            continue
+
+        print(
+            "{0:<28} {1:>10.1f} {2:>10.1f} {3:>6} {4:>6}".format(
+                statement,
+                min(times) * 1000,
+                statistics.median(times) * 1000,
+                "yes" if loaded_numpy else "no",
+                "yes" if loaded_bleak else "no",
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1096 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import struct
+import time
+from asyncio import Queue
+from contextlib import suppress
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import TYPE_CHECKING, Any, Callable, Optional, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+    from bleak import (
+        BleakScanner,
+        BLEDevice,
+        AdvertisementData,
+        BleakClient,
+        BleakGATTCharacteristic,
+    )
+
+# numpy and bleak take most of the import time, they are imported on first use:
+# numpy when the first data sink is added, bleak when scanning or connecting
+np = None
+bleak = None
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+
+        np = numpy
+
+
+def _import_bleak():
+    global bleak
+    if bleak is None:
+        import bleak as _bleak
+
+        bleak = _bleak
+
+SERVICE_GUID = "0000ffd0-0000-1000-8000-00805f9b34fb"
+CMD_NOTIFY_CHAR_UUID = "f000ffe1-0451-4000-b000-000000000000"
+DATA_NOTIFY_CHAR_UUID = "f000ffe2-0451-4000-b000-000000000000"
+
+# Last known device address per device name prefix, used to connect without a full scan
+ADDRESS_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".gforce_address_cache.json")
+
+SCAN_TIMEOUT = 10.0  # seconds
+DIRECT_CONNECT_TIMEOUT = 3.0  # seconds
+RECONNECT_MIN_DELAY = 0.5  # seconds
+RECONNECT_MAX_DELAY = 8.0  # seconds
+REQUEST_TIMEOUT = 3.0  # seconds
+# Time a request waits for the responses still owed to a timed out request of the same
+# command before it is written, responses arriving later are taken for its own
+LATE_RESPONSE_WINDOW = 0.3  # seconds
+
+
+@dataclass
+class Characteristic:
+    uuid: str
+    service_uuid: str
+    descriptor_uuids: List[str]
+
+
+class Command(IntEnum):
+    GET_PROTOCOL_VERSION = (0x00,)
+    GET_FEATURE_MAP = (0x01,)
+    GET_DEVICE_NAME = (0x02,)
+    GET_MODEL_NUMBER = (0x03,)
+    GET_SERIAL_NUMBER = (0x04,)
+    GET_HW_REVISION = (0x05,)
+    GET_FW_REVISION = (0x06,)
+    GET_MANUFACTURER_NAME = (0x07,)
+    GET_BOOTLOADER_VERSION = (0x0A,)
+
+    GET_BATTERY_LEVEL = (0x08,)
+    GET_TEMPERATURE = (0x09,)
+
+    POWEROFF = (0x1D,)
+    SWITCH_TO_OAD = (0x1E,)
+    SYSTEM_RESET = (0x1F,)
+    SWITCH_SERVICE = (0x20,)
+
+    SET_LOG_LEVEL = (0x21,)
+    SET_LOG_MODULE = (0x22,)
+    PRINT_KERNEL_MSG = (0x23,)
+    MOTOR_CONTROL = (0x24,)
+    LED_CONTROL_TEST = (0x25,)
+    PACKAGE_ID_CONTROL = (0x26,)
+    SEND_TRAINING_PACKAGE = (0x27,)
+
+    GET_ACCELERATE_CAP = (0x30,)
+    SET_ACCELERATE_CONFIG = (0x31,)
+
+    GET_GYROSCOPE_CAP = (0x32,)
+    SET_GYROSCOPE_CONFIG = (0x33,)
+
+    GET_MAGNETOMETER_CAP = (0x34,)
+    SET_MAGNETOMETER_CONFIG = (0x35,)
+
+    GET_EULER_ANGLE_CAP = (0x36,)
+    SET_EULER_ANGLE_CONFIG = (0x37,)
+
+    QUATERNION_CAP = (0x38,)
+    QUATERNION_CONFIG = (0x39,)
+
+    GET_ROTATION_MATRIX_CAP = (0x3A,)
+    SET_ROTATION_MATRIX_CONFIG = (0x3B,)
+
+    GET_GESTURE_CAP = (0x3C,)
+    SET_GESTURE_CONFIG = (0x3D,)
+
+    GET_EMG_RAWDATA_CAP = (0x3E,)
+    SET_EMG_RAWDATA_CONFIG = (0x3F,)
+
+    GET_MOUSE_DATA_CAP = (0x40,)
+    SET_MOUSE_DATA_CONFIG = (0x41,)
+
+    GET_JOYSTICK_DATA_CAP = (0x42,)
+    SET_JOYSTICK_DATA_CONFIG = (0x43,)
+
+    GET_DEVICE_STATUS_CAP = (0x44,)
+    SET_DEVICE_STATUS_CONFIG = (0x45,)
+
+    GET_EMG_RAWDATA_CONFIG = (0x46,)
+
+    SET_DATA_NOTIF_SWITCH = (0x4F,)
+    # Partial command packet, format: [CMD_PARTIAL_DATA, packet number in reverse order, packet content]
+    MD_PARTIAL_DATA = 0xFF
+
+
+class DataSubscription(IntEnum):
+    # Data Notify All Off
+    OFF = (0x00000000,)
+
+    # Accelerate On(C.7)
+    ACCELERATE = (0x00000001,)
+
+    # Gyroscope On(C.8)
+    GYROSCOPE = (0x00000002,)
+
+    # Magnetometer On(C.9)
+    MAGNETOMETER = (0x00000004,)
+
+    # Euler Angle On(C.10)
+    EULERANGLE = (0x00000008,)
+
+    # Quaternion On(C.11)
+    QUATERNION = (0x00000010,)
+
+    # Rotation Matrix On(C.12)
+    ROTATIONMATRIX = (0x00000020,)
+
+    # EMG Gesture On(C.13)
+    EMG_GESTURE = (0x00000040,)
+
+    # EMG Raw Data On(C.14)
+    EMG_RAW = (0x00000080,)
+
+    # HID Mouse On(C.15)
+    HID_MOUSE = (0x00000100,)
+
+    # HID Joystick On(C.16)
+    HID_JOYSTICK = (0x00000200,)
+
+    # Device Status On(C.17)
+    DEVICE_STATUS = (0x00000400,)
+
+    # Device Log On
+    LOG = (0x00000800,)
+
+    # Data Notify All On
+    ALL = 0xFFFFFFFF
+
+
+class DataType(IntEnum):
+    ACC = (0x01,)
+    GYO = (0x02,)
+    MAG = (0x03,)
+    EULER = (0x04,)
+    QUAT = (0x05,)
+    ROTA = (0x06,)
+    EMG_GEST = (0x07,)
+    EMG_ADC = (0x08,)
+    HID_MOUSE = (0x09,)
+    HID_JOYSTICK = (0x0A,)
+    DEV_STATUS = (0x0B,)
+    LOG = (0x0C,)
+
+    PARTIAL = 0xFF
+
+
+# Data types delivered for each subscription bit
+SUBSCRIPTION_DATA_TYPES = {
+    DataSubscription.ACCELERATE: DataType.ACC,
+    DataSubscription.GYROSCOPE: DataType.GYO,
+    DataSubscription.MAGNETOMETER: DataType.MAG,
+    DataSubscription.EULERANGLE: DataType.EULER,
+    DataSubscription.QUATERNION: DataType.QUAT,
+    DataSubscription.ROTATIONMATRIX: DataType.ROTA,
+    DataSubscription.EMG_GESTURE: DataType.EMG_GEST,
+    DataSubscription.EMG_RAW: DataType.EMG_ADC,
+}
+
+
+def subscription_data_types(subscription: int) -> List[DataType]:
+    """
+    :param subscription: DataSubscription bits, possibly combined with |
+    :return: Data types the device sends for the subscription
+    """
+    return [data_type for bit, data_type in SUBSCRIPTION_DATA_TYPES.items() if subscription & bit != 0]
+
+
+class SampleResolution(IntEnum):
+    BITS_8 = (8,)
+    BITS_12 = 12
+
+
+class SamplingRate(IntEnum):
+    HZ_100 = (100,)
+    HZ_200 = (200,)
+    HZ_250 = (250,)
+    HZ_500 = (500,)
+    HZ_650 = (650,)
+
+
+@dataclass
+class EmgRawDataConfig:
+    fs: SamplingRate = SamplingRate.HZ_500
+    channel_mask: int = 0xFF
+    batch_len: int = 16
+    resolution: SampleResolution = SampleResolution.BITS_8
+
+    def to_bytes(self) -> bytes:
+        body = b""
+        body += struct.pack("<H", self.fs)
+        body += struct.pack("<H", self.channel_mask)
+        body += struct.pack("<B", self.batch_len)
+        body += struct.pack("<B", self.resolution)
+        return body
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        fs, channel_mask, batch_len, resolution = struct.unpack(
+            "@HHBB",
+            data,
+        )
+        return cls(fs, channel_mask, batch_len, resolution)
+
+    @classmethod
+    def for_channels(cls, channels: List[int], **kwargs):
+        """
+        Create a configuration streaming only the given channels.
+        :param channels: Device channel indices actually used
+        :param kwargs: Other fields of the configuration
+        """
+        channel_mask = 0
+        for ch in channels:
+            channel_mask |= 1 << ch
+        return cls(channel_mask=channel_mask, **kwargs)
+
+    def channels(self) -> List[int]:
+        """
+        :return: Device channel indices enabled by channel_mask, in the order they are streamed
+        """
+        return [ch for ch in range(16) if self.channel_mask & (1 << ch) != 0]
+
+
+@dataclass
+class Request:
+    cmd: Command
+    has_res: bool
+    body: Optional[bytes] = None
+    timeout: Optional[float] = None  # Seconds, GForce.request_timeouts or REQUEST_TIMEOUT if None
+    retries: int = 0  # Times the request is sent again after a timeout
+
+
+class ResponseCode(IntEnum):
+    SUCCESS = (0x00,)
+    NOT_SUPPORT = (0x01,)
+    BAD_PARAM = (0x02,)
+    FAILED = (0x03,)
+    TIMEOUT = (0x04,)
+    PARTIAL_PACKET = 0xFF
+
+
+@dataclass
+class Response:
+    code: ResponseCode
+    cmd: Command
+    data: bytes
+
+
+def _match_device(device: BLEDevice, adv: AdvertisementData, device_name_prefix: str, min_rssi: int) -> bool:
+    return (
+        SERVICE_GUID.lower() in adv.service_uuids
+        and device.name != None
+        and device.name.startswith(device_name_prefix)
+        and adv.rssi >= min_rssi
+    )
+
+
+async def find_devices(device_name_prefix="", min_rssi=-128, count=1, timeout=SCAN_TIMEOUT) -> List[BLEDevice]:
+    """
+    Scan once for several devices.
+    :param device_name_prefix: Only devices whose name starts with this prefix are accepted
+    :param min_rssi: Minimum RSSI of accepted devices
+    :param count: Scanning stops as soon as this number of devices is found
+    :param timeout: Scanning timeout in seconds
+    :return: At most count devices, the ones with the strongest signal if more were found, sorted by address
+    """
+    _import_bleak()
+    found: Dict[str, BLEDevice] = {}
+    rssi: Dict[str, int] = {}
+    enough = asyncio.Event()
+
+    def on_detection(device: BLEDevice, adv: AdvertisementData):
+        if device.address not in found and _match_device(device, adv, device_name_prefix, min_rssi):
+            print("Device found: {0}, RSSI: {1}".format(device.name, adv.rssi))
+            found[device.address] = device
+            rssi[device.address] = adv.rssi
+            if len(found) >= count:
+                enough.set()
+
+    async with bleak.BleakScanner(on_detection):
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(enough.wait(), timeout)
+
+    # Devices detected while the scanner stopped may exceed count
+    strongest = sorted(found.values(), key=lambda device: rssi[device.address], reverse=True)[:count]
+    return sorted(strongest, key=lambda device: device.address)
+
+
+class GForce:
+    def __init__(self, device_name_prefix="", min_rssi=-128, auto_reconnect=True, device=None):
+        """
+        :param device_name_prefix: Only devices whose name starts with this prefix are accepted
+        :param min_rssi: Minimum RSSI of devices found by scanning
+        :param auto_reconnect: Reconnect and restore subscriptions when the connection is lost
+        :param device: BLEDevice to connect to, e.g. from find_devices(). Skips scanning and address cache
+        """
+        self.device_name = ""
+        self.client = None
+        self.cmd_char = None
+        self.data_char = None
+        # Request waiting for a response per command, at most one request per command is outstanding
+        self._pending: Dict[Command, asyncio.Future] = {}
+        self._cmd_locks: Dict[Command, asyncio.Lock] = {}
+        # Responses owed to a timed out request, per command: count and time they are waited for until.
+        # Cleared when the next request of the command is written
+        self._late_responses: Dict[Command, Tuple[int, float]] = {}
+        self._write_lock = asyncio.Lock()
+        # Response timeout per command, overrides REQUEST_TIMEOUT
+        self.request_timeouts: Dict[Command, float] = {}
+        self.resolution = SampleResolution.BITS_8
+        self._num_channels = 8
+        # Device channel index -> column of the decoded EMG data
+        self.channel_index: Dict[int, int] = {ch: ch for ch in range(self._num_channels)}
+        self._device_name_prefix = device_name_prefix
+        self._min_rssi = min_rssi
+        self._device = device
+        self._auto_reconnect = auto_reconnect
+        self._disconnecting = False
+        self._reconnect_task = None
+
+        # Session state restored after reconnecting
+        self._subscription = None
+        self._emg_raw_data_config = None
+        self._streaming = False
+
+        # Decoders of the data types which can be subscribed
+        self._decoders: Dict[DataType, Callable[[bytes], object]] = {
+            DataType.EMG_ADC: self._convert_emg_to_raw,
+            DataType.ACC: self._convert_acceleration_to_g,
+            DataType.GYO: self._convert_gyro_to_dps,
+            DataType.MAG: self._convert_magnetometer_to_ut,
+            DataType.EULER: self._convert_euler,
+            DataType.QUAT: self._convert_quaternion,
+            DataType.ROTA: self._convert_rotation_matrix,
+            DataType.EMG_GEST: self._convert_emg_gesture,  # It is not supported by the device (?)
+        }
+        # Sinks of each data type, packets of types without sinks are not decoded
+        self._sinks: Dict[DataType, List[Queue]] = {}
+        # Sinks added with traced=True, they receive (data, trace) tuples instead of data
+        self._traced_sinks: List[Queue] = []
+        # Latency tracer (common.latency_trace.LatencyTracer). If set, the traces passed to
+        # traced sinks are started when the notification arrived
+        self.tracer = None
+
+        self.packet_id = 0
+        self.data_packet = bytearray()
+
+    def _match_device(self, _device: BLEDevice, adv: AdvertisementData):
+        if _match_device(_device, adv, self._device_name_prefix, self._min_rssi):
+            print("Device found: {0}, RSSI: {1}".format(_device.name, adv.rssi))
+            return True
+
+        return False
+
+    def _load_address_cache(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(ADDRESS_CACHE_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_address(self, address: str, name: str):
+        cache = self._load_address_cache()
+        entry = {"address": address, "name": name}
+        if cache.get(self._device_name_prefix) == entry:
+            return
+
+        cache[self._device_name_prefix] = entry
+        try:
+            with open(ADDRESS_CACHE_FILE, "w") as f:
+                json.dump(cache, f)
+        except OSError as e:
+            print("Failed to save device address: {0}".format(e))
+
+    async def _connect_client(self, device, timeout: float) -> BleakClient:
+        _import_bleak()
+        client = bleak.BleakClient(
+            device,
+            disconnected_callback=self._on_disconnect,
+            timeout=timeout,
+        )
+        await client.connect()
+        return client
+
+    async def connect(self, scan_timeout=SCAN_TIMEOUT, direct_timeout=DIRECT_CONNECT_TIMEOUT):
+        """
+        Connect to the device. The address cached from the last successful connection
+        is tried first, a scan is only started if the direct connection fails.
+        :param scan_timeout: Timeout of scanning for a matching device, in seconds
+        :param direct_timeout: Timeout of connecting to the cached address, in seconds
+        """
+        if self._device is not None:
+            client = await self._connect_client(self._device, scan_timeout)
+            device_name = self._device.name
+        else:
+            client, device_name = await self._connect_by_prefix(scan_timeout, direct_timeout)
+
+        self.client = client
+        self.device_name = device_name
+
+        await client.start_notify(
+            CMD_NOTIFY_CHAR_UUID,
+            self._on_cmd_response,
+        )
+
+    async def _connect_by_prefix(self, scan_timeout: float, direct_timeout: float):
+        cached = self._load_address_cache().get(self._device_name_prefix)
+        if cached is not None:
+            try:
+                client = await self._connect_client(cached["address"], direct_timeout)
+                return client, cached["name"]
+            except Exception as e:
+                print("Failed to connect to cached address {0}: {1}".format(cached["address"], e))
+
+        _import_bleak()
+        device = await bleak.BleakScanner.find_device_by_filter(
+            self._match_device,
+            timeout=scan_timeout,
+        )
+        if device is None:
+            raise Exception("No GForce device found")
+
+        client = await self._connect_client(device, scan_timeout)
+        self._save_address(client.address, device.name)
+        return client, device.name
+
+    def _on_disconnect(self, client: BleakClient):
+        if client is not self.client:
+            return
+
+        if self._disconnecting or not self._auto_reconnect:
+            print("Disconnected from {0}".format(self.device_name))
+            return
+
+        print("Connection to {0} lost, reconnecting".format(self.device_name))
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.get_event_loop().create_task(self._reconnect())
+
+    def _reset_connection_state(self):
+        """
+        Drop the state of the lost connection: a partially received data packet and the
+        requests waiting for a response, which will never arrive.
+        """
+        self.packet_id = 0
+        self.data_packet = bytearray()
+
+        for cmd, future in self._pending.items():
+            if not future.done():
+                future.set_exception(Exception("Connection lost while waiting for {0}".format(cmd.name)))
+        self._pending.clear()
+        self._late_responses.clear()
+
+    async def _reconnect(self):
+        self._reset_connection_state()
+        delay = RECONNECT_MIN_DELAY
+
+        while not self._disconnecting:
+            try:
+                await self.connect()
+                await self._restore_session()
+                print("Reconnected to {0}".format(self.device_name))
+                return
+            except Exception as e:
+                print("Failed to reconnect: {0}, retry in {1:.1f}s".format(e, delay))
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _restore_session(self):
+        if self._emg_raw_data_config is not None:
+            await self.set_emg_raw_data_config(self._emg_raw_data_config)
+
+        if self._subscription is not None:
+            await self.set_subscription(self._subscription)
+
+        if self._streaming:
+            await self._start_data_notify()
+
+    def add_sink(self, data_type: DataType, sink: Optional[Queue] = None, traced=False) -> Queue:
+        """
+        Register a sink receiving the decoded data of one data type.
+        :param data_type: Data type to receive
+        :param sink: Anything with put_nowait(), a new Queue is created if None
+        :param traced: Receive (data, trace) tuples, the trace is None if no tracer is set
+        :return: The sink
+        """
+        if data_type not in self._decoders:
+            raise Exception(f"Unsupported data type {data_type}")
+
+        _import_numpy()
+        if sink is None:
+            sink = Queue()
+        self._sinks.setdefault(data_type, []).append(sink)
+        if traced and sink not in self._traced_sinks:
+            self._traced_sinks.append(sink)
+        return sink
+
+    def remove_sink(self, data_type: DataType, sink: Queue):
+        sinks = self._sinks.get(data_type, [])
+        if sink in sinks:
+            sinks.remove(sink)
+        if len(sinks) == 0:
+            self._sinks.pop(data_type, None)
+        if not any(sink in other for other in self._sinks.values()) and sink in self._traced_sinks:
+            self._traced_sinks.remove(sink)
+
+    def _on_data_response(self, bs: bytearray):
+        trace = self.tracer.begin() if self.tracer is not None else None
+        bs = bytes(bs)
+        full_packet = b""
+
+        is_partial_data = bs[0] == ResponseCode.PARTIAL_PACKET
+        if is_partial_data:
+            packet_id = bs[1]
+            if self.packet_id != 0 and self.packet_id != packet_id + 1:
+                raise Exception(
+                    "Unexpected packet id: expected {} got {}".format(
+                        self.packet_id + 1,
+                        packet_id,
+                    )
+                )
+            elif self.packet_id == 0 or self.packet_id > packet_id:
+                self.packet_id = packet_id
+                self.data_packet += bs[2:]
+
+                if self.packet_id == 0:
+                    full_packet = bytes(self.data_packet)
+                    self.data_packet = bytearray()
+        else:
+            full_packet = bs
+
+        if len(full_packet) == 0:
+            return
+
+        sinks = self._sinks.get(full_packet[0])
+        if sinks is None:
+            return
+
+        data = self._decoders[full_packet[0]](full_packet[1:])
+        if trace is not None:
+            trace.mark("decode")
+
+        for sink in sinks:
+            if sink in self._traced_sinks:
+                sink.put_nowait((data, trace))
+            else:
+                sink.put_nowait(data)
+
+    def _convert_emg_to_raw(self, data: bytes) -> np.ndarray[np.integer]:
+        match self.resolution:
+            case SampleResolution.BITS_8:
+                dtype = np.uint8
+
+            case SampleResolution.BITS_12:
+                dtype = np.uint16
+
+            case _:
+                raise Exception(f"Unsupported resolution {self.resolution}")
+
+        emg_data = np.frombuffer(data, dtype=dtype)
+
+        return emg_data.reshape(-1, self._num_channels)
+
+    @staticmethod
+    def _convert_acceleration_to_g(data: bytes) -> np.ndarray[np.float32]:
+        normalizing_factor = 65536.0
+
+        acceleration_data = (
+            np.frombuffer(data, dtype=np.int32).astype(np.float32) / normalizing_factor
+        )
+        num_channels = 3
+
+        return acceleration_data.reshape(-1, num_channels)
+
+    @staticmethod
+    def _convert_gyro_to_dps(data: bytes) -> np.ndarray[np.float32]:
+        normalizing_factor = 65536.0
+
+        gyro_data = (
+            np.frombuffer(data, dtype=np.int32).astype(np.float32) / normalizing_factor
+        )
+        num_channels = 3
+
+        return gyro_data.reshape(-1, num_channels)
+
+    @staticmethod
+    def _convert_magnetometer_to_ut(data: bytes) -> np.ndarray[np.float32]:
+        normalizing_factor = 65536.0
+
+        magnetometer_data = (
+            np.frombuffer(data, dtype=np.int32).astype(np.float32) / normalizing_factor
+        )
+        num_channels = 3
+
+        return magnetometer_data.reshape(-1, num_channels)
+
+    @staticmethod
+    def _convert_euler(data: bytes) -> np.ndarray[np.float32]:
+
+        euler_data = np.frombuffer(data, dtype=np.float32).astype(np.float32)
+        num_channels = 3
+
+        return euler_data.reshape(-1, num_channels)
+
+    @staticmethod
+    def _convert_quaternion(data: bytes) -> np.ndarray[np.float32]:
+
+        quaternion_data = np.frombuffer(data, dtype=np.float32).astype(np.float32)
+        num_channels = 4
+
+        return quaternion_data.reshape(-1, num_channels)
+
+    @staticmethod
+    def _convert_rotation_matrix(data: bytes) -> np.ndarray[np.float32]:
+
+        rotation_matrix_data = np.frombuffer(data, dtype=np.int32).astype(np.float32)
+        num_channels = 9
+
+        return rotation_matrix_data.reshape(-1, num_channels)
+
+    @staticmethod
+    def _convert_emg_gesture(data: bytes) -> np.ndarray[np.uint8]:
+        emg_gesture_data = np.frombuffer(data, dtype=np.uint8)
+
+        return emg_gesture_data[0]
+
+    def _on_cmd_response(self, _: BleakGATTCharacteristic, bs: bytearray):
+        try:
+            response = self._parse_response(bytes(bs))
+            late = self._late_responses.pop(response.cmd, None)
+            if late is not None and time.monotonic() < late[1]:
+                # Late response to a request which timed out
+                if late[0] > 1:
+                    self._late_responses[response.cmd] = (late[0] - 1, late[1])
+                return
+
+            future = self._pending.get(response.cmd)
+            if future is not None and not future.done():
+                future.set_result(response.data)
+        except Exception as e:
+            raise Exception("Failed to parse response: %s" % e)
+
+    @staticmethod
+    def _parse_response(res: bytes) -> Response:
+        code = int.from_bytes(res[:1], byteorder="big")
+        code = ResponseCode(code)
+
+        cmd = int.from_bytes(res[1:2], byteorder="big")
+        cmd = Command(cmd)
+
+        data = res[2:]
+
+        return Response(
+            code=code,
+            cmd=cmd,
+            data=data,
+        )
+
+    async def get_protocol_version(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_PROTOCOL_VERSION,
+                has_res=True,
+            )
+        )
+        return buf.decode("utf-8")
+
+    async def get_feature_map(self) -> int:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_FEATURE_MAP,
+                has_res=True,
+            )
+        )
+        return int.from_bytes(buf, byteorder="big")  # TODO: check if this is correct
+
+    async def get_device_name(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_DEVICE_NAME,
+                has_res=True,
+            )
+        )
+        return buf.decode("utf-8")
+
+    async def get_firmware_revision(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_FW_REVISION,
+                has_res=True,
+            )
+        )
+        return buf.decode("utf-8")
+
+    async def get_hardware_revision(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_HW_REVISION,
+                has_res=True,
+            )
+        )
+        return buf.decode("utf-8")
+
+    async def get_model_number(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_MODEL_NUMBER,
+                has_res=True,
+            )
+        )
+        return buf.decode("utf-8")
+
+    async def get_serial_number(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_SERIAL_NUMBER,
+                has_res=True,
+            )
+        )
+        return buf.decode("utf-8")
+
+    async def get_manufacturer_name(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_MANUFACTURER_NAME,
+                has_res=True,
+            )
+        )
+
+        return buf.decode("utf-8")
+
+    async def get_bootloader_version(self) -> str:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_BOOTLOADER_VERSION,
+                has_res=True,
+            )
+        )
+
+        return buf.decode("utf-8")
+
+    async def get_battery_level(self) -> int:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_BATTERY_LEVEL,
+                has_res=True,
+            )
+        )
+        return int.from_bytes(buf, byteorder="big")
+
+    async def get_temperature(self) -> int:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_TEMPERATURE,
+                has_res=True,
+            )
+        )
+        return int.from_bytes(buf, byteorder="big")
+
+    async def power_off(self) -> None:
+        await self._send_request(
+            Request(
+                cmd=Command.POWEROFF,
+                has_res=False,
+            )
+        )
+
+    async def switch_to_oad(self):
+        await self._send_request(
+            Request(
+                cmd=Command.SWITCH_TO_OAD,
+                has_res=False,
+            )
+        )
+
+    async def system_reset(self):
+        await self._send_request(
+            Request(
+                cmd=Command.SYSTEM_RESET,
+                has_res=False,
+            )
+        )
+
+    async def switch_service(self):
+        await self._send_request(
+            Request(
+                cmd=Command.SWITCH_SERVICE,
+                has_res=False,
+            )
+        )
+
+    async def set_motor(self):
+        """
+        Send MOTOR_CONTROL without parameters and wait for the response.
+        """
+        await self._send_request(
+            Request(
+                cmd=Command.MOTOR_CONTROL,
+                has_res=True,
+            )
+        )
+
+    async def set_led(self):
+        """
+        Send LED_CONTROL_TEST without parameters and wait for the response.
+        """
+        await self._send_request(
+            Request(
+                cmd=Command.LED_CONTROL_TEST,
+                has_res=True,
+            )
+        )
+
+    async def set_log_level(self):
+        await self._send_request(
+            Request(
+                cmd=Command.SET_LOG_LEVEL,
+                has_res=False,
+            )
+        )
+
+    async def set_log_module(self):
+        await self._send_request(
+            Request(
+                cmd=Command.SET_LOG_MODULE,
+                has_res=False,
+            )
+        )
+
+    async def print_kernel_msg(self):
+        await self._send_request(
+            Request(
+                cmd=Command.PRINT_KERNEL_MSG,
+                has_res=True,
+            )
+        )
+
+    async def set_package_id(self):
+        await self._send_request(
+            Request(
+                cmd=Command.PACKAGE_ID_CONTROL,
+                has_res=False,
+            )
+        )
+
+    async def send_training_package(self):
+        await self._send_request(
+            Request(
+                cmd=Command.SEND_TRAINING_PACKAGE,
+                has_res=False,
+            )
+        )
+
+    async def set_emg_raw_data_config(self, cfg=EmgRawDataConfig()):
+        channels = cfg.channels()
+        if len(channels) == 0 or cfg.batch_len % len(channels) != 0:
+            raise Exception(f"batch_len {cfg.batch_len} is not a multiple of the {len(channels)} streamed channels")
+
+        body = cfg.to_bytes()
+        await self._send_request(
+            Request(
+                cmd=Command.SET_EMG_RAWDATA_CONFIG,
+                body=body,
+                has_res=True,
+            )
+        )
+        self._apply_emg_raw_data_config(cfg)
+
+    def _apply_emg_raw_data_config(self, cfg: EmgRawDataConfig):
+        self.resolution = cfg.resolution
+
+        channels = cfg.channels()
+        self._num_channels = len(channels)
+        self.channel_index = {ch: i for i, ch in enumerate(channels)}
+        self._emg_raw_data_config = cfg
+
+    async def get_emg_raw_data_config(self) -> EmgRawDataConfig:
+        buf = await self._send_request(
+            Request(
+                cmd=Command.GET_EMG_RAWDATA_CONFIG,
+                has_res=True,
+            )
+        )
+        return EmgRawDataConfig.from_bytes(buf)
+
+    async def set_subscription(self, subscription: DataSubscription):
+        body = [
+            0xFF & subscription,
+            0xFF & (subscription >> 8),
+            0xFF & (subscription >> 16),
+            0xFF & (subscription >> 24),
+        ]
+        body = bytes(body)
+        await self._send_request(
+            Request(
+                cmd=Command.SET_DATA_NOTIF_SWITCH,
+                body=body,
+                has_res=True,
+            )
+        )
+        self._subscription = subscription
+
+    async def _start_data_notify(self):
+        await self.client.start_notify(
+            DATA_NOTIFY_CHAR_UUID,
+            lambda _, data: self._on_data_response(data),
+        )
+
+    async def start_streaming(
+        self, q: Optional[Queue] = None, data_types: Optional[List[DataType]] = None, traced=False
+    ) -> Queue:
+        """
+        Start data notifications.
+        :param q: Sink receiving the decoded data, anything with put_nowait() will do. A new Queue is created if None
+        :param data_types: Data types delivered to q, every supported data type if None.
+                           Use add_sink() to receive different data types in different sinks,
+                           an empty list then only starts the notifications
+        :param traced: q receives (data, trace) tuples, see add_sink()
+        :return: The sink receiving the data
+        """
+        if q is None:
+            q = Queue()
+        if data_types is None:
+            data_types = list(self._decoders.keys())
+        for data_type in data_types:
+            self.add_sink(data_type, q, traced)
+
+        await self._start_data_notify()
+        self._streaming = True
+        return q
+
+    async def stop_streaming(self):
+        self._streaming = False
+        self._sinks.clear()
+        self._traced_sinks.clear()
+        exceptions = []
+        try:
+            await self.set_subscription(DataSubscription.OFF)
+        except Exception as e:
+            exceptions.append(e)
+        try:
+            await self.client.stop_notify(DATA_NOTIFY_CHAR_UUID)
+        except Exception as e:
+            exceptions.append(e)
+        try:
+            await self.client.stop_notify(CMD_NOTIFY_CHAR_UUID)
+        except Exception as e:
+            exceptions.append(e)
+
+        if len(exceptions) > 0:
+            raise Exception("Failed to stop streaming: %s" % exceptions)
+
+    async def disconnect(self):
+        self._disconnecting = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+
+        with suppress(asyncio.CancelledError):
+            await self.client.disconnect()
+
+    async def _send_request(self, req: Request) -> Optional[bytes]:
+        """
+        Send a request and wait for its response. Requests of different commands may be
+        outstanding at the same time, requests of the same command are sent one after
+        another, so the command of a response tells which request it answers.
+        """
+        timeout = req.timeout
+        if timeout is None:
+            timeout = self.request_timeouts.get(req.cmd, REQUEST_TIMEOUT)
+
+        bs = bytes([req.cmd])
+        if req.body is not None:
+            bs += req.body
+
+        async with self._cmd_locks.setdefault(req.cmd, asyncio.Lock()):
+            await self._drain_late_responses(req.cmd)
+
+            future = None
+            if req.has_res:
+                future = asyncio.get_running_loop().create_future()
+                self._pending[req.cmd] = future
+
+            sent = 0
+            try:
+                for attempt in range(req.retries + 1):
+                    async with self._write_lock:
+                        await self.client.write_gatt_char(CMD_NOTIFY_CHAR_UUID, bs)
+                    sent += 1
+
+                    if future is None:
+                        return None
+
+                    try:
+                        # A late response to an earlier attempt answers the request as well
+                        return await asyncio.wait_for(asyncio.shield(future), timeout)
+                    except asyncio.TimeoutError:
+                        if attempt == req.retries:
+                            raise
+                        print("Request {0} timed out, retry".format(req.cmd.name))
+            finally:
+                if future is not None:
+                    self._pending.pop(req.cmd, None)
+                    # Responses still to come for the attempts which weren't answered
+                    # must not be taken for the response of the next request
+                    if future.done() and not future.cancelled():
+                        # Answered, or failed because the connection was lost and no responses are coming
+                        unanswered = sent - 1 if future.exception() is None else 0
+                    else:
+                        unanswered = sent
+                    if unanswered > 0:
+                        self._late_responses[req.cmd] = (unanswered, time.monotonic() + min(timeout, LATE_RESPONSE_WINDOW))
+                    future.cancel()
+
+    async def _drain_late_responses(self, cmd: Command):
+        """
+        Wait until the responses owed to a timed out request of the command arrived, at most
+        until the end of their window. Responses may also be lost, so whatever arrives after
+        the next request is written is taken for its response.
+        """
+        while True:
+            late = self._late_responses.get(cmd)
+            if late is None:
+                return
+            if time.monotonic() >= late[1]:
+                self._late_responses.pop(cmd, None)
+                return
+            await asyncio.sleep(0.01)
+
+    async def get_device_info(self) -> Dict[str, Any]:
+        """
+        Query versions, battery level and EMG configuration concurrently.
+        :return: Dict of the results, None for queries which failed
+        """
+        queries = {
+            "protocol_version": self.get_protocol_version(),
+            "firmware_revision": self.get_firmware_revision(),
+            "hardware_revision": self.get_hardware_revision(),
+            "model_number": self.get_model_number(),
+            "battery_level": self.get_battery_level(),
+            "emg_raw_data_config": self.get_emg_raw_data_config(),
+        }
+        results = await asyncio.gather(*queries.values(), return_exceptions=True)
+
+        return {
+            name: None if isinstance(result, BaseException) else result
+            for name, result in zip(queries.keys(), results)
+        }
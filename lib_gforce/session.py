@@ -0,0 +1,142 @@
+import asyncio
+import time
+from asyncio import Queue
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, List, Optional
+
+from .gforce import (
+    SCAN_TIMEOUT,
+    DataSubscription,
+    DataType,
+    EmgRawDataConfig,
+    GForce,
+    find_devices,
+    subscription_data_types,
+)
+
+
+@dataclass
+class DeviceData:
+    device_index: int
+    device_name: str
+    data_type: DataType
+    timestamp: float  # time.monotonic() when the data block arrived
+    data: Any
+
+
+class _TaggingSink:
+    """
+    Stands in for the data queue of one GForce: tags every data block with the
+    device it came from and hands it to the merged feed and the device buffer.
+    Runs in the notification callback, so no extra task sits between devices.
+    """
+
+    def __init__(self, session: "GForceSession", index: int, device_name: str, data_type: DataType):
+        self._session = session
+        self._index = index
+        self._device_name = device_name
+        self._data_type = data_type
+
+    def put_nowait(self, data):
+        item = DeviceData(self._index, self._device_name, self._data_type, time.monotonic(), data)
+        self._session.buffers[self._index].append(item)
+        self._session._feed_put(item)
+
+
+class GForceSession:
+    """
+    Connects several gForce devices concurrently and merges their data streams.
+    Data blocks are available both as a single feed in arrival order (get())
+    and as per-device buffers holding the most recent blocks (buffers[i]).
+    """
+
+    def __init__(self, device_name_prefix="", min_rssi=-128, num_devices=1, buffer_len=256, feed_maxsize=1024):
+        """
+        :param device_name_prefix: Only devices whose name starts with this prefix are accepted
+        :param min_rssi: Minimum RSSI of accepted devices
+        :param num_devices: Number of devices to connect
+        :param buffer_len: Number of data blocks kept per device in buffers
+        :param feed_maxsize: Size of the merged feed, the oldest blocks are dropped when it is full
+        """
+        self._device_name_prefix = device_name_prefix
+        self._min_rssi = min_rssi
+        self._num_devices = num_devices
+        self._buffer_len = buffer_len
+        self._feed: Queue = Queue(maxsize=feed_maxsize)
+        self.devices: List[GForce] = []
+        self.buffers: List[Deque[DeviceData]] = []
+
+    @property
+    def num_devices(self) -> int:
+        return len(self.devices)
+
+    def _feed_put(self, item: DeviceData):
+        if self._feed.full():
+            self._feed.get_nowait()
+        self._feed.put_nowait(item)
+
+    async def connect(self, timeout=SCAN_TIMEOUT) -> int:
+        """
+        Scan once for all devices and connect them in parallel.
+        Devices failing to connect are dropped.
+        :param timeout: Scanning timeout in seconds
+        :return: Number of connected devices
+        """
+        found = await find_devices(self._device_name_prefix, self._min_rssi, self._num_devices, timeout)
+        if len(found) == 0:
+            raise Exception("No GForce device found")
+
+        candidates = [GForce(self._device_name_prefix, self._min_rssi, device=device) for device in found]
+        results = await asyncio.gather(
+            *(device.connect() for device in candidates),
+            return_exceptions=True,
+        )
+
+        for ble_device, device, result in zip(found, candidates, results):
+            if isinstance(result, BaseException):
+                print("Failed to connect to {0}: {1}".format(ble_device.name, result))
+            else:
+                self.devices.append(device)
+                self.buffers.append(deque(maxlen=self._buffer_len))
+
+        return len(self.devices)
+
+    async def _start_device(self, index: int, subscription: DataSubscription, emg_cfg: Optional[EmgRawDataConfig]):
+        device = self.devices[index]
+        if emg_cfg is not None:
+            await device.set_emg_raw_data_config(emg_cfg)
+        await device.set_subscription(subscription)
+        for data_type in subscription_data_types(subscription):
+            device.add_sink(data_type, _TaggingSink(self, index, device.device_name, data_type))
+        await device.start_streaming(data_types=[])
+
+    async def start(self, subscription: DataSubscription, emg_cfg: Optional[EmgRawDataConfig] = None):
+        """
+        Configure and start streaming on all connected devices in parallel.
+        :param subscription: Data subscription of every device
+        :param emg_cfg: EMG raw data configuration, device default is kept if None
+        """
+        await asyncio.gather(
+            *(self._start_device(i, subscription, emg_cfg) for i in range(self.num_devices)),
+        )
+
+    async def get(self) -> DeviceData:
+        """
+        Get the next data block of any device, in arrival order.
+        """
+        return await self._feed.get()
+
+    async def stop(self):
+        results = await asyncio.gather(
+            *(device.stop_streaming() for device in self.devices),
+            return_exceptions=True,
+        )
+        await asyncio.gather(
+            *(device.disconnect() for device in self.devices),
+            return_exceptions=True,
+        )
+
+        exceptions = [e for e in results if isinstance(e, BaseException)]
+        if len(exceptions) > 0:
+            raise Exception("Failed to stop streaming: %s" % exceptions)
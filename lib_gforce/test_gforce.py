@@ -0,0 +1,67 @@
+# Matching of command responses to requests
+
+import asyncio
+
+from lib_gforce.gforce import Command, GForce, Request, ResponseCode
+
+TIMEOUT = 0.1  # seconds
+
+
+class FakeClient:
+    """
+    Answers every written request with its sequence number after a delay, None drops the response.
+    """
+
+    def __init__(self, device, delays):
+        self._device = device
+        self._delays = list(delays)
+        self.writes = 0
+
+    async def write_gatt_char(self, uuid, bs):
+        self.writes += 1
+        delay = self._delays.pop(0) if self._delays else 0.01
+        if delay is not None:
+            response = bytearray([ResponseCode.SUCCESS, bs[0], self.writes])
+            asyncio.get_running_loop().call_later(delay, self._device._on_cmd_response, None, response)
+
+
+def _device(delays):
+    device = GForce()
+    device.client = FakeClient(device, delays)
+    device.request_timeouts[Command.GET_BATTERY_LEVEL] = TIMEOUT
+    return device
+
+
+def test_request_after_lost_response():
+    async def run():
+        device = _device([None])
+        try:
+            await device.get_battery_level()
+            assert False, "Lost response didn't time out"
+        except asyncio.TimeoutError:
+            pass
+        assert await device.get_battery_level() == 2
+
+    asyncio.run(run())
+
+
+def test_request_after_successful_retry():
+    async def run():
+        device = _device([None, 0.01])
+        assert await device._send_request(Request(cmd=Command.GET_BATTERY_LEVEL, has_res=True, retries=1)) == bytes([2])
+        assert await device.get_battery_level() == 3
+
+    asyncio.run(run())
+
+
+def test_late_response_is_dropped():
+    async def run():
+        device = _device([TIMEOUT * 1.5])
+        try:
+            await device.get_battery_level()
+            assert False, "Late response didn't time out"
+        except asyncio.TimeoutError:
+            pass
+        assert await device.get_battery_level() == 2
+
+    asyncio.run(run())
@@ -0,0 +1,450 @@
+"""
+Analysis of loop test telemetry files and move logs.
+
+Telemetry gives the step response of every finger to every target change: time until
+the finger is within tolerance, overshoot, steady state error and current and force
+peaks, per finger and per day to show degradation over long runs. Move logs give the
+distribution of cycle and move times and the fingers that stalled or timed out.
+Files are processed block by block, so logs larger than memory work.
+
+Usage:
+    python analyze_logs.py --telemetry telemetry_2.bin --moves moves.csv [--plot plots]
+"""
+
+import argparse
+import csv
+import itertools
+import os
+from datetime import datetime
+
+import numpy as np
+
+from telemetry import TelemetryReader
+
+NUM_FINGERS = 6
+NUM_FORCES = 5  # Fingers with a force sensor
+
+POS_TOLERANCE = 1000  # A finger within this distance of its target has arrived
+MIN_STEP = 10000  # Smallest target change analyzed as a step
+STEP_WINDOW = 3.0  # seconds after a step that are analyzed, at most until the target changes again
+SETTLE_FRACTION = 0.2  # Last share of the window the steady state error of a finger that never arrives is averaged over
+GAP = 1.0  # seconds without samples that end a window, e.g. between two runs
+MOVE_ROWS = 1000000  # Move log rows read at once
+
+STEP_DTYPE = np.dtype([
+    ("time", "f8"),  # time.time() of the target change
+    ("finger", "u1"),
+    ("size", "i4"),  # Target change
+    ("response", "f8"),  # Seconds until within tolerance, NaN if never
+    ("overshoot", "f8"),  # Largest travel past the target relative to the step size
+    ("error", "f8"),  # Mean distance to the target after arriving, or at the end of the window
+    ("current", "f8"),  # Peak current
+    ("force", "f8"),  # Peak force, NaN for the thumb root
+])
+
+
+def _segments(ufunc, values, starts, ends):
+    """
+    Reduce values over the segments [starts, ends), which are in order and don't overlap.
+    """
+    if len(starts) == 0:
+        return np.empty(0, dtype=values.dtype)
+    indices = np.empty(2 * len(starts), dtype=np.intp)
+    indices[0::2] = starts
+    indices[1::2] = ends
+    if indices[-1] == len(values):
+        indices = indices[:-1]
+    return ufunc.reduceat(values, indices)[0::2]
+
+
+def analyze_steps(data, done, final):
+    """
+    Step response of every finger in a block of telemetry.
+    :param data: Dict of TelemetryReader with time, target, pos, current and force
+    :param done: Time of the last analyzed step per finger, updated
+    :param final: True for the last block, steps cut off by its end are dropped
+    :return: STEP_DTYPE array of the analyzed steps, first row the next block has to start with
+    """
+    t = data["time"]
+    n = len(t)
+    keep = max(n - 1, 0)  # The last row tells whether the first row of the next block changes the target
+    if n < 2:
+        return np.empty(0, dtype=STEP_DTYPE), 0
+
+    # First rows of new runs, a target change across a gap is no step
+    breaks = np.flatnonzero(np.diff(t) > GAP) + 1
+    next_break = np.append(breaks, n)
+    indices = np.arange(n)
+
+    records = []
+    for finger in range(NUM_FINGERS):
+        target = data["target"][:, finger].astype(np.int32)
+        err = data["pos"][:, finger].astype(np.int32) - target
+
+        changes = np.flatnonzero(target[1:] != target[:-1]) + 1
+        if len(changes) == 0:
+            continue
+        ends = np.append(changes[1:], n)
+        ends = np.minimum(ends, np.searchsorted(t, t[changes] + STEP_WINDOW, side="right"))
+        ends = np.minimum(ends, next_break[np.searchsorted(breaks, changes, side="right")])
+
+        complete = (ends < n) | (t[-1] >= t[changes] + STEP_WINDOW)
+        if not complete.all():
+            keep = min(keep, changes[~complete][0] - 1)
+
+        size = target[changes] - target[changes - 1]
+        selected = complete & (np.abs(size) >= MIN_STEP) & (t[changes] > done[finger]) & ~np.isin(changes, breaks)
+        starts, ends, size = changes[selected], ends[selected], size[selected]
+        if len(starts) == 0:
+            continue
+        done[finger] = t[starts[-1]]
+
+        # Index of the next sample within tolerance, n if none
+        arrived = np.where(np.abs(err) <= POS_TOLERANCE, indices, n)
+        arrived = np.minimum.accumulate(arrived[::-1])[::-1][starts]
+        reached = arrived < ends
+
+        direction = np.sign(size)
+        past = np.where(direction > 0, _segments(np.maximum, err, starts, ends), -_segments(np.minimum, err, starts, ends))
+
+        settle_starts = np.where(reached, arrived,
+                                 ends - np.maximum(1, ((ends - starts) * SETTLE_FRACTION).astype(np.intp)))
+        abs_err = np.abs(err).astype(np.float64)
+        # Settle windows are the ends of the step windows, so they are in order and don't overlap too
+        settle_error = _segments(np.add, abs_err, settle_starts, ends) / (ends - settle_starts)
+
+        step = np.empty(len(starts), dtype=STEP_DTYPE)
+        step["time"] = t[starts]
+        step["finger"] = finger
+        step["size"] = size
+        step["response"] = np.where(reached, t[np.minimum(arrived, n - 1)] - t[starts], np.nan)
+        step["overshoot"] = np.maximum(past, 0) / np.abs(size)
+        step["error"] = settle_error
+        step["current"] = _segments(np.maximum, data["current"][:, finger], starts, ends)
+        if finger < NUM_FORCES:
+            step["force"] = _segments(np.maximum, data["force"][:, finger], starts, ends)
+        else:
+            step["force"] = np.nan
+        records.append(step)
+
+    steps = np.concatenate(records) if records else np.empty(0, dtype=STEP_DTYPE)
+    return steps, (n if final else keep)
+
+
+def day_numbers(t):
+    """
+    :return: Local day of every time as days since 1970-01-01
+    """
+    if len(t) == 0:
+        return np.empty(0, dtype=np.int64)
+    offset = datetime.fromtimestamp(float(t[0])).astimezone().utcoffset().total_seconds()
+    return np.floor((t + offset) / 86400).astype(np.int64)
+
+
+def day_name(day):
+    return str(np.datetime64(int(day), "D"))
+
+
+def analyze_telemetry(paths, start=None, end=None):
+    """
+    :return: STEP_DTYPE array of all steps, dict day -> (peak current, peak force) per finger, number of samples
+    """
+    groups = ["target", "pos", "current", "force"]
+    all_steps = []
+    peaks = {}
+    samples = 0
+
+    for path in paths:
+        reader = TelemetryReader(path)
+        done = np.full(NUM_FINGERS, -np.inf)
+        carry = None
+
+        for block in reader.blocks(start, end, groups):
+            samples += len(block["time"])
+
+            # Peaks of every day over all samples
+            days = day_numbers(block["time"])
+            for day in np.unique(days):
+                rows = days == day
+                current = block["current"][rows].max(axis=0)
+                force = block["force"][rows].max(axis=0)
+                if day in peaks:
+                    current = np.maximum(current, peaks[day][0])
+                    force = np.maximum(force, peaks[day][1])
+                peaks[day] = (current, force)
+
+            data = block if carry is None else {name: np.concatenate([carry[name], block[name]]) for name in block}
+            steps, keep = analyze_steps(data, done, False)
+            all_steps.append(steps)
+            carry = {name: values[keep:] for name, values in data.items()}
+
+        if carry is not None:
+            all_steps.append(analyze_steps(carry, done, True)[0])
+
+    steps = np.concatenate(all_steps) if all_steps else np.empty(0, dtype=STEP_DTYPE)
+    return steps[np.argsort(steps["time"], kind="stable")], peaks, samples
+
+
+def read_moves(paths):
+    """
+    Read move logs of MoveLog.
+    :return: Dict (bus, node, move) -> (end times, durations in seconds),
+             dict (bus, node, finger) -> dict outcome -> count
+    """
+    moves = {}
+    outcomes = {}
+    for path in paths:
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f)
+            previous = None
+            while True:
+                rows = list(itertools.islice(reader, MOVE_ROWS))
+                if not rows:
+                    break
+
+                block = {}
+                for row in rows:
+                    key = (row["bus"], row["node"], row["move"])
+                    finger_key = (row["bus"], row["node"], int(row["finger"]))
+                    counts = outcomes.setdefault(finger_key, {})
+                    counts[row["outcome"]] = counts.get(row["outcome"], 0) + 1
+
+                    # A move has a row per finger
+                    move = (key, row["time_s"])
+                    if move == previous:
+                        continue
+                    previous = move
+                    times, durations = block.setdefault(key, ([], []))
+                    times.append(float(row["time_s"]))
+                    durations.append(float(row["move_ms"]) / 1000)
+
+                for key, (times, durations) in block.items():
+                    old_times, old_durations = moves.get(key, (np.empty(0), np.empty(0)))
+                    moves[key] = (np.concatenate([old_times, times]), np.concatenate([old_durations, durations]))
+
+    return moves, outcomes
+
+
+def cycle_times(moves):
+    """
+    :return: Dict (bus, node) -> cycle times in seconds, from the most frequent move of the node
+    """
+    cycles = {}
+    for (bus, node, name), (times, _) in moves.items():
+        if len(times) > len(cycles.get((bus, node), (None, []))[1]):
+            cycles[(bus, node)] = (name, times)
+
+    # The log time restarts with every run, negative differences are between runs
+    return {key: np.diff(times)[np.diff(times) > 0] for key, (_, times) in cycles.items()}
+
+
+def _median(values):
+    values = values[~np.isnan(values)]
+    return np.median(values) if len(values) else np.nan
+
+
+def step_table(steps):
+    lines = ["{0:>6} {1:>7} {2:>8} {3:>10} {4:>10} {5:>10} {6:>10} {7:>9} {8:>9} {9:>7}".format(
+        "finger", "steps", "reached", "resp(ms)", "p95(ms)", "overshoot", "max over", "error", "current", "force")]
+    for finger in range(NUM_FINGERS):
+        s = steps[steps["finger"] == finger]
+        if len(s) == 0:
+            continue
+        response = s["response"][~np.isnan(s["response"])]
+        lines.append("{0:>6} {1:>7} {2:>7.1%} {3:>10.0f} {4:>10.0f} {5:>9.1%} {6:>9.1%} {7:>9.0f} {8:>9.0f} {9:>7.0f}".format(
+            finger, len(s), len(response) / len(s),
+            np.median(response) * 1000 if len(response) else np.nan,
+            np.percentile(response, 95) * 1000 if len(response) else np.nan,
+            np.median(s["overshoot"]), s["overshoot"].max(), np.median(s["error"]),
+            s["current"].max(), np.nanmax(s["force"]) if finger < NUM_FORCES else np.nan))
+    return "\n".join(lines)
+
+
+def daily_trends(steps, peaks):
+    """
+    :return: Sorted days, and per finger arrays over the days of median response time,
+             median overshoot, median steady state error, peak current
+    """
+    days = sorted(set(day_numbers(steps["time"])) | set(peaks))
+    step_days = day_numbers(steps["time"])
+    trends = {}
+    for finger in range(NUM_FINGERS):
+        rows = steps["finger"] == finger
+        response = []
+        overshoot = []
+        error = []
+        for day in days:
+            s = steps[rows & (step_days == day)]
+            response.append(_median(s["response"]))
+            overshoot.append(_median(s["overshoot"]))
+            error.append(_median(s["error"]))
+        current = [peaks[day][0][finger] if day in peaks else np.nan for day in days]
+        trends[finger] = tuple(np.array(values, dtype=np.float64) for values in (response, overshoot, error, current))
+    return days, trends
+
+
+def _slope(days, values):
+    """
+    :return: Change per day of a least squares line, NaN with less than two days
+    """
+    valid = ~np.isnan(values)
+    if valid.sum() < 2:
+        return np.nan
+    return np.polyfit(np.asarray(days, dtype=np.float64)[valid], values[valid], 1)[0]
+
+
+def trend_table(days, trends):
+    lines = ["{0:<10} {1:>6} {2:>10} {3:>10} {4:>9} {5:>9}".format(
+        "day", "finger", "resp(ms)", "overshoot", "error", "current")]
+    for day_index, day in enumerate(days):
+        for finger, (response, overshoot, error, current) in trends.items():
+            if np.isnan(response[day_index]) and np.isnan(current[day_index]):
+                continue
+            lines.append("{0:<10} {1:>6} {2:>10.0f} {3:>9.1%} {4:>9.0f} {5:>9.0f}".format(
+                day_name(day), finger, response[day_index] * 1000, overshoot[day_index], error[day_index],
+                current[day_index]))
+
+    if len(days) > 1:
+        lines.append("")
+        lines.append("{0:<10} {1:>6} {2:>10} {3:>10}".format("per day", "finger", "resp(ms)", "current"))
+        for finger, (response, _, _, current) in trends.items():
+            lines.append("{0:<10} {1:>6} {2:>+10.1f} {3:>+10.1f}".format(
+                "", finger, _slope(days, response) * 1000, _slope(days, current)))
+    return "\n".join(lines)
+
+
+def move_table(moves, outcomes):
+    lines = ["{0:<14} {1:>4} {2:<16} {3:>8} {4:>9} {5:>9} {6:>9}".format(
+        "bus", "node", "move", "count", "p50(s)", "p95(s)", "max(s)")]
+    for (bus, node, name), (_, durations) in sorted(moves.items()):
+        lines.append("{0:<14} {1:>4} {2:<16} {3:>8} {4:>9.3f} {5:>9.3f} {6:>9.3f}".format(
+            bus, node, name, len(durations), np.median(durations), np.percentile(durations, 95), durations.max()))
+
+    failed = [(key, counts) for key, counts in sorted(outcomes.items()) if set(counts) - {"reached"}]
+    if failed:
+        lines.append("")
+        lines.append("{0:<14} {1:>4} {2:>6} {3:>8} {4:>8} {5:>8}".format(
+            "bus", "node", "finger", "reached", "stalled", "timeout"))
+        for (bus, node, finger), counts in failed:
+            lines.append("{0:<14} {1:>4} {2:>6} {3:>8} {4:>8} {5:>8}".format(
+                bus, node, finger, counts.get("reached", 0), counts.get("stalled", 0), counts.get("timeout", 0)))
+    return "\n".join(lines)
+
+
+def cycle_table(cycles):
+    lines = ["{0:<14} {1:>4} {2:>8} {3:>9} {4:>9} {5:>9} {6:>9} {7:>9}".format(
+        "bus", "node", "cycles", "mean(s)", "p50(s)", "p95(s)", "max(s)", "loops/h")]
+    for (bus, node), c in sorted(cycles.items()):
+        if len(c) == 0:
+            continue
+        lines.append("{0:<14} {1:>4} {2:>8} {3:>9.3f} {4:>9.3f} {5:>9.3f} {6:>9.3f} {7:>9.0f}".format(
+            bus, node, len(c), c.mean(), np.median(c), np.percentile(c, 95), c.max(), 3600 / c.mean()))
+    return "\n".join(lines)
+
+
+def plot(directory, steps, days, trends, cycles):
+    """
+    Save plots as PNG files, needs matplotlib.
+    """
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("Plots need matplotlib: pip install matplotlib")
+        return
+
+    os.makedirs(directory, exist_ok=True)
+
+    if len(steps):
+        fig, axes = plt.subplots(1, 2, figsize=(12, 4))
+        for finger in range(NUM_FINGERS):
+            s = steps[steps["finger"] == finger]
+            response = s["response"][~np.isnan(s["response"])] * 1000
+            if len(response):
+                axes[0].hist(response, bins=50, histtype="step", label="finger {0}".format(finger))
+                axes[1].hist(s["overshoot"] * 100, bins=50, histtype="step", label="finger {0}".format(finger))
+        axes[0].set_xlabel("step response time (ms)")
+        axes[1].set_xlabel("overshoot (%)")
+        axes[0].legend()
+        fig.tight_layout()
+        fig.savefig(os.path.join(directory, "steps.png"))
+        plt.close(fig)
+
+    if len(days) > 1:
+        fig, axes = plt.subplots(2, 1, figsize=(10, 6), sharex=True)
+        x = [np.datetime64(int(day), "D") for day in days]
+        for finger, (response, _, _, current) in trends.items():
+            axes[0].plot(x, response * 1000, marker="o", label="finger {0}".format(finger))
+            axes[1].plot(x, current, marker="o")
+        axes[0].set_ylabel("median response (ms)")
+        axes[1].set_ylabel("peak current")
+        axes[0].legend()
+        fig.autofmt_xdate()
+        fig.tight_layout()
+        fig.savefig(os.path.join(directory, "trends.png"))
+        plt.close(fig)
+
+    if any(len(c) for c in cycles.values()):
+        fig, ax = plt.subplots(figsize=(8, 4))
+        for (bus, node), c in sorted(cycles.items()):
+            if len(c):
+                ax.hist(c, bins=50, histtype="step", label="{0}:{1}".format(bus, node))
+        ax.set_xlabel("cycle time (s)")
+        ax.legend()
+        fig.tight_layout()
+        fig.savefig(os.path.join(directory, "cycles.png"))
+        plt.close(fig)
+
+    print("Plots saved to", directory)
+
+
+def parse_time(text):
+    """
+    :param text: time.time() value or ISO date and time, e.g. "2024-05-01 08:00"
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze loop test telemetry files and move logs")
+    parser.add_argument("--telemetry", nargs="+", default=[], metavar="FILE", help="telemetry files of TelemetryWriter")
+    parser.add_argument("--moves", nargs="+", default=[], metavar="FILE", help="move logs of MOVE_LOG_FILE")
+    parser.add_argument("--start", type=parse_time, help="start of the analyzed telemetry, time.time() or ISO time")
+    parser.add_argument("--end", type=parse_time, help="end of the analyzed telemetry, time.time() or ISO time")
+    parser.add_argument("--plot", metavar="DIR", help="save plots to this directory, needs matplotlib")
+    args = parser.parse_args()
+
+    if not args.telemetry and not args.moves:
+        parser.print_help()
+        exit(-1)
+
+    steps = np.empty(0, dtype=STEP_DTYPE)
+    days, trends = [], {}
+    if args.telemetry:
+        steps, peaks, samples = analyze_telemetry(args.telemetry, args.start, args.end)
+        print("{0} samples, {1} steps".format(samples, len(steps)))
+        print()
+        print(step_table(steps))
+        print()
+        days, trends = daily_trends(steps, peaks)
+        print(trend_table(days, trends))
+        print()
+
+    cycles = {}
+    if args.moves:
+        moves, outcomes = read_moves(args.moves)
+        cycles = cycle_times(moves)
+        print(cycle_table(cycles))
+        print()
+        print(move_table(moves, outcomes))
+
+    if args.plot:
+        plot(args.plot, steps, days, trends, cycles)
+
+
+if __name__ == "__main__":
+    main()
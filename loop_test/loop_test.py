@@ -8,27 +8,126 @@ import time
 
 from pymodbus import FramerType
 from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusException
 from serial.tools import list_ports
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from common.roh_registers_v1 import *
+from modbus_bus import ModbusBus
+from motion import STALLED, TIMEOUT, MotionExecutor, MoveLog, MoveStats
+from telemetry import TelemetryRecorder, TelemetryWriter
+from trajectory import TrajectoryPlayer, load_waypoints, sine_sweep, through_poses
 
 # ROHand configuration
 NODE_ID = [2] # Support multiple nodes
 WITH_LODE = False # Choose with load or without load
-TIME_DELAY = 1.5
+
+# Serial port and device addresses of the hands on it, one entry per adapter, e.g. {"COM3": [2, 3], "COM4": [2]}.
+# None to use the first CH340 or USB port with the nodes in NODE_ID.
+BUSES = None
+MAX_ERRORS = 10 # Consecutive communication errors after which a node is given up
+ERROR_DELAY = 1.0 # seconds before a node retries after a communication error
+STATUS_INTERVAL = 60 # seconds between two printed test status tables
+
+# Motion completion
+POS_TOLERANCE = 1000 # A finger within this distance of its target has arrived
+POLL_INTERVAL = 0.02 # seconds between reads of finger positions and status
+STALL_TIME = 0.3 # seconds without progress after which a finger counts as stalled
+MOVE_TIMEOUT = 3.0 # seconds after which a move is given up and reported
+MOVE_LOG_FILE = None # CSV file with per-finger completion times, e.g. "moves.csv"
+
+# Telemetry recording
+TELEMETRY_FILE = None # File per node, formatted with the node ID and bus index, e.g. "telemetry_{1}_{0}.bin"
+TELEMETRY_RATE = 20 # samples per second
+TELEMETRY_COMPRESS = True # False to store raw columns, which the reader memory-maps
+
+# Trajectory playback instead of step moves
+TRAJECTORY = None # "min_jerk" or "trapezoid" through the targets of the moves, "sine" sweep, or a waypoint CSV file
+TRAJECTORY_RATE = 50 # samples per second
+SEGMENT_TIME = 1.0 # seconds per move of "min_jerk" and "trapezoid"
+SWEEP_FINGERS = [1, 2, 3, 4] # fingers moved by "sine"
+SWEEP_FREQUENCY = (0.2, 2.0) # start and end frequency of "sine" in Hz
+SWEEP_TIME = 20.0 # seconds of "sine"
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
+# Name, first finger and targets of the moves of one loop
+MOVES_WITHOUT_LOAD = [
+    # Close thumb then spread
+    ("close thumb", 0, [65535]),
+    ("open thumb", 0, [0]),
+    # Rotate thumb root
+    ("rotate thumb", 5, [65535]),
+    ("unrotate thumb", 5, [0]),
+    # Close other fingers then spread
+    ("close fingers", 1, [65535, 65535, 65535, 65535]),
+    ("open fingers", 1, [0, 0, 0, 0]),
+]
+
+MOVES_WITH_LOAD = [
+    # Close fingers then spread
+    ("close fingers", 0, [65535, 65535, 65535, 65535, 65535]),
+    ("open fingers", 0, [0, 0, 0, 0, 0]),
+]
+
+
+def start_pose():
+    """
+    :return: Finger positions at the start of a loop
+    """
+    # Thumb root rotated to opposite with load
+    return [0, 0, 0, 0, 0, 65535 if WITH_LODE else 0]
+
+
+def build_trajectory(moves):
+    """
+    :param moves: Step moves of a loop, followed by "min_jerk" and "trapezoid"
+    :return: Trajectory of a loop from TRAJECTORY
+    """
+    if TRAJECTORY in ("min_jerk", "trapezoid"):
+        poses = [start_pose()]
+        for _, first_finger, targets in moves:
+            pose = list(poses[-1])
+            pose[first_finger:first_finger + len(targets)] = targets
+            poses.append(pose)
+        return through_poses(poses, SEGMENT_TIME, TRAJECTORY_RATE, TRAJECTORY)
+
+    if TRAJECTORY == "sine":
+        return sine_sweep(SWEEP_FINGERS, SWEEP_FREQUENCY[0], SWEEP_FREQUENCY[1], SWEEP_TIME, TRAJECTORY_RATE,
+                          rest=start_pose())
+
+    return load_waypoints(TRAJECTORY, TRAJECTORY_RATE)
+
+
+class NodeTest:
+    """
+    Loop test of one node, independent of the other nodes.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.player = TrajectoryPlayer(executor.bus, executor.node_id)
+        self.label = "{0}:{1}".format(executor.bus.name, executor.node_id)
+        self.cycles = 0
+        self.passed = 0
+        self.failed = 0
+        self.errors = 0  # Communication errors
+        self.skipped = 0  # Trajectory samples skipped because they were late
+        self.given_up = False
+
 
 class Application:
 
     def __init__(self):
         signal.signal(signal.SIGINT, lambda signal, frame: self._signal_handler())
         self.terminated = False
+        self.stats = MoveStats()
+        self.move_log = None
+        # Outcomes failing a cycle, fingers stop at the object when loaded
+        self.failed_outcomes = (TIMEOUT,) if WITH_LODE else (TIMEOUT, STALLED)
+        self.moves = MOVES_WITH_LOAD if WITH_LODE else MOVES_WITHOUT_LOAD
+        self.trajectory = None if TRAJECTORY is None else build_trajectory(self.moves)
 
     def _signal_handler(self):
         print("You pressed ctrl-c, exit")
@@ -46,116 +145,185 @@ class Application:
                 return port.device
         return None
 
-    def write_registers(self, client, address, values):
-        """
-        Write data to Modbus device.
-        :param client: Modbus client instance
-        :param address: Register address
-        :param values: Data to be written
-        :return: True if successful, False otherwise
-        """
-        for i in range(len(NODE_ID)):
-            try:
-                resp = client.write_registers(address, values, NODE_ID[i])
-                if resp.isError():
-                    print("client.write_registers() returned", resp)
-                    return False
-            except ModbusException as e:
-                print("ModbusException:{0}".format(e))
-                return False
-        return True
+    def open_buses(self):
+        """
+        Connect to every serial port.
+        :return: List of (ModbusBus, node IDs), None if a port fails to connect
+        """
+        buses = BUSES
+        if buses is None:
+            buses = {self.find_comport("CH340") or self.find_comport("USB"): NODE_ID}
 
-    def read_registers(self, client, address, count, node_id):
-        """
-        Read data from Modbus device.
-        :param client: Modbus client instance
-        :param address: Register address
-        :param count: Register count to be read
-        :return: List of registers if successful, None otherwise
-        """
-        try:
-            resp = client.read_holding_registers(address, count, node_id)
-            if resp.isError():
-                return None    
-            return resp.registers
-        except ModbusException as e:
-            print("ModbusException:{0}".format(e))
+        opened = []
+        for port, node_ids in buses.items():
+            client = ModbusSerialClient(port, FramerType.RTU, 115200)
+            if not client.connect():
+                print("Failed to connect Modbus device on {0}".format(port))
+                for bus, _ in opened:
+                    bus.close()
+                return None
+            opened.append((ModbusBus(client, str(port)), node_ids))
+        return opened
+
+    async def move(self, node, name, first_finger, targets):
+        """
+        Move the fingers of a node and wait until they finish.
+        :return: MoveResult, None on communication error
+        """
+        result = await node.executor.move(name, first_finger, targets)
+        if result is None:
             return None
-        
-    def loop_without_load(self, client):
-            #
-            # Close thumb then spread
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET0, [65535]):
-                return False
-            time.sleep(TIME_DELAY)
-
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET0, [0]):
-                return False
-            time.sleep(TIME_DELAY)
-
-            #
-            # Rotate thumb root
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET5, [65535]):
-                return False
-            time.sleep(TIME_DELAY)
-
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET5, [0]):
-                return False
-            time.sleep(TIME_DELAY)
-
-            #
-            # Close other fingers then spread
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET1, [65535, 65535, 65535, 65535]):
-                return False
-            time.sleep(TIME_DELAY)
-
-            if not self.write_registers(client, ROH_FINGER_POS_TARGET1, [0, 0, 0, 0]):
-                return False
-            time.sleep(TIME_DELAY)
-      
-            return True
-    
-    def loop_with_load(self, client):
-        #
-        # Close other fingers then spread
-        if not self.write_registers(client, ROH_FINGER_POS_TARGET0, [65535, 65535, 65535, 65535, 65535]):
-            return False
-        time.sleep(TIME_DELAY)
-            
-        if not self.write_registers(client, ROH_FINGER_POS_TARGET0, [0, 0, 0, 0, 0]):
-            return False
-        time.sleep(TIME_DELAY)
-        
-        return True
 
-    async def main(self):
-        client = ModbusSerialClient(self.find_comport("CH340") or self.find_comport("USB"), FramerType.RTU, 115200)
-        if not client.connect():
-            print("Failed to connect Modbus device")
-            exit(-1)
+        self.stats.add(result)
+        if self.move_log is not None:
+            self.move_log.write(result, first_finger)
+        for i, outcome in enumerate(result.outcomes):
+            if outcome in self.failed_outcomes:
+                print("Node {0} {1}: finger {2} {3} at position {4}".format(
+                    node.label, name, first_finger + i, outcome, result.positions[i]))
+        return result
+
+    async def play(self, node):
+        """
+        Play the trajectory and wait until the fingers reach its end.
+        :return: True if all fingers reached the end, None on communication error
+        """
+        played = await node.player.play(self.trajectory)
+        if played is None:
+            return None
+        node.skipped += played[1]
+
+        result = await self.move(node, "trajectory end", 0, self.trajectory.positions[-1].tolist())
+        if result is None:
+            return None
+        return not any(outcome in self.failed_outcomes for outcome in result.outcomes)
+
+    async def loop(self, node):
+        """
+        Run the moves of one loop, or play the trajectory.
+        :return: True if all fingers finished every move, None on communication error
+        """
+        if self.trajectory is not None:
+            return await self.play(node)
+
+        passed = True
+        for name, first_finger, targets in self.moves:
+            result = await self.move(node, name, first_finger, targets)
+            if result is None:
+                return None
+            passed &= not any(outcome in self.failed_outcomes for outcome in result.outcomes)
+        return passed
 
+    async def prepare(self, node):
+        """
+        Move a node to the start position of the loop.
+        :return: False on communication error
+        """
         # Open all fingers
-        self.write_registers(client, ROH_FINGER_POS_TARGET0, [0, 0, 0, 0, 0, 0])
-        time.sleep(TIME_DELAY)
+        if await self.move(node, "open all", 0, [0, 0, 0, 0, 0, 0]) is None:
+            return False
 
         if WITH_LODE:
             # Rotate thumb root to opposite
-            self.write_registers(client, ROH_FINGER_POS_TARGET5, [65535])
-            time.sleep(TIME_DELAY)
+            return await self.move(node, "rotate thumb", 5, [65535]) is not None
+        return True
 
-        loop_time = 0
+    async def run_node(self, node):
+        """
+        Loop test of one node until terminated or too many communication errors.
+        """
+        errors = 0  # Consecutive communication errors
+        ready = False
 
         while not self.terminated:
-            
-            if WITH_LODE:
-                if not self.loop_with_load(client):
-                    break
+            if not ready:
+                ready = await self.prepare(node)
+                if ready:
+                    continue
             else:
-                if not self.loop_without_load(client):
-                    break
+                passed = await self.loop(node)
+                if passed is not None:
+                    errors = 0
+                    node.cycles += 1
+                    if passed:
+                        node.passed += 1
+                    else:
+                        node.failed += 1
+                    print("Node {0} loop executed: {1}, {2}".format(node.label, node.cycles, "passed" if passed else "failed"))
+                    continue
+                ready = False
+
+            # Communication error, start over from the start position
+            node.errors += 1
+            errors += 1
+            if errors >= MAX_ERRORS:
+                print("Node {0}: {1} communication errors in a row, given up".format(node.label, errors))
+                node.given_up = True
+                return
+            await asyncio.sleep(ERROR_DELAY)
+
+    def status(self, nodes, elapsed):
+        """
+        :return: Table of cycle counts per node and the total throughput
+        """
+        lines = ["{0:<20} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}".format(
+            "node", "cycles", "passed", "failed", "errors", "skipped")]
+        for node in nodes:
+            lines.append("{0:<20} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}{6}".format(
+                node.label, node.cycles, node.passed, node.failed, node.errors, node.skipped,
+                " given up" if node.given_up else ""))
+        cycles = sum(node.cycles for node in nodes)
+        lines.append("{0} loops in {1:.1f}s, {2:.0f} loops/h".format(cycles, elapsed, cycles * 3600 / max(elapsed, 1e-6)))
+        return "\n".join(lines)
+
+    async def main(self):
+        buses = self.open_buses()
+        if buses is None:
+            exit(-1)
+
+        nodes = [
+            NodeTest(MotionExecutor(bus, node_id, POS_TOLERANCE, POLL_INTERVAL, STALL_TIME, MOVE_TIMEOUT))
+            for bus, node_ids in buses for node_id in node_ids
+        ]
+        if MOVE_LOG_FILE is not None:
+            self.move_log = MoveLog(MOVE_LOG_FILE)
+
+        recorders = []
+        if TELEMETRY_FILE is not None:
+            for bus_index, (bus, node_ids) in enumerate(buses):
+                for node_id in node_ids:
+                    writer = TelemetryWriter(TELEMETRY_FILE.format(node_id, bus_index), TELEMETRY_COMPRESS, node_id=node_id)
+                    recorders.append(TelemetryRecorder(bus, node_id, writer, TELEMETRY_RATE))
+        recorder_tasks = [asyncio.create_task(recorder.run()) for recorder in recorders]
+
+        start_time = time.perf_counter()
+        node_tasks = [asyncio.create_task(self.run_node(node)) for node in nodes]
+        next_status = start_time + STATUS_INTERVAL
+        while not all(task.done() for task in node_tasks):
+            await asyncio.wait(node_tasks, timeout=0.5)
+            now = time.perf_counter()
+            if now >= next_status:
+                next_status = now + STATUS_INTERVAL
+                print(self.status(nodes, now - start_time))
+        for task in node_tasks:
+            task.result()
+
+        print(self.status(nodes, time.perf_counter() - start_time))
+        print(self.stats.summary())
+
+        for recorder, task in zip(recorders, recorder_tasks):
+            recorder.stop()
+            await task
+            recorder.writer.close()
+            print("Node {0}:{1} telemetry: {2} samples, {3} ticks skipped".format(
+                recorder.bus.name, recorder.node_id, recorder.samples, recorder.skipped))
 
-            loop_time += 1
-            print("Loop executed:", loop_time)
+        if self.move_log is not None:
+            self.move_log.close()
+        for bus, _ in buses:
+            if recorders:
+                print("Bus {0}: {1}".format(bus.name, bus.delay_summary()))
+            bus.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+# Asyncio access to a Modbus serial port
+#
+# pymodbus serial calls block until the device answers. They run in a single worker
+# thread per port, so requests on one bus never overlap and the event loop keeps
+# running while a request is on the wire. Low priority reads such as telemetry use
+# try_read(), which gives up instead of queuing behind commands. Low priority reads
+# don't count as busy for each other, so several of them share the idle time.
+#
+# A command issued while a low priority read is on the wire still waits for it, the
+# time such commands wait is recorded to show how much telemetry delays them.
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymodbus.exceptions import ModbusException
+
+
+class ModbusBus:
+    def __init__(self, client, name=""):
+        """
+        :param client: Connected ModbusSerialClient
+        :param name: Name of the bus used in messages, e.g. the port
+        """
+        self.client = client
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="modbus")
+        self._pending = 0  # Requests queued or on the wire, except low priority reads
+        self._low_priority = 0  # Low priority reads queued or on the wire
+        self.delayed_commands = 0  # Commands issued while a low priority read was on the wire
+        self.command_delay_total = 0.0  # Seconds these commands waited
+        self.command_delay_max = 0.0
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    async def _run(self, func, *args, low_priority=False):
+        if low_priority:
+            self._low_priority += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+            finally:
+                self._low_priority -= 1
+
+        delayed = self._low_priority > 0
+        issued = time.perf_counter()
+        started = []
+
+        def timed(*args):
+            started.append(time.perf_counter())
+            return func(*args)
+
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed, *args)
+        finally:
+            self._pending -= 1
+            if delayed and started:
+                delay = started[0] - issued
+                self.delayed_commands += 1
+                self.command_delay_total += delay
+                self.command_delay_max = max(self.command_delay_max, delay)
+
+    def _write(self, address, values, node_id):
+        try:
+            resp = self.client.write_registers(address, values, node_id)
+            if resp.isError():
+                print("client.write_registers() returned", resp)
+                return False
+        except ModbusException as e:
+            print("ModbusException:{0}".format(e))
+            return False
+        return True
+
+    def _read(self, address, count, node_id):
+        try:
+            resp = self.client.read_holding_registers(address, count, node_id)
+            if resp.isError():
+                return None
+            return resp.registers
+        except ModbusException as e:
+            print("ModbusException:{0}".format(e))
+            return None
+
+    async def write(self, address, values, node_id):
+        """
+        Write data to Modbus device.
+        :param address: Register address
+        :param values: Data to be written
+        :param node_id: Device address
+        :return: True if successful, False otherwise
+        """
+        return await self._run(self._write, address, values, node_id)
+
+    async def read(self, address, count, node_id):
+        """
+        Read data from Modbus device.
+        :param address: Register address
+        :param count: Register count to be read
+        :param node_id: Device address
+        :return: List of registers if successful, None otherwise
+        """
+        return await self._run(self._read, address, count, node_id)
+
+    async def try_read(self, address, count, node_id):
+        """
+        Low priority read from Modbus device, only if no command is pending.
+        :return: List of registers if successful, None if the bus is busy or on error
+        """
+        if self.busy:
+            return None
+        return await self._run(self._read, address, count, node_id, low_priority=True)
+
+    def delay_summary(self):
+        """
+        :return: How much commands were delayed by low priority reads
+        """
+        if self.delayed_commands == 0:
+            return "no commands delayed by low priority reads"
+        return "{0} commands delayed by low priority reads, mean {1:.1f}ms, max {2:.1f}ms".format(
+            self.delayed_commands, self.command_delay_total / self.delayed_commands * 1000, self.command_delay_max * 1000)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.client.close()
@@ -0,0 +1,168 @@
+# Completion-triggered finger moves
+#
+# A move writes the targets of some fingers and then polls their positions and status
+# until every finger is within tolerance of its target or has stalled, so the next move
+# starts as soon as the hand got there instead of after a fixed delay. Fingers that
+# don't finish before the timeout are reported, which catches slow fingers.
+
+import asyncio
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.roh_registers_v1 import ROH_FINGER_POS0, ROH_FINGER_POS_TARGET0, ROH_FINGER_STATUS0
+
+# Values of ROH_FINGER_STATUS*
+STATUS_OPENING = 0
+STATUS_CLOSING = 1
+STATUS_POS_REACHED = 2
+STATUS_OVER_CURRENT = 3
+STATUS_FORCE_REACHED = 4
+STATUS_STUCK = 5
+
+# Statuses of a finger that stopped before its target
+STOP_STATUS = (STATUS_OVER_CURRENT, STATUS_FORCE_REACHED, STATUS_STUCK)
+
+# Seconds after the write before a stop status is trusted, the status of the previous move may still be reported
+STATUS_SETTLE = 0.1
+
+# Outcome of a finger
+REACHED = "reached"
+STALLED = "stalled"
+TIMEOUT = "timeout"
+
+# name: name of the move
+# bus: name of the bus
+# node_id: device address
+# duration: seconds from the write until all fingers finished or the timeout
+# outcomes: REACHED, STALLED or TIMEOUT per finger
+# finger_times: seconds until each finger finished, None on timeout
+# positions: last read position per finger
+MoveResult = namedtuple("MoveResult", ["name", "bus", "node_id", "duration", "outcomes", "finger_times", "positions"])
+
+
+class MotionExecutor:
+    def __init__(self, bus, node_id, tolerance=1000, poll_interval=0.02, stall_time=0.3, timeout=3.0):
+        """
+        :param bus: ModbusBus of the device
+        :param node_id: Device address
+        :param tolerance: Distance to the target a finger counts as arrived at, and the smallest movement
+                          counted as progress
+        :param poll_interval: Seconds between two polls
+        :param stall_time: Seconds without progress after which a finger counts as stalled
+        :param timeout: Seconds after which a move is given up
+        """
+        self.bus = bus
+        self.node_id = node_id
+        self.tolerance = tolerance
+        self.poll_interval = poll_interval
+        self.stall_time = stall_time
+        self.timeout = timeout
+
+    async def move(self, name, first_finger, targets):
+        """
+        Move fingers and wait until they finish.
+        :param name: Name of the move used in reports
+        :param first_finger: Index of the first finger, 0 for the thumb
+        :param targets: Target positions of the consecutive fingers starting at first_finger
+        :return: MoveResult, None on communication error
+        """
+        count = len(targets)
+        start = time.perf_counter()
+        if not await self.bus.write(ROH_FINGER_POS_TARGET0 + first_finger, targets, self.node_id):
+            return None
+
+        outcomes = [None] * count
+        finger_times = [None] * count
+        positions = [None] * count
+        progress_pos = [None] * count  # Position at the last progress
+        progress_time = [start] * count
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            status = await self.bus.read(ROH_FINGER_STATUS0 + first_finger, count, self.node_id)
+            pos = await self.bus.read(ROH_FINGER_POS0 + first_finger, count, self.node_id)
+            if status is None or pos is None:
+                return None
+
+            now = time.perf_counter()
+            elapsed = now - start
+            for i in range(count):
+                if outcomes[i] is not None:
+                    continue
+                positions[i] = pos[i]
+
+                if abs(pos[i] - targets[i]) <= self.tolerance:
+                    outcomes[i] = REACHED
+                elif elapsed >= STATUS_SETTLE and status[i] in STOP_STATUS:
+                    outcomes[i] = STALLED
+                elif progress_pos[i] is None or abs(pos[i] - progress_pos[i]) > self.tolerance:
+                    progress_pos[i] = pos[i]
+                    progress_time[i] = now
+                elif now - progress_time[i] >= self.stall_time:
+                    outcomes[i] = STALLED
+
+                if outcomes[i] is not None:
+                    finger_times[i] = elapsed
+
+            if None not in outcomes:
+                break
+            if elapsed >= self.timeout:
+                outcomes = [TIMEOUT if outcome is None else outcome for outcome in outcomes]
+                break
+
+        return MoveResult(name, self.bus.name, self.node_id, elapsed, outcomes, finger_times, positions)
+
+
+class MoveStats:
+    """
+    Duration statistics per bus, node and move.
+    """
+
+    def __init__(self):
+        self._durations = {}  # (bus, node_id, name) -> list of durations
+        self._timeouts = {}  # (bus, node_id, name) -> number of moves with a finger timed out
+
+    def add(self, result):
+        key = (result.bus, result.node_id, result.name)
+        self._durations.setdefault(key, []).append(result.duration)
+        self._timeouts[key] = self._timeouts.get(key, 0) + (TIMEOUT in result.outcomes)
+
+    def summary(self):
+        """
+        :return: Table of count, mean, p95 and max duration and timeouts per bus, node and move
+        """
+        lines = ["{0:<14} {1:>4} {2:<16} {3:>8} {4:>9} {5:>9} {6:>9} {7:>8}".format(
+            "bus", "node", "move", "count", "mean(s)", "p95(s)", "max(s)", "timeout")]
+        for key, durations in self._durations.items():
+            bus, node_id, name = key
+            d = np.array(durations)
+            lines.append("{0:<14} {1:>4} {2:<16} {3:>8} {4:>9.3f} {5:>9.3f} {6:>9.3f} {7:>8}".format(
+                bus, node_id, name, len(d), d.mean(), np.percentile(d, 95), d.max(), self._timeouts[key]))
+        return "\n".join(lines)
+
+
+class MoveLog:
+    """
+    CSV file with one row per finger and move.
+    """
+
+    def __init__(self, path):
+        self._start_time = time.perf_counter()
+        self._file = open(path, "w")
+        self._file.write("time_s,bus,node,move,finger,outcome,finger_ms,move_ms,position\n")
+
+    def write(self, result, first_finger=0):
+        elapsed = time.perf_counter() - self._start_time
+        for i, (outcome, finger_time, position) in enumerate(zip(result.outcomes, result.finger_times, result.positions)):
+            self._file.write("{0:.3f},{1},{2},{3},{4},{5},{6},{7:.1f},{8}\n".format(
+                elapsed, result.bus, result.node_id, result.name, first_finger + i, outcome,
+                "" if finger_time is None else "{0:.1f}".format(finger_time * 1000), result.duration * 1000, position))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
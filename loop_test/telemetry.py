@@ -0,0 +1,315 @@
+# Telemetry recording of ROHand for long endurance runs
+#
+# A recorder reads finger status, current, force, target and position of one node at a
+# fixed rate, one short read per group. It only reads while the bus is idle and checks
+# again before every group, so a command issued during a sample waits for one group
+# read at most, not for all of them. A tick is skipped if the bus doesn't become idle
+# before the next tick is due.
+#
+# Samples go to an append-only columnar file made of chunks. Every column of a chunk is
+# stored on its own, compressed with zlib or raw, so a reader decompresses only the
+# columns it needs. A sidecar index file holds offset, row count and time range of every
+# chunk, so a time slice is found without scanning the data file. A chunk is written
+# before its index entry, a crash loses at most the rows not yet flushed.
+#
+# Data file: header, then chunks
+#   header: MAGIC, uint32 length of the JSON description, JSON description
+#   chunk:  CHUNK_MAGIC, uint32 rows, uint32 stored size per column, column data
+# Index file: one INDEX_DTYPE record per chunk
+
+import asyncio
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.roh_registers_v1 import (
+    ROH_FINGER_CURRENT0,
+    ROH_FINGER_FORCE0,
+    ROH_FINGER_POS0,
+    ROH_FINGER_POS_TARGET0,
+    ROH_FINGER_STATUS0,
+)
+
+MAGIC = b"ROHTLM1\n"
+CHUNK_MAGIC = b"CHNK"
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("rows", "<u4"), ("t_first", "<f8"), ("t_last", "<f8")])
+
+# Group, first register and count of the recorded registers
+GROUPS = [
+    ("status", ROH_FINGER_STATUS0, 6),
+    ("current", ROH_FINGER_CURRENT0, 6),
+    ("force", ROH_FINGER_FORCE0, 5),
+    ("target", ROH_FINGER_POS_TARGET0, 6),
+    ("pos", ROH_FINGER_POS0, 6),
+]
+
+NUM_COLUMNS = sum(count for _, _, count in GROUPS)
+
+
+class TelemetryWriter:
+    def __init__(self, path, compress=True, chunk_rows=1200, node_id=None):
+        """
+        Open a telemetry file for appending, created if it doesn't exist.
+        :param path: Data file, the index is written to path + ".idx"
+        :param compress: Compress the columns with zlib, raw columns can be memory-mapped by the reader
+        :param chunk_rows: Rows buffered before a chunk is written
+        :param node_id: Device address stored in the description of a new file
+        """
+        self.path = path
+        self._chunk_rows = chunk_rows
+        self._times = np.empty(chunk_rows, dtype="<f8")
+        self._values = np.empty((chunk_rows, NUM_COLUMNS), dtype="<u2")
+        self._rows = 0
+
+        groups = [[name, count] for name, _, count in GROUPS]
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.header = read_header(path)[0]
+            if self.header["groups"] != groups:
+                raise IOError("{0} has the register groups {1}, not {2}".format(path, self.header["groups"], groups))
+            self._compress = self.header["compression"] == "zlib"
+        else:
+            self._compress = compress
+            self.header = {
+                "version": 1,
+                "compression": "zlib" if compress else "none",
+                "node_id": node_id,
+                "groups": groups,
+            }
+            description = json.dumps(self.header).encode()
+            with open(path, "wb") as f:
+                f.write(MAGIC + struct.pack("<I", len(description)) + description)
+            open(path + ".idx", "wb").close()
+
+        self._file = open(path, "ab")
+        self._index = open(path + ".idx", "ab")
+
+    def append(self, t, registers):
+        """
+        :param t: time.time() of the sample
+        :param registers: Registers of all groups in GROUPS order
+        """
+        self._times[self._rows] = t
+        self._values[self._rows] = registers
+        self._rows += 1
+        if self._rows == self._chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as a chunk.
+        """
+        rows = self._rows
+        if rows == 0:
+            return
+
+        columns = [self._times[:rows].tobytes()]
+        columns += [np.ascontiguousarray(self._values[:rows, i]).tobytes() for i in range(self._values.shape[1])]
+        if self._compress:
+            columns = [zlib.compress(column, 1) for column in columns]
+
+        offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(CHUNK_MAGIC + struct.pack("<I{0}I".format(len(columns)), rows, *map(len, columns)))
+        for column in columns:
+            self._file.write(column)
+        self._file.flush()
+
+        entry = np.array([(offset, rows, self._times[0], self._times[rows - 1])], dtype=INDEX_DTYPE)
+        self._index.write(entry.tobytes())
+        self._index.flush()
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._index.close()
+
+
+def read_header(path):
+    """
+    :return: Description of a telemetry file and the offset of its first chunk
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError("{0} is not a telemetry file".format(path))
+        length, = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(length)), len(MAGIC) + 4 + length
+
+
+class TelemetryReader:
+    def __init__(self, path):
+        """
+        :param path: Data file, its index is read from path + ".idx"
+        """
+        self.path = path
+        self.header, _ = read_header(path)
+        self.groups = [(name, count) for name, count in self.header["groups"]]
+        self._num_columns = 1 + sum(count for _, count in self.groups)
+        self._compressed = self.header["compression"] == "zlib"
+        self.index = np.fromfile(path + ".idx", dtype=INDEX_DTYPE)
+
+    @property
+    def rows(self):
+        return int(self.index["rows"].sum())
+
+    def time_range(self):
+        """
+        :return: Time of the first and last sample, None if the file is empty
+        """
+        if len(self.index) == 0:
+            return None
+        return float(self.index["t_first"][0]), float(self.index["t_last"][-1])
+
+    def chunks(self, start=None, end=None):
+        """
+        :return: Index entries of the chunks overlapping the time slice
+        """
+        first = 0 if start is None else np.searchsorted(self.index["t_last"], start, side="left")
+        last = len(self.index) if end is None else np.searchsorted(self.index["t_first"], end, side="right")
+        return self.index[first:last]
+
+    def _read_chunk(self, f, entry, columns):
+        rows = int(entry["rows"])
+        f.seek(int(entry["offset"]))
+        head = f.read(len(CHUNK_MAGIC) + 4 + 4 * self._num_columns)
+        if head[:len(CHUNK_MAGIC)] != CHUNK_MAGIC:
+            raise IOError("Corrupt chunk at offset {0} of {1}".format(entry["offset"], self.path))
+        sizes = struct.unpack_from("<{0}I".format(self._num_columns), head, len(CHUNK_MAGIC) + 4)
+        base = int(entry["offset"]) + len(head)
+        offsets = np.concatenate([[0], np.cumsum(sizes)]) + base
+
+        data = []
+        for column in columns:
+            dtype = "<f8" if column == 0 else "<u2"
+            if self._compressed:
+                f.seek(offsets[column])
+                data.append(np.frombuffer(zlib.decompress(f.read(sizes[column])), dtype=dtype))
+            else:
+                data.append(np.memmap(self.path, dtype=dtype, mode="r", offset=int(offsets[column]), shape=(rows,)))
+        return data
+
+    def _columns(self, groups):
+        """
+        :return: Columns of the groups, column 0 is the time and the groups follow in file order,
+                 and the slice of every group in the columns
+        """
+        if groups is None:
+            groups = [name for name, _ in self.groups]
+
+        columns = [0]
+        group_slices = {}
+        column = 1
+        for name, count in self.groups:
+            if name in groups:
+                group_slices[name] = slice(len(columns), len(columns) + count)
+                columns += range(column, column + count)
+            column += count
+        return columns, group_slices
+
+    def _load(self, f, entries, columns, group_slices, start, end):
+        parts = [self._read_chunk(f, entry, columns) for entry in entries]
+        if parts:
+            data = [np.concatenate([part[i] for part in parts]) for i in range(len(columns))]
+        else:
+            data = [np.empty(0, dtype="<f8" if i == 0 else "<u2") for i in range(len(columns))]
+
+        t = data[0]
+        mask = np.ones(len(t), dtype=bool)
+        if start is not None:
+            mask &= t >= start
+        if end is not None:
+            mask &= t <= end
+
+        result = {"time": t[mask]}
+        for name, columns_slice in group_slices.items():
+            result[name] = np.stack(data[columns_slice], axis=1)[mask]
+        return result
+
+    def read(self, start=None, end=None, groups=None):
+        """
+        Load a time slice. Only the chunks overlapping the slice and the requested
+        columns are read.
+        :param start: time.time() of the first sample, None for the start of the file
+        :param end: time.time() of the last sample, None for the end of the file
+        :param groups: Names of the groups to load, e.g. ["pos", "target"], None for all
+        :return: Dict with "time", an array of shape (rows,), and an array of shape (rows, count) per group
+        """
+        columns, group_slices = self._columns(groups)
+        with open(self.path, "rb") as f:
+            return self._load(f, self.chunks(start, end), columns, group_slices, start, end)
+
+    def blocks(self, start=None, end=None, groups=None, chunks_per_block=64):
+        """
+        Load a time slice block by block, for files larger than memory.
+        :param chunks_per_block: Chunks loaded at once
+        :return: Iterator of dicts like read() in time order
+        """
+        columns, group_slices = self._columns(groups)
+        entries = self.chunks(start, end)
+        with open(self.path, "rb") as f:
+            for i in range(0, len(entries), chunks_per_block):
+                yield self._load(f, entries[i:i + chunks_per_block], columns, group_slices, start, end)
+
+
+class TelemetryRecorder:
+    def __init__(self, bus, node_id, writer, rate=20):
+        """
+        :param bus: ModbusBus of the device
+        :param node_id: Device address
+        :param writer: TelemetryWriter the samples are appended to
+        :param rate: Samples per second
+        """
+        self.bus = bus
+        self.node_id = node_id
+        self.writer = writer
+        self.interval = 1.0 / rate
+        self.samples = 0
+        self.skipped = 0  # Ticks skipped because the bus was busy or late
+        self._stopped = False
+
+    async def _sample(self, deadline):
+        """
+        Read all groups, yielding the bus to commands before every group.
+        :param deadline: loop.time() until which the bus may be waited for
+        :return: Registers of all groups, None if the bus stayed busy or on error
+        """
+        loop = asyncio.get_running_loop()
+        registers = []
+        for _, first, count in GROUPS:
+            while self.bus.busy and loop.time() < deadline:
+                await asyncio.sleep(0.002)
+            values = await self.bus.try_read(first, count, self.node_id)
+            if values is None:
+                return None
+            registers += values
+        return registers
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while not self._stopped:
+            t = time.time()
+            registers = await self._sample(next_time + self.interval)
+            if registers is None:
+                self.skipped += 1
+            else:
+                self.writer.append(t, registers)
+                self.samples += 1
+
+            next_time += self.interval
+            delay = next_time - loop.time()
+            if delay < 0:
+                # Late, skip the missed ticks instead of reading in a burst
+                missed = int(-delay / self.interval) + 1
+                self.skipped += missed - 1
+                next_time += missed * self.interval
+                delay = next_time - loop.time()
+            await asyncio.sleep(delay)
+
+    def stop(self):
+        self._stopped = True
@@ -0,0 +1,206 @@
+# Precomputed finger trajectories streamed to ROHand
+#
+# A trajectory is computed up front as arrays of target positions and speeds sampled at
+# a fixed rate, the player only looks up and sends samples. Every sample is a single
+# write of ROH_FINGER_SPEED0..9 and ROH_FINGER_POS_TARGET0..5, which are consecutive
+# registers, so speed and target of a tick always arrive together. Speeds of the unused
+# fingers 6..9 are written back with the values read before playing.
+#
+# The player follows the clock, not the samples: after a late tick it jumps to the
+# sample that is due now instead of sending the missed ones in a burst.
+
+import asyncio
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.roh_registers_v1 import ROH_FINGER_SPEED0
+
+NUM_FINGERS = 6
+NUM_SPEEDS = 10  # ROH_FINGER_SPEED0..9, followed by ROH_FINGER_POS_TARGET0
+
+MAX_POS = 65535
+MAX_SPEED = 65535
+FULL_SPEED_VELOCITY = 65535 / 0.5  # Approximate position units per second at MAX_SPEED, full range in about 0.5s
+SPEED_MARGIN = 1.5  # Speed headroom so a finger can keep up with the trajectory
+MIN_SPEED = 6554  # Speed of fingers standing still, lets them catch up with their target slowly
+
+
+class Trajectory:
+    def __init__(self, positions, rate):
+        """
+        :param positions: Target positions of shape (samples, NUM_FINGERS)
+        :param rate: Samples per second
+        """
+        positions = np.clip(np.rint(positions), 0, MAX_POS)
+        self.rate = rate
+        self.positions = positions.astype(np.uint16)
+
+        # Speed each finger needs to follow, from the velocity of the trajectory
+        if len(positions) > 1:
+            velocity = np.abs(np.gradient(positions, axis=0)) * rate
+        else:
+            velocity = np.zeros_like(positions)
+        speeds = velocity * (SPEED_MARGIN * MAX_SPEED / FULL_SPEED_VELOCITY)
+        self.speeds = np.clip(np.rint(speeds), MIN_SPEED, MAX_SPEED).astype(np.uint16)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def duration(self):
+        return len(self.positions) / self.rate
+
+
+def _ramp(duration, rate):
+    """
+    :return: Normalized time from 0 to 1 of the samples of a segment
+    """
+    samples = max(1, int(round(duration * rate)))
+    return np.arange(1, samples + 1) / samples
+
+
+def min_jerk(start, end, duration, rate):
+    """
+    Minimum jerk move, zero velocity and acceleration at both ends.
+    :param start: Start positions of the fingers
+    :param end: End positions of the fingers
+    :return: Positions of shape (samples, fingers), excluding the start
+    """
+    s = _ramp(duration, rate)
+    shape = s * s * s * (10 - 15 * s + 6 * s * s)
+    start = np.asarray(start, dtype=np.float64)
+    return start + np.outer(shape, np.asarray(end, dtype=np.float64) - start)
+
+
+def trapezoid(start, end, duration, rate, accel_fraction=0.25):
+    """
+    Trapezoidal velocity move, constant acceleration, cruise and deceleration.
+    :param accel_fraction: Share of the duration spent accelerating, and as much decelerating, at most 0.5
+    :return: Positions of shape (samples, fingers), excluding the start
+    """
+    s = _ramp(duration, rate)
+    a = min(max(accel_fraction, 1e-6), 0.5)
+    peak = 1 / (1 - a)  # Velocity of the cruise in normalized units
+    shape = np.where(s < a, peak * s * s / (2 * a),
+                     np.where(s <= 1 - a, peak * (s - a / 2),
+                              1 - peak * (1 - s) ** 2 / (2 * a)))
+    start = np.asarray(start, dtype=np.float64)
+    return start + np.outer(shape, np.asarray(end, dtype=np.float64) - start)
+
+
+PROFILES = {"min_jerk": min_jerk, "trapezoid": trapezoid}
+
+
+def through_poses(poses, segment_time, rate, profile="min_jerk"):
+    """
+    Move through a sequence of poses, one segment per pose.
+    :param poses: Positions of all fingers per pose, the first one is the start
+    :param segment_time: Seconds per segment
+    :param profile: "min_jerk" or "trapezoid"
+    :return: Trajectory
+    """
+    segments = [np.asarray(poses[:1], dtype=np.float64)]
+    for start, end in zip(poses[:-1], poses[1:]):
+        segments.append(PROFILES[profile](start, end, segment_time, rate))
+    return Trajectory(np.concatenate(segments), rate)
+
+
+def sine_sweep(fingers, f0, f1, duration, rate, center=MAX_POS / 2, amplitude=MAX_POS / 2 - 2000, rest=None,
+               ramp_time=1.0):
+    """
+    Sine of linearly increasing frequency, for measuring how fast the fingers follow.
+    The swept fingers first move from rest to the center with a minimum jerk ramp. The
+    duration is rounded to a whole number of cycles, so the sweep ends at the center.
+    :param fingers: Indexes of the swept fingers
+    :param f0: Start frequency in Hz
+    :param f1: End frequency in Hz
+    :param duration: Seconds of the sweep, rounded to a whole number of cycles
+    :param rest: Positions of all fingers before the sweep, all 0 if None
+    :param ramp_time: Seconds of the ramp from rest to the center
+    :return: Trajectory starting at rest
+    """
+    rest = np.zeros(NUM_FINGERS) if rest is None else np.asarray(rest, dtype=np.float64)
+    start = rest.copy()
+    start[fingers] = center
+
+    # The phase at the end is 2 pi duration (f0 + f1) / 2, whole cycles end at the center
+    mean_frequency = (f0 + f1) / 2
+    duration = max(1, round(duration * mean_frequency)) / mean_frequency
+    t = np.linspace(0, duration, max(1, int(round(duration * rate))) + 1)
+    phase = 2 * np.pi * (f0 * t + (f1 - f0) * t * t / (2 * duration))
+
+    sweep = np.tile(start, (len(t), 1))
+    sweep[:, fingers] = (center + amplitude * np.sin(phase))[:, np.newaxis]
+    # The sweep starts at the center where the ramp ends
+    return Trajectory(np.concatenate([rest[np.newaxis], min_jerk(rest, start, ramp_time, rate), sweep[1:]]), rate)
+
+
+def load_waypoints(path, rate):
+    """
+    Load waypoints from a CSV file with a header and rows of time in seconds and the
+    positions of the fingers, e.g. "time_s,pos0,pos1,pos2,pos3,pos4,pos5". Positions
+    between the waypoints are interpolated linearly.
+    :return: Trajectory
+    """
+    waypoints = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    times = waypoints[:, 0]
+    if np.any(np.diff(times) <= 0):
+        raise ValueError("Waypoint times of {0} must increase".format(path))
+    if waypoints.shape[1] != 1 + NUM_FINGERS:
+        raise ValueError("Waypoints of {0} need a time and {1} positions".format(path, NUM_FINGERS))
+
+    t = times[0] + np.arange(int((times[-1] - times[0]) * rate) + 1) / rate
+    positions = np.stack([np.interp(t, times, waypoints[:, 1 + i]) for i in range(NUM_FINGERS)], axis=1)
+    return Trajectory(positions, rate)
+
+
+class TrajectoryPlayer:
+    def __init__(self, bus, node_id):
+        """
+        :param bus: ModbusBus of the device
+        :param node_id: Device address
+        """
+        self.bus = bus
+        self.node_id = node_id
+        self._speeds = None  # Speeds read before playing
+
+    async def play(self, trajectory):
+        """
+        Stream a trajectory in real time, then restore the speeds.
+        :return: (samples sent, samples skipped, max lateness in seconds), None on communication error
+        """
+        if self._speeds is None:
+            self._speeds = await self.bus.read(ROH_FINGER_SPEED0, NUM_SPEEDS, self.node_id)
+            if self._speeds is None:
+                return None
+        kept_speeds = self._speeds[NUM_FINGERS:]
+
+        loop = asyncio.get_running_loop()
+        sent = 0
+        skipped = 0
+        lateness = 0.0
+        index = 0
+        last = len(trajectory) - 1
+        start = loop.time()
+        while True:
+            values = trajectory.speeds[index].tolist() + kept_speeds + trajectory.positions[index].tolist()
+            if not await self.bus.write(ROH_FINGER_SPEED0, values, self.node_id):
+                return None
+            sent += 1
+            if index == last:
+                break
+
+            # After a late tick continue with the sample due now, the last one is always sent
+            due = min(int((loop.time() - start) * trajectory.rate), last)
+            if due > index + 1:
+                skipped += due - index - 1
+                lateness = max(lateness, (due - index - 1) / trajectory.rate)
+            index = max(due, index + 1)
+            await asyncio.sleep(start + index / trajectory.rate - loop.time())
+
+        if not await self.bus.write(ROH_FINGER_SPEED0, self._speeds, self.node_id):
+            return None
+        return sent, skipped, lateness